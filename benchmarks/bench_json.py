@@ -0,0 +1,82 @@
+"""Compares the cost of encoding each route's response with jsonify and with `project.encoding`.
+
+    python -m benchmarks.bench_json --repeat 5
+
+Every case builds the complete flask response from data already in memory, so database time
+is left out. "jsonify" is how the routes encoded their bodies before, "std" is
+`project.encoding` with the standard library fallback and "fast" is `project.encoding` with
+orjson. Bulk routes build their bodies with `iter_object` from `balances_query` row tuples,
+and error routes use the pre-encoded `CONSTANT_ERRORS` where they can.
+"""
+import argparse
+import random
+import timeit
+from unittest import mock
+
+import numpy as np
+from flask import jsonify
+
+from project import encoding
+from project.app import create_app
+from project.encoding import encoded_response, iter_object, json_response
+from project.globals import ACCEPTED_SYMBOLS
+from project.helpers import error_payload, error_response
+from project.models import Users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5_000, help="users in the bulk responses")
+    parser.add_argument("--quotes", type=int, default=50_000, help="quotes in /quote/batch")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    rows = [
+        (i, "chase", *[rand.choice([0.0, rand.uniform(0, 100)]) for _ in ACCEPTED_SYMBOLS])
+        for i in range(args.rows)
+    ]
+    user = Users.balance_row_to_dict(rows[1])
+    auths = {"id": 1, "provider": "chase", "auths": ["BTC", "ETH"]}
+    results = [{"index": i, "status": 204} for i in range(args.rows)]
+    quotes = np.array([rand.uniform(0.0001, 1_000_000) for _ in range(args.quotes)])
+
+    def balances_many(fast: bool):
+        if not fast:
+            data = [Users.balance_row_to_dict(row) for row in rows]
+            return jsonify({"balances": data, "not_found": []})
+        body = iter_object({"not_found": []}, "balances", map(Users.balance_row_to_dict, rows))
+        return encoded_response(b"".join(body))
+
+    cases = {
+        "/balances/<id>": lambda fast: json_response(user) if fast else jsonify(user),
+        "/list/<id>": lambda fast: json_response(auths) if fast else jsonify(auths),
+        "/buy/batch": lambda fast: json_response(results) if fast else jsonify(results),
+        "/balances?ids": balances_many,
+        "/quote/batch": lambda fast: (
+            json_response({"rate_version": 1, "quotes": quotes})
+            if fast
+            else jsonify({"rate_version": 1, "quotes": quotes.tolist()})
+        ),
+        "invalid API key": lambda fast: (
+            error_response(401, "invalid API key")
+            if fast
+            else jsonify(error_payload(401, "invalid API key"))
+        ),
+    }
+
+    app = create_app(testing=True)
+    print(f"{'route':>16} {'jsonify':>12} {'std':>12} {'fast':>12}")
+    with app.test_request_context():
+        for name, build in cases.items():
+            number = max(1, 200_000 // max(len(build(True).get_data()), 1))
+            timings = []
+            for fast, orjson in [(False, encoding.orjson), (True, None), (True, encoding.orjson)]:
+                with mock.patch.object(encoding, "orjson", orjson):
+                    best = min(timeit.repeat(lambda: build(fast), number=number, repeat=args.repeat))
+                timings.append(f"{best / number * 1e6:9.1f} us")
+            print(f"{name:>16} " + " ".join(f"{t:>12}" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
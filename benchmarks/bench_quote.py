@@ -0,0 +1,61 @@
+"""Compares /quote/batch's vectorized conversion with the scalar helpers.
+
+    python -m benchmarks.bench_quote --size 50000
+
+"math" times only the conversions. "request" also includes reading the decoded JSON body
+and turning the results back into a list, which is what /quote/batch does per request.
+"binary" is the same for the packed octet-stream format.
+"""
+import argparse
+import random
+import timeit
+
+import numpy as np
+
+from project.globals import ACCEPTED_SYMBOLS
+from project.helpers import convert_to_usd
+from project.quotes import QUOTE_RECORD, quote, read_binary_quotes, read_json_quotes, symbol_codes
+from project.rates import rate_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=50_000, help="number of (symbol, amount) pairs")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    symbols = [rand.choice(ACCEPTED_SYMBOLS) for _ in range(args.size)]
+    amounts = [rand.uniform(0.0001, 1_000_000) for _ in range(args.size)]
+    body = {"symbols": symbols, "amounts": amounts}
+    codes, values = symbol_codes(symbols), np.array(amounts)
+    records = np.empty(args.size, dtype=QUOTE_RECORD)
+    records["symbol"], records["amount"] = codes, values
+    data = records.tobytes()
+    snapshot = rate_store.snapshot
+
+    def scalar():
+        return [convert_to_usd(a, s, snapshot) for s, a in zip(symbols, amounts)]
+
+    def vectorized_math():
+        return quote(codes, values, "usd", snapshot)
+
+    def vectorized_request():
+        return quote(*read_json_quotes(body, args.size), "usd", snapshot).tolist()
+
+    def vectorized_binary():
+        return quote(*read_binary_quotes(data, args.size), "usd", snapshot).tobytes()
+
+    assert scalar() == vectorized_request()
+    for name, fn in [
+        ("scalar", scalar),
+        ("vectorized math", vectorized_math),
+        ("vectorized request", vectorized_request),
+        ("vectorized binary", vectorized_binary),
+    ]:
+        best = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+        print(f"{name:>18}: {best * 1000:8.2f} ms for {args.size} quotes ({best / args.size * 1e9:6.1f} ns/quote)")
+
+
+if __name__ == "__main__":
+    main()
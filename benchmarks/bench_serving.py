@@ -0,0 +1,194 @@
+"""Compares the Flask (WSGI) and asyncio (ASGI) serving modes under concurrent clients.
+
+    python -m benchmarks.bench_serving --concurrency 64 --duration 10 --route mixed
+
+By default both servers are started as subprocesses against a temporary SQLite database:
+the Flask app on werkzeug's threaded server and `project.asgi` on uvicorn. To compare real
+deployments (e.g. gunicorn with eventlet workers against uvicorn, both on Postgres) start
+them yourself and pass --sync-url, --async-url and the --database-uri they share, which is
+seeded with the benchmark's client and users.
+
+"balances" only reads, "sell" sells a tiny amount with a new transaction_id per request and
+"mixed" does one sell for every three reads.
+"""
+import argparse
+import http.client
+import logging
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from project.app import db
+from project.globals import ACCEPTED_SYMBOLS
+from project.models import Clients, Keys, Users
+
+
+def seed(uri: str, users: int) -> dict:
+    """creates the schema if needed and adds a client with `users` funded users"""
+    engine = create_engine(uri)
+    db.metadata.create_all(engine)
+    with Session(engine, expire_on_commit=False) as sess:
+        key = Keys(key=secrets.token_urlsafe())
+        client = Clients(name="bench", api_key=key)
+        holdings = {}
+        for symbol in ACCEPTED_SYMBOLS:
+            holdings[symbol] = 1_000_000.0
+            holdings[f"{symbol}_auth"] = True
+        members = [Users(client=client, **holdings) for _ in range(users)]
+        sess.add_all([key, client, *members])
+        sess.commit()
+        seeded = {"client_id": client.id, "key": key.key, "users": [u.id for u in members]}
+    engine.dispose()
+    return seeded
+
+
+def serve(mode: str, uri: str, port: int) -> None:
+    """runs one serving mode in the foreground, this is what `start_server` spawns"""
+    if mode == "sync":
+        from werkzeug.serving import make_server
+
+        from project.app import create_app
+
+        from project.pool import engine_options
+
+        app = create_app()
+        app.config["SQLALCHEMY_DATABASE_URI"] = uri
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no access log
+        make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+    else:
+        import uvicorn
+
+        from project.app import create_app
+        from project.asgi import AsyncAPI, async_database_uri
+
+        config = dict(create_app().config, ASYNC_DATABASE_URI=async_database_uri(uri))
+        uvicorn.run(AsyncAPI(config), host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode: str, uri: str) -> tuple:
+    """spawns `serve` in a subprocess and waits for it to accept connections"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.bench_serving", "serve", mode, uri, str(port)]
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"the {mode} server did not start")
+
+
+def client_loop(url: str, seeded: dict, route: str, stop: float, index: int, results: list) -> None:
+    """one client: sends requests over a keep-alive connection until `stop`"""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+    headers = {"client_id": str(seeded["client_id"]), "authorization": seeded["key"]}
+    users = seeded["users"]
+    latencies, errors, n = [], 0, index
+    while time.monotonic() < stop:
+        user = users[n % len(users)]
+        if route == "sell" or (route == "mixed" and n % 4 == 0):
+            method, path = "POST", f"/sell/{user}/BTC/0.000001"
+            request_headers = dict(headers, transaction_id=secrets.token_hex(8))
+        else:
+            method, path, request_headers = "GET", f"/balances/{user}", headers
+        n += 1
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, headers=request_headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 300:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    results.append((latencies, errors))
+
+
+def run_load(url: str, seeded: dict, route: str, concurrency: int, duration: float) -> dict:
+    results = []
+    stop = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=client_loop, args=(url, seeded, route, stop, i, results))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies = sorted(l for ls, _ in results for l in ls)
+    errors = sum(e for _, e in results)
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / duration,
+        "p50": percentile(0.50),
+        "p99": percentile(0.99),
+    }
+
+
+def main():
+    if sys.argv[1:2] == ["serve"]:
+        mode, uri, port = sys.argv[2:5]
+        return serve(mode, uri, int(port))
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per mode")
+    parser.add_argument("--route", choices=["balances", "sell", "mixed"], default="balances")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--database-uri", help="defaults to a temporary SQLite file")
+    parser.add_argument("--sync-url", help="an already running Flask server")
+    parser.add_argument("--async-url", help="an already running ASGI server")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = args.database_uri or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        seeded = seed(uri, args.users)
+        for mode, url in [("sync", args.sync_url), ("async", args.async_url)]:
+            process = None
+            if url is None:
+                process, url = start_server(mode, uri)
+            try:
+                stats = run_load(url, seeded, args.route, args.concurrency, args.duration)
+            finally:
+                if process is not None:
+                    process.terminate()
+                    process.wait()
+            print(
+                f"{mode:>5}: {stats['rps']:8.1f} req/s  p50 {stats['p50']:7.2f} ms  "
+                f"p99 {stats['p99']:7.2f} ms  {stats['requests']} ok, {stats['errors']} errors "
+                f"({args.concurrency} clients, {args.route})"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy.engine import make_url
+
+from benchmarks.bench_serving import free_port
+from benchmarks.loadtest import __doc__
+from benchmarks.loadtest.driver import ROUTES, Workload, parse_mix, run_load
+from benchmarks.loadtest.seed import seed
+
+COMPARED = ("rps", "p50_ms", "p95_ms", "p99_ms", "statements_per_request", "lock_wait_ms_per_request")
+
+
+def start_server(uri: str, locking: str) -> tuple:
+    """spawns `benchmarks.loadtest.server` and waits for it to answer"""
+    import http.client
+
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.loadtest.server", uri, str(port), locking]
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/_loadtest/stats")
+            conn.getresponse().read()
+            conn.close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("the load test server did not start")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(results: dict) -> None:
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    print(
+        f"{'route':>9} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'sql/req':>8} {'lock ms/req':>12}  statuses"
+    )
+    for name, row in [*results["routes"].items(), ("overall", results["overall"])]:
+        print(
+            f"{name:>9} {row['rps']:9.1f} {row['p50_ms']:8.2f} {row['p95_ms']:8.2f} "
+            f"{row['p99_ms']:8.2f} {fmt(row['statements_per_request'], '8.2f'):>8} "
+            f"{fmt(row['lock_wait_ms_per_request'], '12.3f'):>12}  {row['statuses']}"
+        )
+    if results["overall"]["failures"]:
+        print(f"{results['overall']['failures']} requests got no response")
+    if results["deposits_exhausted"]:
+        print("the seeded deposits ran out, later buys were sent as balance reads (see --deposits)")
+
+
+def compare(before_path: str, after_path: str) -> None:
+    """prints the change of each compared result between two saved runs"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{before['meta']['commit']} -> {after['meta']['commit']}")
+    print(f"{'route':>9} " + " ".join(f"{name:>26}" for name in COMPARED))
+    for route in [*ROUTES, "overall"]:
+        old = before["overall"] if route == "overall" else before["routes"].get(route)
+        new = after["overall"] if route == "overall" else after["routes"].get(route)
+        if old is None or new is None:
+            continue
+        cells = []
+        for name in COMPARED:
+            if old[name] is None or new[name] is None:
+                cells.append("-")
+                continue
+            change = f" ({(new[name] - old[name]) / old[name]:+.0%})" if old[name] else ""
+            cells.append(f"{old[name]:.2f} -> {new[name]:.2f}{change}")
+        print(f"{route:>9} " + " ".join(f"{cell:>26}" for cell in cells))
+
+
+def main():
+    if sys.argv[1:2] == ["compare"]:
+        return compare(*sys.argv[2:4])
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.loadtest",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--users", type=int, default=250, help="users per client")
+    parser.add_argument("--deposits", type=int, default=20, help="unspent deposits per user")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent connections")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of load before measuring")
+    parser.add_argument("--mix", default="buy=1,sell=1,balances=4,list=2", help="route weights")
+    parser.add_argument("--locking", choices=["pessimistic", "optimistic"], default="pessimistic")
+    parser.add_argument("--database-uri", help="defaults to a temporary SQLite file")
+    parser.add_argument("--url", help="an already running server on --database-uri")
+    parser.add_argument("--output", help="where to save the results, defaults to loadtest-<commit>.json")
+    args = parser.parse_args()
+    weights = parse_mix(args.mix)
+    commit = git_commit()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = args.database_uri or f"sqlite:///{os.path.join(tmp, 'loadtest.db')}"
+        seeded = seed(uri, args.clients, args.users, args.deposits)
+        workload = Workload(seeded, weights)
+        process, url = (None, args.url) if args.url else start_server(uri, args.locking)
+        try:
+            if args.warmup:
+                run_load(url, workload, args.concurrency, args.warmup)
+            results = run_load(url, workload, args.concurrency, args.duration)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    results["meta"] = {
+        "commit": commit,
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "database": make_url(uri).get_backend_name(),
+        "server": args.url or "benchmarks.loadtest.server",
+        "args": vars(args),
+    }
+    print_results(results)
+    output = args.output or f"loadtest-{commit}.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
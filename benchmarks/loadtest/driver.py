@@ -0,0 +1,203 @@
+"""Drives a running server with a mix of trading requests from concurrent clients"""
+import http.client
+import json
+import queue
+import random
+import secrets
+import threading
+import time
+from urllib.parse import urlsplit
+
+from project.globals import ACCEPTED_SYMBOLS
+
+from benchmarks.loadtest.seed import DEPOSIT_AMOUNT
+
+ROUTES = ("buy", "sell", "balances", "list")
+# endpoint of each route in the app, which `server.StatementStats` counts by
+ENDPOINTS = {
+    "buy": "main.buy",
+    "sell": "main.sell",
+    "balances": "main.balances",
+    "list": "main.currency_list",
+}
+SELL_AMOUNT = 0.000001
+
+
+def parse_mix(mix: str) -> dict:
+    """parses "buy=1,sell=1,balances=4,list=2" into relative route weights"""
+    weights = {}
+    for part in mix.split(","):
+        route, _, weight = part.partition("=")
+        if route not in ROUTES:
+            raise ValueError(f"unknown route '{route}', expected one of {', '.join(ROUTES)}")
+        weights[route] = float(weight or 1)
+    if not any(weights.values()):
+        raise ValueError("the mix needs a route with a positive weight")
+    return weights
+
+
+class Workload:
+    """Picks the next request of a client, spending the seeded deposits on buys"""
+
+    def __init__(self, seeded: dict, weights: dict):
+        self.clients = seeded["clients"]
+        self.routes = list(weights)
+        self.weights = list(weights.values())
+        self.deposits = queue.SimpleQueue()
+        for deposit in seeded["deposits"]:
+            self.deposits.put(deposit)
+        self.deposits_exhausted = False
+        self._clients = {client["id"]: client for client in self.clients}
+
+    def next_request(self, rand: random.Random) -> tuple:
+        """(route, method, path, headers) of a random request of the mix"""
+        route = rand.choices(self.routes, self.weights)[0]
+        if route == "buy":
+            try:
+                client_id, user, transaction_id = self.deposits.get_nowait()
+            except queue.Empty:
+                self.deposits_exhausted = True
+                route = "balances"
+            else:
+                client = self._clients[client_id]
+                path = f"/buy/{user}/{rand.choice(ACCEPTED_SYMBOLS)}/{DEPOSIT_AMOUNT:f}"
+                return route, "POST", path, self.headers(client, transaction_id=transaction_id)
+        client = rand.choice(self.clients)
+        user = rand.choice(client["users"])
+        if route == "sell":
+            path = f"/sell/{user}/{rand.choice(ACCEPTED_SYMBOLS)}/{SELL_AMOUNT:f}"
+            return route, "POST", path, self.headers(client, transaction_id=secrets.token_hex(8))
+        return route, "GET", f"/{route}/{user}", self.headers(client)
+
+    @staticmethod
+    def headers(client: dict, **extra) -> dict:
+        return dict({"client_id": str(client["id"]), "authorization": client["key"]}, **extra)
+
+
+class Recorder:
+    """Latencies and status codes of one client's requests, by route"""
+
+    def __init__(self):
+        self.latencies = {route: [] for route in ROUTES}
+        self.statuses = {route: {} for route in ROUTES}
+        self.failures = 0  # requests that got no response at all
+
+    def record(self, route: str, status: int, latency: float) -> None:
+        self.latencies[route].append(latency)
+        self.statuses[route][status] = self.statuses[route].get(status, 0) + 1
+
+
+def client_loop(url: str, workload: Workload, stop: float, seed: int, recorder: Recorder) -> None:
+    """one client: sends requests over a keep-alive connection until `stop`"""
+    parts = urlsplit(url)
+    rand = random.Random(seed)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+    while time.monotonic() < stop:
+        route, method, path, headers = workload.next_request(rand)
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            recorder.failures += 1
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+            continue
+        recorder.record(route, response.status, time.perf_counter() - start)
+    conn.close()
+
+
+def percentile(latencies: list, p: float) -> float:
+    """the `p` quantile of sorted `latencies`, in milliseconds"""
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+
+def summarize(latencies: list, statuses: dict, duration: float, server: dict = None) -> dict:
+    """the results of one route, or of all of them"""
+    latencies = sorted(latencies)
+    summary = {
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status >= 500),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "rps": len(latencies) / duration,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+        "statements_per_request": None,
+        "lock_wait_ms": None,
+        "lock_wait_ms_per_request": None,
+    }
+    if server and server["requests"]:
+        summary["statements_per_request"] = server["statements"] / server["requests"]
+        summary["lock_wait_ms"] = server["lock_wait_seconds"] * 1000
+        summary["lock_wait_ms_per_request"] = summary["lock_wait_ms"] / server["requests"]
+    return summary
+
+
+def server_stats(url: str, method: str = "GET"):
+    """the `StatementStats` of a server started by `server`, or None for any other server"""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+    try:
+        conn.request(method, "/_loadtest/stats")
+        response = conn.getresponse()
+        body = response.read()
+        return json.loads(body) if response.status == 200 else None
+    except (OSError, http.client.HTTPException, ValueError):
+        return None
+    finally:
+        conn.close()
+
+
+def run_load(url: str, workload: Workload, concurrency: int, duration: float) -> dict:
+    """
+    runs `concurrency` clients against `url` for `duration` seconds
+
+    :return: The results per route and overall, see `summarize`
+    """
+    server_stats(url, "DELETE")
+    recorders = [Recorder() for _ in range(concurrency)]
+    stop = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=client_loop, args=(url, workload, stop, i, recorder))
+        for i, recorder in enumerate(recorders)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    stats = server_stats(url)
+    endpoints = stats["endpoints"] if stats else {}
+
+    routes, everything, all_statuses, totals = {}, [], {}, None
+    for route in ROUTES:
+        latencies = [l for recorder in recorders for l in recorder.latencies[route]]
+        statuses = {}
+        for recorder in recorders:
+            for status, count in recorder.statuses[route].items():
+                statuses[status] = statuses.get(status, 0) + count
+                all_statuses[status] = all_statuses.get(status, 0) + count
+        if not latencies:
+            continue
+        server = endpoints.get(ENDPOINTS[route])
+        if server:
+            totals = totals or {"requests": 0, "statements": 0, "lock_wait_seconds": 0.0}
+            for name in totals:
+                totals[name] += server[name]
+        routes[route] = summarize(latencies, statuses, elapsed, server)
+        everything.extend(latencies)
+    overall = summarize(everything, all_statuses, elapsed, totals)
+    overall["failures"] = sum(recorder.failures for recorder in recorders)
+    return {
+        "duration": elapsed,
+        "overall": overall,
+        "routes": routes,
+        "server": stats and {k: v for k, v in stats.items() if k != "endpoints"},
+        "deposits_exhausted": workload.deposits_exhausted,
+    }
@@ -0,0 +1,63 @@
+"""Seeds the clients, users and deposits a load test trades with"""
+import secrets
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from project.app import db
+from project.globals import ACCEPTED_SYMBOLS
+from project.models import Clients, Keys, Transactions, Users
+
+# USD amount of every seeded deposit, and so of every buy
+DEPOSIT_AMOUNT = 10.0
+
+
+def seed(uri: str, clients: int, users: int, deposits: int) -> dict:
+    """
+    creates the schema if needed and adds the load test's rows
+
+    every user holds and is authorized for every currency, so sells never run out
+
+    :param uri: The database to seed
+    :param clients: The number of clients
+    :param users: The number of users of each client
+    :param deposits: The number of unspent deposits of each user
+    :return: The clients' ids, keys and user ids, and the deposits as
+        (client_id, user_id, transaction_id) tuples
+    """
+    engine = create_engine(uri)
+    db.metadata.create_all(engine)
+    holdings = {}
+    for symbol in ACCEPTED_SYMBOLS:
+        holdings[symbol] = 1_000_000.0
+        holdings[f"{symbol}_auth"] = True
+    seeded = {"clients": [], "deposits": []}
+    with Session(engine, expire_on_commit=False) as sess:
+        for n in range(clients):
+            key = Keys(key=secrets.token_urlsafe())
+            client = Clients(name=f"loadtest-{n}", api_key=key)
+            members = [Users(client=client, **holdings) for _ in range(users)]
+            sess.add_all([key, client, *members])
+            sess.flush()
+            seeded["clients"].append(
+                {"id": client.id, "key": key.key, "users": [user.id for user in members]}
+            )
+        sess.execute(
+            Transactions.__table__.insert(),
+            [
+                {"usd_amount": DEPOSIT_AMOUNT, "user_id": user_id, "client_id": client["id"]}
+                for client in seeded["clients"]
+                for user_id in client["users"]
+                for _ in range(deposits)
+            ],
+        )
+        rows = sess.execute(
+            select(Transactions.client_id, Transactions.user_id, Transactions.id).where(
+                Transactions.client_id.in_([client["id"] for client in seeded["clients"]]),
+                Transactions.complete.is_(False),
+            )
+        )
+        seeded["deposits"] = [tuple(row) for row in rows]
+        sess.commit()
+    engine.dispose()
+    return seeded
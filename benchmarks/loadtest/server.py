@@ -0,0 +1,137 @@
+"""Runs the Flask app for a load test, counting the SQL each request sends.
+
+    python -m benchmarks.loadtest.server <database uri> <port> <pessimistic|optimistic>
+
+Per endpoint, `StatementStats` counts requests, SQL statements and the time spent in
+statements that can wait on another transaction's lock: `SELECT ... FOR UPDATE` and writes,
+which on SQLite wait for the database's write lock. That time includes the statements' own
+execution, so it is an upper bound on lock waits, but those statements are primary key
+lookups and updates, so under contention it is almost all waiting.
+
+The counts are served as JSON at `/_loadtest/stats`, outside the API blueprint so that no API
+key is needed. DELETE resets them.
+"""
+import logging
+import socket
+import sys
+import threading
+import time
+
+from flask import request
+from sqlalchemy import event
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from project.metrics import db_pool_checkout_seconds, trade_conflicts, trade_retries
+
+LOCKING_PREFIXES = ("INSERT", "UPDATE", "DELETE")
+
+
+def waits_on_locks(statement: str) -> bool:
+    """whether a statement can wait for a lock held by another transaction"""
+    return "FOR UPDATE" in statement or statement.lstrip()[:6].upper() in LOCKING_PREFIXES
+
+
+class StatementStats:
+    """Per endpoint counts of requests, SQL statements and lock wait time"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.endpoints = {}
+
+    def install(self, app, engine) -> None:
+        app.before_request(self.start_request)
+        app.teardown_request(self.finish_request)
+        event.listen(engine, "before_cursor_execute", self.before_execute)
+        event.listen(engine, "after_cursor_execute", self.after_execute)
+
+    def start_request(self) -> None:
+        self._local.current = [0, 0.0]  # statements, lock wait seconds
+
+    def finish_request(self, exc=None) -> None:
+        current = getattr(self._local, "current", None)
+        self._local.current = None
+        if current is None or request.endpoint in (None, "loadtest_stats"):
+            return
+        with self._lock:
+            totals = self.endpoints.setdefault(
+                request.endpoint, {"requests": 0, "statements": 0, "lock_wait_seconds": 0.0}
+            )
+            totals["requests"] += 1
+            totals["statements"] += current[0]
+            totals["lock_wait_seconds"] += current[1]
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.started = time.perf_counter()
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        current = getattr(self._local, "current", None)
+        if current is None:
+            return
+        current[0] += 1
+        if waits_on_locks(statement):
+            current[1] += time.perf_counter() - self._local.started
+
+    def reset(self) -> None:
+        with self._lock:
+            self.endpoints = {}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            endpoints = {name: dict(totals) for name, totals in self.endpoints.items()}
+        return {
+            "endpoints": endpoints,
+            "pool_checkouts": db_pool_checkout_seconds.count,
+            "pool_wait_seconds": db_pool_checkout_seconds.sum,
+            "trade_conflicts": trade_conflicts.value,
+            "trade_retries": trade_retries.value,
+        }
+
+
+def create_server_app(uri: str, locking: str = "pessimistic"):
+    """the app with production settings, on `uri`, with a `StatementStats` installed"""
+    from project.app import create_app, db
+    from project.pool import engine_options
+
+    app = create_app()
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=uri,
+        SQLALCHEMY_ENGINE_OPTIONS=engine_options(dict(app.config, SQLALCHEMY_DATABASE_URI=uri)),
+        TRADE_LOCKING=locking,
+    )
+    stats = StatementStats()
+    with app.app_context():
+        stats.install(app, db.engine)
+
+    def stats_view():
+        if request.method == "DELETE":
+            stats.reset()
+        return stats.snapshot()
+
+    app.add_url_rule("/_loadtest/stats", "loadtest_stats", stats_view, methods=["GET", "DELETE"])
+    return app
+
+
+class NoDelayHandler(WSGIRequestHandler):
+    """werkzeug's handler with Nagle's algorithm off
+
+    werkzeug writes the headers and the body separately, and with Nagle on the body waits
+    for the client's delayed ACK of the headers, which adds ~40 ms to every response
+    """
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def main():
+    uri, port, locking = sys.argv[1:4]
+    app = create_server_app(uri, locking)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no access log
+    make_server(
+        "127.0.0.1", int(port), app, threaded=True, request_handler=NoDelayHandler
+    ).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
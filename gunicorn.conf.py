@@ -0,0 +1,11 @@
+"""gunicorn settings, read from the working directory when gunicorn starts"""
+import glob
+import os
+
+
+def on_starting(server):
+    """drops the metrics files of the previous run, see `project.instrumentation`"""
+    directory = os.environ.get("METRICS_MULTIPROC_DIR")
+    if directory:
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            os.remove(path)
@@ -0,0 +1,29 @@
+"""keyset pagination indexes on transactions
+
+Revision ID: 3e8b6d41c7f2
+Revises: 5c1f0e7b2a94
+Create Date: 2026-10-18 15:02:47.193820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e8b6d41c7f2'
+down_revision = '5c1f0e7b2a94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # built concurrently on Postgres, so trades can keep writing transactions meanwhile
+    with op.get_context().autocommit_block():
+        op.create_index('ix_transactions_client_id_inc_time_id', 'transactions', ['client_id', 'inc_time', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_transactions_user_id_inc_time_id', 'transactions', ['user_id', 'inc_time', 'id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_transactions_user_id_inc_time_id', table_name='transactions', postgresql_concurrently=True)
+        op.drop_index('ix_transactions_client_id_inc_time_id', table_name='transactions', postgresql_concurrently=True)
@@ -0,0 +1,24 @@
+"""unique confirmation key per client on transactions
+
+Revision ID: 5c1f0e7b2a94
+Revises: aeb90583e999
+Create Date: 2026-10-18 12:14:03.418250
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1f0e7b2a94'
+down_revision = 'aeb90583e999'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_transactions_client_id_inc_key', 'transactions', ['client_id', 'inc_key'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_transactions_client_id_inc_key', table_name='transactions')
@@ -0,0 +1,45 @@
+"""orders table of the settlement queue
+
+Revision ID: 7f4a2c9e1b36
+Revises: 3e8b6d41c7f2
+Create Date: 2026-10-18 17:41:26.508113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f4a2c9e1b36'
+down_revision = '3e8b6d41c7f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('orders',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('side', sa.String(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('client_id', sa.Integer(), nullable=False),
+    sa.Column('symbol', sa.String(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('transaction_id', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('enqueued_at', sa.DateTime(), nullable=False),
+    sa.Column('settled_at', sa.DateTime(), nullable=True),
+    sa.Column('settled_transaction_id', sa.Integer(), nullable=True),
+    sa.Column('error_status', sa.Integer(), nullable=True),
+    sa.Column('error_message', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['client_id'], ['clients.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_orders_client_id_side_transaction_id', 'orders', ['client_id', 'side', 'transaction_id'], unique=True)
+    op.create_index('ix_orders_queued', 'orders', ['id'], unique=False, postgresql_where=sa.text("status = 'queued'"), sqlite_where=sa.text("status = 'queued'"))
+
+
+def downgrade():
+    op.drop_index('ix_orders_queued', table_name='orders')
+    op.drop_index('ix_orders_client_id_side_transaction_id', table_name='orders')
+    op.drop_table('orders')
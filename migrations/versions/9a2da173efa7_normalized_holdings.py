@@ -0,0 +1,83 @@
+"""move per currency columns on users into a holdings table
+
+Revision ID: 9a2da173efa7
+Revises: d2d331b1db58
+Create Date: 2026-10-18 09:47:03.550971
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a2da173efa7'
+down_revision = 'd2d331b1db58'
+branch_labels = None
+depends_on = None
+
+# the currencies that had columns on users when this migration was written
+SYMBOLS = ["BTC", "ETH", "DOGE", "USDT", "BNB"]
+
+users = sa.table(
+    'users',
+    sa.column('id', sa.Integer),
+    *[sa.column(symbol, sa.Float) for symbol in SYMBOLS],
+    *[sa.column(f'{symbol}_auth', sa.Boolean) for symbol in SYMBOLS],
+)
+holdings = sa.table(
+    'holdings',
+    sa.column('user_id', sa.Integer),
+    sa.column('symbol', sa.String),
+    sa.column('amount', sa.Float),
+    sa.column('authorized', sa.Boolean),
+)
+
+
+def upgrade():
+    op.create_table('holdings',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('symbol', sa.String(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('authorized', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'symbol')
+    )
+    for symbol in SYMBOLS:
+        op.execute(
+            holdings.insert().from_select(
+                ['user_id', 'symbol', 'amount', 'authorized'],
+                sa.select(
+                    users.c.id,
+                    sa.literal(symbol, sa.String),
+                    sa.func.coalesce(users.c[symbol], 0.0),
+                    sa.func.coalesce(users.c[f'{symbol}_auth'], sa.false()),
+                ),
+            )
+        )
+    with op.batch_alter_table('users') as batch_op:
+        for symbol in SYMBOLS:
+            batch_op.drop_column(symbol)
+            batch_op.drop_column(f'{symbol}_auth')
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        for symbol in SYMBOLS:
+            batch_op.add_column(sa.Column(symbol, sa.Float(), nullable=True))
+            batch_op.add_column(sa.Column(f'{symbol}_auth', sa.Boolean(), nullable=True))
+    for symbol in SYMBOLS:
+        held = holdings.alias()
+        mine = sa.and_(held.c.user_id == users.c.id, held.c.symbol == symbol)
+        op.execute(
+            users.update().values(
+                {
+                    symbol: sa.func.coalesce(
+                        sa.select(held.c.amount).where(mine).scalar_subquery(), 0.0
+                    ),
+                    f'{symbol}_auth': sa.func.coalesce(
+                        sa.select(held.c.authorized).where(mine).scalar_subquery(), sa.false()
+                    ),
+                }
+            )
+        )
+    op.drop_table('holdings')
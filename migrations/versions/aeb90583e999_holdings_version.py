@@ -0,0 +1,28 @@
+"""version column on holdings, for optimistic concurrency
+
+Revision ID: aeb90583e999
+Revises: 9a2da173efa7
+Create Date: 2026-10-18 11:05:52.671190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'aeb90583e999'
+down_revision = '9a2da173efa7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('holdings') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+    with op.batch_alter_table('holdings') as batch_op:
+        batch_op.alter_column('version', server_default=None)
+
+
+def downgrade():
+    with op.batch_alter_table('holdings') as batch_op:
+        batch_op.drop_column('version')
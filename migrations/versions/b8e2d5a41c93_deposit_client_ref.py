@@ -0,0 +1,28 @@
+"""client_ref column for the references of bulk deposits
+
+Revision ID: b8e2d5a41c93
+Revises: 7f4a2c9e1b36
+Create Date: 2026-10-18 19:02:47.116034
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e2d5a41c93'
+down_revision = '7f4a2c9e1b36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transactions') as batch_op:
+        batch_op.add_column(sa.Column('client_ref', sa.String(), nullable=True))
+    op.create_index('ix_transactions_client_id_client_ref', 'transactions', ['client_id', 'client_ref'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_transactions_client_id_client_ref', table_name='transactions')
+    with op.batch_alter_table('transactions') as batch_op:
+        batch_op.drop_column('client_ref')
@@ -0,0 +1,65 @@
+"""initial schema, with a column per currency on users
+
+Revision ID: d2d331b1db58
+Revises:
+Create Date: 2026-10-18 09:12:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2d331b1db58'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+SYMBOLS = ["BTC", "ETH", "DOGE", "USDT", "BNB"]
+
+
+def upgrade():
+    op.create_table('keys',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('clients',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('key_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['key_id'], ['keys.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    columns = []
+    for symbol in SYMBOLS:
+        columns.append(sa.Column(symbol, sa.Float(), nullable=True))
+        columns.append(sa.Column(f'{symbol}_auth', sa.Boolean(), nullable=True))
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    *columns,
+    sa.Column('client_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['client_id'], ['clients.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('transactions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('usd_amount', sa.Float(), nullable=True),
+    sa.Column('inc_time', sa.DateTime(), nullable=True),
+    sa.Column('complete_time', sa.DateTime(), nullable=True),
+    sa.Column('complete', sa.Boolean(), nullable=True),
+    sa.Column('inc_key', sa.String(), nullable=True),
+    sa.Column('rate_version', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('client_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['client_id'], ['clients.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('transactions')
+    op.drop_table('users')
+    op.drop_table('clients')
+    op.drop_table('keys')
@@ -1,18 +1,32 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from project.cache import api_key_cache, response_cache
 from project.config import DevConfig, TestConfig
+from project.instrumentation import request_metrics
+from project.pool import engine_options
+from project.rates import rate_store
+from project.replica import RoutingSQLAlchemy, replica_router
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 
 def create_app(testing=False):
     app = Flask(__name__)
     conf = TestConfig() if testing else DevConfig()
     app.config.from_object(conf)
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(app.config))
+    replica_router.init_app(app)
     db.init_app(app)
     migrate.init_app(app, db, compare_type=True)
+    api_key_cache.init_app(app)
+    response_cache.init_app(app)
+    rate_store.init_app(app)
+    request_metrics.init_app(app)
     from project.routes import api as main_blueprint
+    from project.settlement import settlement_queue
+    from project.sockets import order_channel
     app.register_blueprint(main_blueprint)
+    order_channel.init_app(app)
+    settlement_queue.init_app(app)
     return app
 
@@ -0,0 +1,278 @@
+"""Native asyncio serving mode for the per-user routes.
+
+    uvicorn asgi:app --workers 4
+
+Serves /list, /balances/<id>, /buy, /sell and /orders/<id> on SQLAlchemy's asyncio engine, so
+a trade waiting on a row lock awaits on the event loop instead of holding a worker. Everything
+else (the batch, multi-user and quote routes) is only served by the Flask app. With
+`TRADE_SETTLEMENT = "queued"`, /buy and /sell queue their orders with `enqueue_order` and
+answer 202, like the Flask routes, see `project.settlement`.
+
+The handlers run the same header checks, validation and trade code as `project.routes`,
+through `AsyncSession.run_sync`, and answer with the same status codes and bodies.
+"""
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.datastructures import Headers
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_etags, quote_etag
+from werkzeug.routing import Map, Rule
+
+from project.app import create_app
+from project.cache import api_key_cache
+from project.encoding import dumps
+from project.exceptions import (
+    InvalidTokenError,
+    MissingHeaderError,
+    TransactionNotFoundError,
+    UnauthorizedClientError,
+)
+from project.helpers import (
+    CONFLICT_MESSAGE,
+    TRADE_ERRORS,
+    buy_order,
+    client_credentials,
+    conflict_backoff,
+    deposit_id,
+    error_body,
+    required_header,
+    sell_order,
+    trade_error,
+    user_response,
+    verify_client,
+)
+from project.metrics import trade_conflicts, trade_retries
+from project.models import Orders
+from project.pool import engine_options
+from project.settlement import enqueue_order
+
+# async driver used for each database dialect, see `ASYNC_DATABASE_URI` in `project.config`
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_uri(uri: str) -> str:
+    """swaps the driver of a synchronous database uri for its asyncio equivalent"""
+    scheme, rest = uri.split(":", 1)
+    return f"{ASYNC_DRIVERS[scheme.split('+')[0]]}:{rest}"
+
+
+class Response:
+    """A complete response, sent in one `http.response.start` and one `http.response.body`"""
+
+    def __init__(self, status: int, body: bytes = b"", headers=None):
+        self.status = status
+        self.body = body
+        self.headers = Headers(headers)
+
+    @classmethod
+    def json(cls, payload, status: int = 200) -> "Response":
+        return cls(status, dumps(payload), {"Content-Type": "application/json"})
+
+    @classmethod
+    def error(cls, status: int, message=None) -> "Response":
+        return cls(status, error_body(status, message), {"Content-Type": "application/json"})
+
+    @classmethod
+    def empty(cls) -> "Response":
+        return cls(204, headers={"Content-Type": "text/html; charset=utf-8"})
+
+    @classmethod
+    def from_exception(cls, e: HTTPException) -> "Response":
+        """werkzeug's response for an HTTP error, as flask would send it"""
+        response = e.get_response()
+        return cls(response.status_code, response.get_data(), response.headers)
+
+    async def send(self, send) -> None:
+        headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in self.headers]
+        headers.append((b"content-length", str(len(self.body)).encode()))
+        await send({"type": "http.response.start", "status": self.status, "headers": headers})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+class AsyncAPI:
+    """ASGI application serving the per-user routes of `project.routes.api`"""
+
+    url_map = Map(
+        [
+            Rule("/list/<int:id>", endpoint="currency_list", methods=["GET"]),
+            Rule("/buy/<int:id>/<symbol>/<float:usd_amount>", endpoint="buy", methods=["POST"]),
+            Rule(
+                "/sell/<int:user_id>/<symbol>/<float:currency_amount>",
+                endpoint="sell",
+                methods=["POST"],
+            ),
+            Rule("/balances/<int:id>", endpoint="balances", methods=["GET"]),
+            Rule("/orders/<int:id>", endpoint="order_status", methods=["GET"]),
+        ]
+    )
+
+    def __init__(self, config):
+        self.config = config
+        uri = config["ASYNC_DATABASE_URI"] or async_database_uri(
+            config["SQLALCHEMY_DATABASE_URI"]
+        )
+        self.engine = create_async_engine(
+            uri, echo=config["SQLALCHEMY_ECHO"], **engine_options(config, uri, asyncio=True)
+        )
+        self.session = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            response = await self.dispatch(scope)
+            await response.send(send)
+
+    async def lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def dispatch(self, scope) -> Response:
+        """matches the route, checks the API key and runs the handler, like flask and `check_api_key`"""
+        # none of the rules end in a slash, so matching never has to build a redirect url
+        adapter = self.url_map.bind("localhost")
+        try:
+            endpoint, args = adapter.match(scope["path"], method=scope["method"])
+        except HTTPException as e:
+            return Response.from_exception(e)
+        headers = Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]])
+        try:
+            client_id, auth = client_credentials(headers)
+        except MissingHeaderError as e:
+            return Response.error(400, f"{e}")
+        try:
+            if not api_key_cache.verified(client_id, auth):
+                async with self.session() as session:
+                    await session.run_sync(verify_client, client_id, auth)
+            return await getattr(self, endpoint)(headers, client_id, **args)
+        except InvalidTokenError:
+            return Response.error(401, "invalid API key")
+        except HTTPException as e:
+            return Response.from_exception(e)
+
+    async def currency_list(self, headers: Headers, client_id: int, id: int) -> Response:
+        """Currency list: For a given user, get the curriencies they can transact"""
+        return await self.user_view(headers, "auths", client_id, id)
+
+    async def balances(self, headers: Headers, client_id: int, id: int) -> Response:
+        """Balances: For a given User, get a list of Balances"""
+        return await self.user_view(headers, "balances", client_id, id)
+
+    async def user_view(self, headers: Headers, kind: str, client_id: int, user_id: int) -> Response:
+        """serves one of the user's cacheable, conditional responses, see `user_response`"""
+        async with self.session() as session:
+            try:
+                status, etag, body = await session.run_sync(
+                    user_response,
+                    kind,
+                    user_id,
+                    client_id,
+                    parse_etags(headers.get("If-None-Match")),
+                )
+            except UnauthorizedClientError as e:
+                return Response.error(401, f"{e}")
+        return Response(
+            status, body, {"Content-Type": "application/json", "ETag": quote_etag(etag)}
+        )
+
+    async def buy(
+        self, headers: Headers, client_id: int, id: int, symbol: str, usd_amount: float
+    ) -> Response:
+        """Buy: For a given User, buy a selected Currency"""
+        return await self.trade(buy_order, headers, client_id, id, symbol, usd_amount)
+
+    async def sell(
+        self, headers: Headers, client_id: int, user_id: int, symbol: str, currency_amount: float
+    ) -> Response:
+        """Sell: for a given User, sell a selected Currency"""
+        return await self.trade(sell_order, headers, client_id, user_id, symbol, currency_amount)
+
+    async def trade(
+        self, order, headers: Headers, client_id: int, user_id: int, symbol: str, amount: float
+    ) -> Response:
+        """
+        runs `buy_order` or `sell_order` in its own transaction
+
+        optimistic trades that conflict are re-run with the same backoff as `retry_on_conflict`,
+        sleeping on the event loop
+        """
+        try:
+            transaction_id = required_header(headers, "transaction_id")
+            key = deposit_id(transaction_id) if order is buy_order else transaction_id
+        except MissingHeaderError as e:
+            return Response.error(400, f"{e}")
+        except TransactionNotFoundError as e:
+            return Response.error(*trade_error(e, symbol))
+        if self.config["TRADE_SETTLEMENT"] == "queued":
+            side = "buy" if order is buy_order else "sell"
+            return await self.enqueue(side, client_id, user_id, symbol, amount, transaction_id)
+        optimistic = self.config["TRADE_LOCKING"] == "optimistic"
+        for attempt in range(self.config["OPTIMISTIC_MAX_RETRIES"] + 1):
+            try:
+                async with self.session() as session:
+                    try:
+                        await session.run_sync(
+                            order, user_id, symbol, amount, client_id, key, optimistic
+                        )
+                    except TRADE_ERRORS as e:
+                        # the message may read the rows, which the rollback expires
+                        response = Response.error(*trade_error(e, symbol))
+                        await session.rollback()
+                        return response
+                    await session.commit()
+                return Response.empty()
+            except StaleDataError:
+                trade_conflicts.inc()
+            if attempt < self.config["OPTIMISTIC_MAX_RETRIES"]:
+                trade_retries.inc()
+                await asyncio.sleep(conflict_backoff(attempt, self.config))
+        return Response.error(409, CONFLICT_MESSAGE)
+
+    async def enqueue(
+        self,
+        side: str,
+        client_id: int,
+        user_id: int,
+        symbol: str,
+        amount: float,
+        transaction_id: str,
+    ) -> Response:
+        """queues a /buy or /sell order for the settlement workers, like `queued_order`"""
+        async with self.session() as session:
+            try:
+                order_id, status = await session.run_sync(
+                    enqueue_order, side, user_id, symbol, amount, client_id, transaction_id
+                )
+            except TRADE_ERRORS as e:
+                return Response.error(*trade_error(e, symbol))
+            await session.commit()
+        response = Response.json({"order_id": order_id, "status": status}, 202)
+        response.headers["Location"] = f"/orders/{order_id}"
+        return response
+
+    async def order_status(self, headers: Headers, client_id: int, id: int) -> Response:
+        """Order status: how settling a queued /buy or /sell order went"""
+        async with self.session() as session:
+            order = await session.get(Orders, id)
+        if order is None:
+            return Response.error(404, "Order not found")
+        if order.client_id != client_id:
+            return Response.error(401, "unauthorized client")
+        return Response.json(order.to_dict())
+
+
+def create_asgi_app(testing=False) -> AsyncAPI:
+    """builds the ASGI app from the same configuration and extensions as `create_app`"""
+    return AsyncAPI(create_app(testing).config)
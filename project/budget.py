@@ -0,0 +1,186 @@
+"""Query budgets: limits on the SQL statements a view may send.
+
+    @api.route("/balances/<int:id>")
+    @query_budget(2)
+    def balances(id): ...
+
+`query_budget` counts the statements the view sends, not counting `check_api_key`'s, and
+checks them against two limits:
+
+- the view's budget, the most statements it may send
+- `QUERY_REPEAT_LIMIT`, how often a single statement may be sent with different parameters.
+  Above it, a loop is most likely loading rows one at a time (an N+1 query)
+
+What happens when a view breaks a limit depends on `QUERY_BUDGET`. "raise" raises
+`QueryBudgetError` after the view returns, which fails the test that made the request.
+"warn" logs a warning with the stack that sent the statement over the limit. "off" doesn't
+count anything.
+
+`track_statements` counts the statements sent inside a `with` block, for code that isn't a
+view. A streamed body's statements are sent after the view returns, so they aren't in the
+view's budget. `stream_budget` checks them against a budget of their own as the body is sent.
+"""
+import logging
+import os
+import threading
+import traceback
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Iterable, Iterator, List, Optional
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from project.exceptions import QueryBudgetError
+
+# frames of the repository's code, the only ones shown in the stack of a warning
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_local = threading.local()
+
+
+class StatementTracker:
+    """The statements sent while it's active, and the stack of the first to break a limit"""
+
+    def __init__(self, budget: Optional[int] = None, repeat_limit: Optional[int] = None):
+        self.budget = budget
+        self.repeat_limit = repeat_limit
+        self.statements = []
+        self.parameters = defaultdict(set)  # statement -> distinct parameters it was sent with
+        self.violations = []  # (message, stack summary) pairs
+
+    def record(self, statement: str, parameters) -> None:
+        self.statements.append(statement)
+        sent_with = self.parameters[statement]
+        sent_with.add(repr(parameters))
+        if self.budget is not None and len(self.statements) == self.budget + 1:
+            self.violate(f"more than {self.budget} statements")
+        if self.repeat_limit is not None and len(sent_with) == self.repeat_limit + 1:
+            self.violate(
+                f"statement sent with more than {self.repeat_limit} different parameters, "
+                f"a likely N+1 query: {statement}"
+            )
+
+    def violate(self, message: str) -> None:
+        self.violations.append((message, _stack_summary()))
+
+    def __len__(self) -> int:
+        return len(self.statements)
+
+
+def _stack_summary() -> List[str]:
+    """the calling frames in this repository, skipping libraries' and this module's"""
+    frames = [
+        frame
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(ROOT_DIR)
+        and "site-packages" not in frame.filename
+        and frame.filename != __file__
+    ]
+    return [f"{frame.filename}:{frame.lineno} in {frame.name}: {frame.line}" for frame in frames]
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    for tracker in getattr(_local, "trackers", ()):
+        tracker.record(statement, parameters)
+
+
+@contextmanager
+def track_statements(budget: Optional[int] = None, repeat_limit: Optional[int] = None):
+    """
+    counts the statements sent by this thread inside the `with` block
+
+    :param budget: The most statements that may be sent, None for no limit
+    :param repeat_limit: How often a statement may be sent with different parameters
+    :return: The `StatementTracker`
+    """
+    tracker = StatementTracker(budget, repeat_limit)
+    with _active(tracker):
+        yield tracker
+
+
+@contextmanager
+def _active(tracker: StatementTracker):
+    trackers = getattr(_local, "trackers", ())
+    _local.trackers = (*trackers, tracker)
+    try:
+        yield
+    finally:
+        _local.trackers = trackers
+
+
+def query_budget(statements: int):
+    """
+    decorator declaring the most SQL statements a view may send, see the module's docstring
+
+    :param statements: The view's budget
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            mode = current_app.config["QUERY_BUDGET"]
+            if mode == "off":
+                return view(*args, **kwargs)
+            with track_statements(statements, current_app.config["QUERY_REPEAT_LIMIT"]) as tracker:
+                response = view(*args, **kwargs)
+            if tracker.violations:
+                report(tracker, mode, _request_name())
+            return response
+
+        wrapper.query_budget = statements
+        return wrapper
+
+    return decorator
+
+
+def stream_budget(chunks: Iterable[bytes], statements: int) -> Iterator[bytes]:
+    """
+    checks the statements sent while a streamed body is sent, like `query_budget` does a view's
+
+    call it in the view, it reads the config and request then. only the statements sent while
+    a chunk is produced are counted, so that bodies streamed in turn by the same thread don't
+    count each other's. a broken limit is raised or logged once the body has been sent
+
+    :param chunks: The body
+    :param statements: The body's budget
+    :return: The body, in the same chunks
+    """
+    mode = current_app.config["QUERY_BUDGET"]
+    if mode == "off":
+        return iter(chunks)
+    repeat_limit = current_app.config["QUERY_REPEAT_LIMIT"]
+    name = f"{_request_name()} streaming its body"
+
+    def tracked():
+        tracker = StatementTracker(statements, repeat_limit)
+        body = iter(chunks)
+        while True:
+            with _active(tracker):
+                chunk = next(body, None)
+            if chunk is None:
+                break
+            yield chunk
+        if tracker.violations:
+            report(tracker, mode, name)
+
+    return tracked()
+
+
+def _request_name() -> str:
+    return f"{request.method} {request.path} ({request.endpoint})"
+
+
+def report(tracker: StatementTracker, mode: str, name: str) -> None:
+    """raises or logs the limits `tracker` saw broken, depending on `mode`"""
+    message = f"{name} sent {len(tracker)} statements"
+    details = "\n".join(
+        f"{violation}, at\n  " + "\n  ".join(stack or ["(no frames in this repository)"])
+        for violation, stack in tracker.violations
+    )
+    if mode == "raise":
+        raise QueryBudgetError(f"{message}: {details}\nstatements:\n" + "\n".join(tracker.statements))
+    logging.getLogger(__name__).warning("%s: %s", message, details)
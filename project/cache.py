@@ -0,0 +1,229 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+from project.metrics import Counter
+
+response_cache_hits = Counter("response_cache_hits_total", "responses served from the response cache")
+response_cache_misses = Counter(
+    "response_cache_misses_total", "cacheable responses that had to be built from the database"
+)
+
+
+class LRUCache:
+    """Thread safe, size bounded LRU cache with an optional time to live per entry"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """returns the cached value for `key`, or `default` if it is missing or expired"""
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value) -> None:
+        """stores `value` under `key`, evicting the least recently used entry when full"""
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate) -> None:
+        """deletes every entry whose key satisfies `predicate`"""
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class ApiKeyCache:
+    """Remembers verified (client_id, key digest) pairs so `check_api_key` can skip the database.
+
+    Only keys that already passed `Clients.auth_key` are stored, and only as a sha256 digest.
+    Key rotation must call `invalidate` (the model event hooks in `project.models` do this for ORM updates).
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._cache = LRUCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.enabled = app.config["API_KEY_CACHE_ENABLED"]
+        self._cache = LRUCache(
+            maxsize=app.config["API_KEY_CACHE_SIZE"],
+            ttl=app.config["API_KEY_CACHE_TTL"],
+        )
+
+    @staticmethod
+    def digest(key: str) -> bytes:
+        return hashlib.sha256(key.encode()).digest()
+
+    def verified(self, client_id: int, key: str) -> bool:
+        """True if this client_id/key pair was verified against the database recently"""
+        if not self.enabled:
+            return False
+        return self._cache.get((client_id, self.digest(key)), False)
+
+    def store(self, client_id: int, key: str) -> None:
+        """records a client_id/key pair that was just verified against the database"""
+        if self.enabled:
+            self._cache.set((client_id, self.digest(key)), True)
+
+    def invalidate(self, client_id: int = None) -> None:
+        """drops cached verifications for `client_id`, or for every client if no id is given"""
+        if client_id is None:
+            self._cache.clear()
+        else:
+            self._cache.delete_where(lambda k: k[0] == client_id)
+
+    @property
+    def hits(self) -> int:
+        return self._cache.hits
+
+    @property
+    def misses(self) -> int:
+        return self._cache.misses
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+api_key_cache = ApiKeyCache()
+
+
+class CacheBackend:
+    """Storage for `ResponseCache`.
+
+    The in-process `LocalBackend` is private to each worker. A shared store (redis, memcached)
+    implements the same three methods, and then every worker sees the others' invalidations.
+    Backends are listed in `RESPONSE_CACHE_BACKENDS` and built with the app's config.
+    """
+
+    # whether every worker, and the settlement workers, use the same store
+    shared = True
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes) -> None:
+        raise NotImplementedError
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        raise NotImplementedError
+
+
+class LocalBackend(CacheBackend):
+    """`CacheBackend` on an in-process `LRUCache`"""
+
+    shared = False
+
+    def __init__(self, config):
+        self._cache = LRUCache(
+            maxsize=config["RESPONSE_CACHE_SIZE"], ttl=config["RESPONSE_CACHE_TTL"]
+        )
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._cache.get(key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self._cache.set(key, value)
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            self._cache.delete(key)
+
+
+RESPONSE_CACHE_BACKENDS = {"local": LocalBackend}
+
+
+class ResponseCache:
+    """Serialized per-user responses of the read routes, e.g. the JSON body of /balances/<id>.
+
+    Entries are keyed by the route, the client and the user, so a response is only ever served
+    to the client it was built for, and hold the body with its ETag. An entry is only served
+    while its ETag is still the user's version, see `project.helpers.user_response`, so a body
+    cached by a reader that raced a trade, or by another worker, is rebuilt instead. Trades
+    call `invalidate` once they have committed, see `project.helpers.changed_users`, to free
+    the entries. The TTL bounds how long changes made outside this API that don't bump the
+    version, like authorizing a currency, take to show.
+    """
+
+    # the cached views
+    KINDS = ("balances", "auths")
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.backend = RESPONSE_CACHE_BACKENDS[app.config["RESPONSE_CACHE_BACKEND"]](app.config)
+        self.enabled = app.config["RESPONSE_CACHE_ENABLED"]
+        if self.enabled is None:
+            self.enabled = self.backend.shared
+
+    @staticmethod
+    def key(kind: str, client_id: int, user_id: int) -> str:
+        return f"{kind}:{client_id}:{user_id}"
+
+    def get(self, kind: str, client_id: int, user_id: int) -> Optional[Tuple[str, bytes]]:
+        """the cached (etag, body) of the response, or None"""
+        if not self.enabled:
+            return None
+        value = self.backend.get(self.key(kind, client_id, user_id))
+        if value is None:
+            response_cache_misses.inc()
+            return None
+        response_cache_hits.inc()
+        etag, body = value.split(b" ", 1)
+        return etag.decode(), body
+
+    def set(self, kind: str, client_id: int, user_id: int, etag: str, body: bytes) -> None:
+        if self.enabled:
+            self.backend.set(self.key(kind, client_id, user_id), f"{etag} ".encode() + body)
+
+    def invalidate(self, client_id: int, user_ids: Iterable[int]) -> None:
+        """drops every cached response about these users of the client"""
+        if self.enabled:
+            self.backend.delete_many(
+                self.key(kind, client_id, user_id) for user_id in user_ids for kind in self.KINDS
+            )
+
+
+response_cache = ResponseCache()
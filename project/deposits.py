@@ -0,0 +1,184 @@
+"""Bulk deposits: the positive `Transactions` that buys spend, sent thousands at a time.
+
+POST /deposits/bulk takes {"user_id", "usd_amount", "client_ref"} records, as a JSON array or
+as CSV with a user_id,usd_amount,client_ref header. client_ref is the client's own reference
+for the deposit and is stored in the transaction's client_ref column, whose unique
+(client_id, client_ref) index makes it usable once per client, and resending a batch safe.
+Sell orders' transaction_ids are in inc_key, so they don't collide with deposit references.
+
+On Postgres the records are sent with COPY into a temporary table, and inserted from there
+with a single INSERT ... SELECT that returns the new ids. Elsewhere they are inserted with
+one multi-row INSERT, whose new ids are read back from its rowid range.
+"""
+import csv
+import io
+import itertools
+import math
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import Boolean, DateTime, Integer, column, literal, select, table
+from sqlalchemy.dialects import postgresql, sqlite
+
+from project.helpers import batch_error, missing_fields
+from project.models import Transactions
+
+DEPOSIT_FIELDS = {"user_id": int, "usd_amount": (int, float), "client_ref": str}
+
+# the temporary table COPY writes to, dropped when the transaction ends
+COPY_TABLE = table("deposits_in", column("user_id"), column("usd_amount"), column("client_ref"))
+
+
+def read_json_deposits(body, max_items: int) -> list:
+    """
+    reads the records of a bulk deposit sent as JSON
+
+    :param body: The decoded JSON body, a list of {"user_id", "usd_amount", "client_ref"} objects
+    :param max_items: The largest request accepted
+    :return: The records, unvalidated
+    """
+    error = batch_error(body, max_items)
+    if error:
+        raise ValueError(error)
+    return body
+
+
+def read_csv_deposits(data: bytes, max_items: int) -> list:
+    """
+    reads the records of a bulk deposit sent as CSV
+
+    values that aren't numbers where numbers are expected are kept as they are, for
+    `invalid_fields` to reject
+
+    :param data: The request body, starting with a header naming the `DEPOSIT_FIELDS` columns
+    :param max_items: The largest request accepted
+    :return: The records, unvalidated
+    """
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ValueError("CSV body must be UTF-8") from None
+    reader = csv.DictReader(io.StringIO(text))
+    if reader.fieldnames is None or set(DEPOSIT_FIELDS) - set(reader.fieldnames):
+        raise ValueError(f"CSV body must start with a {','.join(DEPOSIT_FIELDS)} header")
+    records = [
+        {
+            "user_id": _number(row["user_id"], int),
+            "usd_amount": _number(row["usd_amount"], float),
+            "client_ref": row["client_ref"],
+        }
+        # one past the limit is enough to know the body is too large
+        for row in itertools.islice(reader, max_items + 1)
+    ]
+    if not records:
+        raise ValueError("CSV body must have at least one record")
+    error = batch_error(records, max_items)
+    if error:
+        raise ValueError(error)
+    return records
+
+
+def _number(value: str, kind):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def invalid_fields(record) -> list:
+    """the fields of a record that are missing or invalid. amounts must be positive"""
+    invalid = missing_fields(record, DEPOSIT_FIELDS)
+    if "usd_amount" not in invalid and not (
+        math.isfinite(record["usd_amount"]) and record["usd_amount"] > 0
+    ):
+        invalid.append("usd_amount")
+    if "client_ref" not in invalid and not record["client_ref"]:
+        invalid.append("client_ref")
+    return invalid
+
+
+def insert_deposits(session, client_id: int, records: List[dict]) -> Dict[str, int]:
+    """
+    inserts the client's deposits, skipping client_refs the client has already used
+
+    :param session: The session to insert in, committed by the caller
+    :param client_id: The calling client, who owns every record's user
+    :param records: Valid records, with different client_refs
+    :return: A dict of client_ref to the new transaction's id, for the inserted records
+    """
+    if not records:
+        return {}
+    if session.bind.dialect.name == "postgresql":
+        return _copy_deposits(session, client_id, records)
+    return _insert_deposits(session, client_id, records)
+
+
+def _copy_deposits(session, client_id: int, records: List[dict]) -> Dict[str, int]:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        (record["user_id"], repr(float(record["usd_amount"])), record["client_ref"])
+        for record in records
+    )
+    buffer.seek(0)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS deposits_in"
+            " (user_id integer, usd_amount double precision, client_ref varchar) ON COMMIT DROP"
+        )
+        cursor.execute("TRUNCATE deposits_in")
+        cursor.copy_expert(
+            "COPY deposits_in (user_id, usd_amount, client_ref) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    finally:
+        cursor.close()
+    statement = (
+        postgresql.insert(Transactions)
+        .from_select(
+            ["usd_amount", "inc_time", "complete", "client_ref", "user_id", "client_id"],
+            select(
+                COPY_TABLE.c.usd_amount,
+                literal(datetime.utcnow(), DateTime),
+                literal(False, Boolean),
+                COPY_TABLE.c.client_ref,
+                COPY_TABLE.c.user_id,
+                literal(client_id, Integer),
+            ),
+        )
+        .on_conflict_do_nothing(index_elements=["client_id", "client_ref"])
+        .returning(Transactions.client_ref, Transactions.id)
+    )
+    return dict(session.execute(statement).all())
+
+
+def _insert_deposits(session, client_id: int, records: List[dict]) -> Dict[str, int]:
+    now = datetime.utcnow()
+    rows = [
+        {
+            "usd_amount": float(record["usd_amount"]),
+            "inc_time": now,
+            "complete": False,
+            "client_ref": record["client_ref"],
+            "user_id": record["user_id"],
+            "client_id": client_id,
+        }
+        for record in records
+    ]
+    result = session.execute(
+        sqlite.insert(Transactions)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["client_id", "client_ref"])
+    )
+    if result.rowcount < 1:
+        return {}
+    # only the rows this statement inserted, which get consecutive rowids up to the last one,
+    # see `Transactions.create_unique_many`
+    first = result.lastrowid - result.rowcount + 1
+    return dict(
+        session.execute(
+            select(Transactions.client_ref, Transactions.id).where(
+                Transactions.id.between(first, result.lastrowid)
+            )
+        ).all()
+    )
@@ -0,0 +1,128 @@
+"""JSON encoding of response bodies.
+
+Bodies are encoded with orjson when it's installed, and with the standard library otherwise,
+or when orjson can't encode a value (e.g. an int above 64 bits). Both encoders give the same
+compact, key sorted, newline terminated output as flask's `jsonify`, except that non ASCII
+characters are sent as UTF-8 rather than \\u escapes. numpy arrays are encoded as lists.
+
+`iter_object` encodes a body while it is streamed. Those responses have no Content-Length,
+and their "serialize" time is recorded when the stream ends, see `project.instrumentation`.
+
+Exports can also be sent as CSV, with `csv_lines`.
+"""
+import csv
+import io
+import json
+import time
+from typing import Iterable, Iterator
+
+import numpy as np
+from flask import current_app
+from flask.json import JSONEncoder as FlaskJSONEncoder
+
+from project.instrumentation import phase_recorder, record_phase
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+if orjson is not None:
+    ORJSON_OPTIONS = (
+        orjson.OPT_SORT_KEYS
+        | orjson.OPT_APPEND_NEWLINE
+        | orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_SERIALIZE_NUMPY
+    )
+
+
+class JSONEncoder(FlaskJSONEncoder):
+    """flask's encoder, which also encodes numpy arrays and scalars"""
+
+    def default(self, o):
+        if isinstance(o, (np.ndarray, np.generic)):
+            return o.tolist()
+        return super().default(o)
+
+
+def std_dumps(payload) -> bytes:
+    """encodes `payload` with the standard library's json module"""
+    return (
+        json.dumps(
+            payload, cls=JSONEncoder, ensure_ascii=False, sort_keys=True, separators=(",", ":")
+        )
+        + "\n"
+    ).encode()
+
+
+def _dumps(payload) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, option=ORJSON_OPTIONS)
+        except TypeError:
+            pass
+    return std_dumps(payload)
+
+
+def dumps(payload) -> bytes:
+    """encodes a response body, see the module's docstring"""
+    start = time.perf_counter()
+    body = _dumps(payload)
+    record_phase("serialize", time.perf_counter() - start)
+    return body
+
+
+def iter_object(fields: dict, key: str, items: Iterable) -> Iterator[bytes]:
+    """
+    encodes `{**fields, key: list(items)}` one item at a time
+
+    the array goes last instead of in sorted order, so that the items can be encoded as they
+    are read, without building the whole list first
+
+    :param fields: The object's other fields
+    :param key: The name of the array
+    :param items: The array's items
+    :return: The encoded object, in chunks
+    """
+    # the chunks are encoded while the response is sent, after the request is recorded
+    return _iter_object(fields, key, items, phase_recorder("serialize"))
+
+
+def _iter_object(fields: dict, key: str, items: Iterable, record) -> Iterator[bytes]:
+    # only the time spent encoding, not the time the server takes to send each chunk
+    start = time.perf_counter()
+    head = _dumps(fields).rstrip()[:-1]
+    chunk = head + (b"," if fields else b"") + _dumps(key).rstrip() + b":["
+    elapsed = time.perf_counter() - start
+    yield chunk
+    separator = b""
+    for item in items:
+        start = time.perf_counter()
+        chunk = separator + _dumps(item).rstrip()
+        elapsed += time.perf_counter() - start
+        yield chunk
+        separator = b","
+    yield b"]}\n"
+    record(elapsed)
+
+
+def dumps_lines(items: Iterable) -> bytes:
+    """encodes `items` as newline delimited JSON (NDJSON), one item per line"""
+    return b"".join(map(_dumps, items))
+
+
+def csv_lines(rows: Iterable) -> bytes:
+    """encodes `rows` of values as CSV lines"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def encoded_response(body, status: int = 200):
+    """a JSON response whose body is already encoded, as bytes or an iterable of chunks"""
+    return current_app.response_class(body, status=status, mimetype="application/json")
+
+
+def json_response(payload, status: int = 200):
+    """like flask's `jsonify`, encoding `payload` with `dumps`"""
+    return encoded_response(dumps(payload), status)
@@ -9,15 +9,15 @@ class InvalidSymbolError(Exception):
 class MissingHeaderError(Exception):
     pass
 class InsufficientCurrencyError(Exception):
-    from project.models import Users
-    def __init__(self, user: Users, symbol: str, amount: float, *args: object) -> None:
+    from project.models import Holdings
+    def __init__(self, holding: Holdings, amount: float, *args: object) -> None:
         super().__init__(*args)
-        self.user = user
-        self.symbol = symbol
+        self.holding = holding
+        self.symbol = holding.symbol
         self.amount = amount
 
     def __str__(self) -> str:
-        return f"Insufficient {self.symbol}. user_id {self.user.id} only owns {getattr(self.user, self.symbol)})"
+        return f"Insufficient {self.symbol}. user_id {self.holding.user_id} only owns {self.holding.amount})"
 
 class DuplicatePaymentError(Exception):
     from project.models import Transactions
@@ -29,12 +29,37 @@ class DuplicatePaymentError(Exception):
         return f"transaction {self.transaction.id} Already completed. \nTransaction initiated at datetime_utc: {self.transaction.inc_time}\n Transaction completed at datetime_utc: {self.transaction.complete_time}"
 
 class UnauthorizedCurrencyError(Exception):
-    from project.models import Users
+    from project.models import Holdings
 
-    def __init__(self, user: Users, symbol: str, *args: object) -> None:
+    def __init__(self, holding: Holdings, *args: object) -> None:
         super().__init__(*args)
-        self.user = user
-        self.symbol = symbol
+        self.holding = holding
+        self.symbol = holding.symbol
 
     def __str__(self) -> str:
-        return f"User {self.user.id} is not authorized to purchase {self.symbol}"
+        return f"User {self.holding.user_id} is not authorized to purchase {self.symbol}"
+
+
+class StaleRatesError(Exception):
+    from project.rates import RateSnapshot
+
+    def __init__(self, snapshot: RateSnapshot, *args: object) -> None:
+        super().__init__(*args)
+        self.snapshot = snapshot
+
+    def __str__(self) -> str:
+        return f"Exchange rates are stale. version {self.snapshot.version} was fetched {self.snapshot.age():.0f} seconds ago"
+
+
+class UnauthorizedClientError(Exception):
+    def __str__(self) -> str:
+        return "unauthorized client"
+
+
+class DuplicateOrderError(Exception):
+    def __str__(self) -> str:
+        return "Sell order already submitted"
+
+
+class QueryBudgetError(Exception):
+    pass
@@ -1,12 +1,27 @@
-import math
+import itertools
+import random
+import time
+import zlib
 from contextlib import contextmanager
-from typing import Tuple
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Iterable, Iterator, Tuple
 
-from flask import jsonify
+from flask import current_app
+from sqlalchemy import event, tuple_
+from sqlalchemy.orm import Session, joinedload, scoped_session
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.datastructures import ETags
+from werkzeug.exceptions import NotFound
 from werkzeug.http import HTTP_STATUS_CODES
 
 from project.globals import ACCEPTED_SYMBOLS
 from project.app import db
+from project.budget import stream_budget
+from project.cache import api_key_cache, response_cache
+from project.encoding import dumps, encoded_response
+from project.metrics import trade_conflicts, trade_retries
+from project.rates import RateSnapshot, rate_store
 
 
 @contextmanager
@@ -23,68 +38,512 @@ def db_session(autocommit: bool = True):
         db.session.remove()
 
 
+def after_commit(session, callback) -> None:
+    """
+    runs `callback` once the session's transaction commits. a rollback drops it instead, and
+    so does rolling back the savepoint it was added in
+    """
+    if isinstance(session, scoped_session):
+        session = session()
+    session.info.setdefault("after_commit", []).append((session.get_nested_transaction(), callback))
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session):
+    if session.in_nested_transaction():
+        # a savepoint was released, the transaction itself hasn't committed yet
+        return
+    for _, callback in session.info.pop("after_commit", ()):
+        callback()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_after_commit(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("after_commit", None)
+    elif previous_transaction.nested and "after_commit" in session.info:
+        session.info["after_commit"] = [
+            (added_in, callback)
+            for added_in, callback in session.info["after_commit"]
+            if not _within(added_in, previous_transaction)
+        ]
+
+
+def _within(transaction, savepoint) -> bool:
+    """whether `transaction` is `savepoint` or one of the transactions nested in it"""
+    while transaction is not None:
+        if transaction is savepoint:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+# called with (client_id, user_ids) once a trade that changed the users has committed
+user_change_listeners = []
+
+
+def changed_users(session, client_id: int, user_ids: Iterable[int]) -> None:
+    """
+    drops the cached responses of users a trade changed and calls `user_change_listeners`,
+    once the trade has committed
+    """
+    user_ids = list(user_ids)
+
+    def committed():
+        response_cache.invalidate(client_id, user_ids)
+        for listener in user_change_listeners:
+            listener(client_id, user_ids)
+
+    after_commit(session, committed)
+
+
 from project.exceptions import (
     TransactionMismatchError,
     TransactionNotFoundError,
     InvalidSymbolError,
     DuplicatePaymentError,
+    DuplicateOrderError,
     InsufficientCurrencyError,
+    MissingHeaderError,
+    UnauthorizedClientError,
+    UnauthorizedCurrencyError,
+    StaleRatesError,
+)
+from project.models import Holdings, Transactions, Users
+from project.statements import (
+    CLIENT_WITH_KEY,
+    TRANSACTION,
+    TRANSACTION_FOR_UPDATE,
+    USER,
+    first,
 )
-from project.models import Users, Transactions
+
+# the largest id of an integer primary key on Postgres
+MAX_ID = 2**31 - 1
 
 
 @contextmanager
-def transaction(transaction_id: int, usd_amount: float, user_id: int) -> Transactions:
-    """Verifies and completes transaction"""
-    transaction = Transactions.query.with_for_update().get(transaction_id)
+def transaction(
+    transaction_id: int,
+    usd_amount: float,
+    user_id: int,
+    rate_version: int = None,
+    optimistic: bool = False,
+    session=None,
+) -> Transactions:
+    """Verifies and completes transaction
+
+    with `optimistic` the row isn't locked, and is completed with a conditional UPDATE instead.
+    `session` defaults to `db.session`
+    """
+    session = db.session if session is None else session
+    statement = TRANSACTION if optimistic else TRANSACTION_FOR_UPDATE
+    transaction = first(session, statement, transaction_id=transaction_id)
+    verify_transaction(transaction, usd_amount, user_id)
+    yield transaction
+    if optimistic:
+        Transactions.complete_pending(transaction.id, rate_version, session)
+    else:
+        transaction.completed(rate_version)
+
+
+def optimistic() -> bool:
+    """whether trades run in optimistic mode, see `TRADE_LOCKING` in `project.config`"""
+    return current_app.config["TRADE_LOCKING"] == "optimistic"
+
+
+def retry_on_conflict(view):
+    """
+    decorator for trade routes, re-running the whole route when an optimistic trade conflicts
+
+    every attempt runs in a fresh session. attempts back off exponentially with full jitter,
+    and once `OPTIMISTIC_MAX_RETRIES` is used up the client gets a 409
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        config = current_app.config
+        for attempt in range(config["OPTIMISTIC_MAX_RETRIES"] + 1):
+            try:
+                return view(*args, **kwargs)
+            except StaleDataError:
+                trade_conflicts.inc()
+            if attempt < config["OPTIMISTIC_MAX_RETRIES"]:
+                trade_retries.inc()
+                time.sleep(conflict_backoff(attempt, config))
+        return error_response(409, CONFLICT_MESSAGE)
+
+    return wrapper
+
+
+CONFLICT_MESSAGE = "trade conflicted with concurrent updates, please retry"
+
+
+def conflict_backoff(attempt: int, config) -> float:
+    """seconds to wait before retrying a conflicted trade: exponential, with full jitter"""
+    delay = min(config["OPTIMISTIC_BACKOFF_MAX"], config["OPTIMISTIC_BACKOFF"] * 2**attempt)
+    return random.uniform(0, delay)
+
+
+def client_credentials(headers) -> Tuple[int, str]:
+    """
+    reads the client_id and authorization headers every route requires
+
+    :param headers: The request's werkzeug `Headers`
+    :return: A tuple of the client id and the API key. raises `MissingHeaderError`, with the
+        message for the client, if either is missing
+    """
+    client_id = headers.get("client_id", type=int)
+    if client_id is None:
+        raise MissingHeaderError("'client_id' header required")
+    auth = headers.get("authorization", type=str)
+    if auth is None:
+        raise MissingHeaderError("'Authorization' header required")
+    return client_id, auth
+
+
+def required_header(headers, name: str) -> str:
+    """returns the header `name`, raising `MissingHeaderError` if the request doesn't have it"""
+    value = headers.get(name)
+    if value is None:
+        raise MissingHeaderError(f"'{name}' header required")
+    return value
+
+
+def deposit_id(transaction_id: str) -> int:
+    """
+    the id of the deposit a buy spends, from its transaction_id header
+
+    the statements bind it as an integer, which drivers like asyncpg won't cast a string to.
+    raises `TransactionNotFoundError` for a value that can't be a transactions id
+    """
+    if not (transaction_id.isascii() and transaction_id.isdigit()) or int(transaction_id) > MAX_ID:
+        raise TransactionNotFoundError
+    return int(transaction_id)
+
+
+def verify_client(session, client_id: int, key: str) -> None:
+    """
+    checks an API key against the database and caches the result
+
+    raises werkzeug's `NotFound` if the client doesn't exist and `InvalidTokenError` if the
+    key is wrong. callers check `api_key_cache.verified` first
+
+    :param session: The session to query with
+    :param client_id: The calling client
+    :param key: The key from the authorization header
+    """
+    client = first(session, CLIENT_WITH_KEY, client_id=client_id)
+    if client is None:
+        raise NotFound()
+    client.auth_key(key)
+    api_key_cache.store(client_id, key)
+
+
+def client_user(session, user_id: int, client_id: int) -> Users:
+    """
+    loads a user, with their client and holdings, for the read only routes
+
+    raises werkzeug's `NotFound` if the user doesn't exist and `UnauthorizedClientError` if
+    they belong to another client
+    """
+    # populate_existing, so that a user already in the session is reloaded with its client
+    # and holdings instead of lazy loading them
+    user = session.get(
+        Users,
+        user_id,
+        options=[joinedload(Users.client), joinedload(Users.holdings)],
+        populate_existing=True,
+    )
+    if user is None:
+        raise NotFound()
+    if user.client_id != client_id:
+        raise UnauthorizedClientError
+    return user
+
+
+def user_response(
+    session, kind: str, user_id: int, client_id: int, if_none_match: ETags
+) -> Tuple[int, str, bytes]:
+    """
+    builds the response of /balances/<id> ("balances") or /list/<id> ("auths")
+
+    if the request has an If-None-Match header or `response_cache` is enabled, the user's
+    version is looked up first with a single indexed query. a matching ETag gets a 304, and a
+    cached body built at that version is served, without loading the user. otherwise the body
+    is built, and cached unless it was read from the replica, which may be behind the version
+    other readers compare against. raises like `client_user`
+
+    :param session: The session to query with
+    :param if_none_match: The request's parsed If-None-Match header
+    :return: A tuple of the status, the ETag and the JSON body
+    """
+    if if_none_match or response_cache.enabled:
+        owner = Users.owner_and_version(session, user_id)
+        if owner is not None and owner[0] == client_id:
+            current = str(owner[1])
+            if if_none_match.contains(current):
+                return 304, current, b""
+            cached = response_cache.get(kind, client_id, user_id)
+            if cached is not None and cached[0] == current:
+                return 200, current, cached[1]
+    user = client_user(session, user_id, client_id)
+    etag = str(user.version)
+    body = dumps(user.balance_to_dict() if kind == "balances" else user.auth_to_dict())
+    if not session.info.get("replica"):
+        response_cache.set(kind, client_id, user_id, etag, body)
+    return 200, etag, body
+
+
+def buy_order(
+    session,
+    user_id: int,
+    symbol: str,
+    usd_amount: float,
+    client_id: int,
+    transaction_id: int,
+    optimistic: bool = False,
+) -> int:
+    """
+    Buy: spends the deposit `transaction_id` on `symbol` for the user
+
+    raises werkzeug's `NotFound` if the user doesn't exist, or one of `TRADE_ERRORS`. the
+    caller commits, or rolls back on error
+
+    :param session: The session to trade in
+    :param optimistic: Skip the row locks, see `TRADE_LOCKING` in `project.config`
+    :return: The id of the spent deposit
+    """
+    snapshot = rate_store.fresh()
+    user = first(session, USER, user_id=user_id)
+    if user is None:
+        raise NotFound()
+    if user.client_id != client_id:
+        raise UnauthorizedClientError
+    holding = Holdings.lock(user.id, symbol, optimistic, session)
+    with transaction(
+        transaction_id, usd_amount, user.id, snapshot.version, optimistic, session
+    ) as deposit:
+        holding.purchase(usd_amount, snapshot)
+    changed_users(session, client_id, [user.id])
+    return deposit.id
+
+
+def sell_order(
+    session,
+    user_id: int,
+    symbol: str,
+    currency_amount: float,
+    client_id: int,
+    transaction_id: str,
+    optimistic: bool = False,
+) -> int:
+    """
+    Sell: sells `currency_amount` of the user's `symbol`, recording the order under `transaction_id`
+
+    raises werkzeug's `NotFound` if the user doesn't exist, or one of `TRADE_ERRORS`,
+    `DuplicateOrderError` if the client already sent this transaction_id. the caller
+    commits, or rolls back on error
+
+    :param session: The session to trade in
+    :param optimistic: Skip the row locks, see `TRADE_LOCKING` in `project.config`
+    :return: The id of the order's transaction
+    """
+    snapshot = rate_store.fresh()
+    user = first(session, USER, user_id=user_id)
+    if user is None:
+        raise NotFound()
+    if user.client_id != client_id:
+        raise UnauthorizedClientError
+    holding = Holdings.lock(user.id, symbol, optimistic, session)
+    usd = sell_currency(holding, currency_amount, snapshot)
+    order_id = Transactions.create_unique(
+        usd_amount=-usd,
+        user_id=user.id,
+        inc_key=transaction_id,
+        client_id=client_id,
+        rate_version=snapshot.version,
+        session=session,
+    )
+    if order_id is None:
+        raise DuplicateOrderError
+    changed_users(session, client_id, [user.id])
+    return order_id
+
+
+def verify_transaction(transaction: Transactions, usd_amount: float, user_id: int) -> None:
+    """
+    verifies that a deposit exists, matches the order and has not been spent yet
+
+    :param transaction: The locked Transactions row, or None if it does not exist
+    :param usd_amount: The USD amount the order claims was deposited
+    :param user_id: The user the order is for
+    """
     if transaction is None:
         raise TransactionNotFoundError
     if transaction.usd_amount != usd_amount or transaction.user_id != user_id:
         raise TransactionMismatchError
     if transaction.complete:
         raise DuplicatePaymentError(transaction)
-    yield transaction
-    transaction.completed()
 
 
-def convert_to_crypto(usd: float, symbol: str) -> float:
-    """converts usd amounts to crypto.
+def query_param(args, name: str, parse, expected: str):
+    """
+    parses the query parameter `name` with `parse`
 
-    in a real application this would be though an API
+    raises `ValueError` with a message for the client if the parameter is invalid
+
+    :param args: The request's query parameters
+    :param parse: Converts the parameter's string, raising ValueError, TypeError or KeyError
+    :param expected: What the parameter should be, for the error message
+    """
+    try:
+        return parse(args[name])
+    except (ValueError, TypeError, KeyError):
+        raise ValueError(f"'{name}' must be {expected}") from None
+
+
+def parse_utc(value: str) -> datetime:
+    """an ISO 8601 time as a naive UTC datetime, the way times are stored. naive times are UTC"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_history_cursor(value: str) -> Tuple[datetime, int]:
+    """the (inc_time, id) of a `history_cursor`"""
+    inc_time, _, id = value.rpartition(",")
+    return parse_utc(inc_time), int(id)
+
+
+def history_cursor(row) -> str:
+    """the `after` parameter of GET /transactions that continues after a `history_query` row"""
+    return f"{row.inc_time.isoformat()},{row.id}"
+
+
+def history_statement(args, client_id: int):
+    """
+    the client's transactions matching the query parameters of GET /transactions, as a
+    `Transactions.history_query` without a limit
+
+    raises `ValueError` with a message for the client if a parameter is invalid
+
+    :param args: The request's query parameters: user_id, since, until, complete and after
+    :param client_id: The calling client, the only one whose transactions are read
+    """
+    statement = Transactions.history_query().where(Transactions.client_id == client_id)
+    if "user_id" in args:
+        user_id = query_param(args, "user_id", int, "a user id")
+        statement = statement.where(Transactions.user_id == user_id)
+    if "since" in args:
+        since = query_param(args, "since", parse_utc, "an ISO 8601 time")
+        statement = statement.where(Transactions.inc_time >= since)
+    if "until" in args:
+        until = query_param(args, "until", parse_utc, "an ISO 8601 time")
+        statement = statement.where(Transactions.inc_time < until)
+    if "complete" in args:
+        flags = {"true": True, "false": False}
+        complete = query_param(args, "complete", flags.__getitem__, "true or false")
+        statement = statement.where(Transactions.complete.is_(complete))
+    if "after" in args:
+        cursor = query_param(args, "after", parse_history_cursor, "a cursor from a previous page")
+        statement = statement.where(
+            tuple_(Transactions.inc_time, Transactions.id) > tuple_(*cursor)
+        )
+    return statement
+
+
+def stream_rows(engine, statement, encode, head: bytes = b"", gzip: bool = False) -> Iterator[bytes]:
+    """
+    the body of a streamed response listing the rows of `statement`
+
+    the rows are read `STREAM_YIELD_PER` at a time from a server side cursor, on a connection
+    of their own, since the body is sent after the request's session is gone. that's a single
+    statement, checked with `stream_budget` since it's sent after the view's budget was
+
+    :param engine: The engine to read from
+    :param encode: Encodes a list of rows as bytes
+    :param head: Sent before the rows, e.g. a CSV header
+    :param gzip: Compress the body with gzip
+    :return: The body, in chunks
+    """
+    yield_per = current_app.config["STREAM_YIELD_PER"]
+
+    def chunks():
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        compressor = zlib.compressobj(wbits=31) if gzip else None
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(statement)
+            for chunk in itertools.chain(
+                [head], map(encode, result.yield_per(yield_per).partitions())
+            ):
+                chunk = compressor.compress(chunk) if gzip else chunk
+                if chunk:
+                    yield chunk
+        if gzip:
+            yield compressor.flush()
+
+    return stream_budget(chunks(), 1)
+
+
+def user_owners(ids: Iterable[int]) -> dict:
+    """
+    looks up which client each user belongs to, with a single query and without locking
+
+    :param ids: The user ids to look up
+    :return: A dict of user id to client id. missing users are left out
+    """
+    return dict(db.session.query(Users.id, Users.client_id).filter(Users.id.in_(set(ids))))
+
+
+def lock_rows(model, ids: Iterable[int]) -> dict:
+    """
+    locks every row of `model` with a primary key in `ids` using a single `SELECT ... FOR UPDATE`
+
+    rows are locked in id order so that concurrent batches cannot deadlock each other
+
+    :param model: The model to lock rows of, e.g. Transactions
+    :param ids: The primary keys to lock
+    :return: A dict of primary key to locked row. missing ids are left out
+    """
+    rows = (
+        model.query.filter(model.id.in_(sorted(set(ids))))
+        .order_by(model.id)
+        .with_for_update()
+        .all()
+    )
+    return {row.id: row for row in rows}
+
+
+def convert_to_crypto(usd: float, symbol: str, snapshot: RateSnapshot = None) -> float:
+    """converts usd amounts to crypto.
 
     :param amount: The USD amount the user is spending
     :param symbol: The acronym representing the crypto you want to purchase, e.g. "BTC"
+    :param snapshot: The rates to convert with, defaults to the current `rate_store` snapshot
     :return: The amount of crypto acquired.
     """
-    conversion = {
-        "BTC": 0.0000233678,
-        "ETH": 0.00030321,
-        "DOGE": 8.10,
-        "USDT": 1,
-        "BNB": 0.00234261,
-    }
-    return usd * conversion[symbol]
- 
+    return usd * (snapshot or rate_store.snapshot).rates[symbol]
 
 
-def convert_to_usd(amount: float, symbol: str) -> float:
+def convert_to_usd(amount: float, symbol: str, snapshot: RateSnapshot = None) -> float:
     """converts crypto to usd
 
-    in a real application this would be though an API
-
     :param amount: The quantity crypto you want to convert to USD
     :param symbol: The acronym representing the crypto you want to convert, e.g. "BTC"
+    :param snapshot: The rates to convert with, defaults to the current `rate_store` snapshot
     :return: The amount of USD to be paid to the user.
     """
+    return amount / (snapshot or rate_store.snapshot).rates[symbol]
 
-    conversion = {
-        "BTC": 0.0000233678,
-        "ETH": 0.00030321,
-        "DOGE": 8.10,
-        "USDT": 1,
-        "BNB": 0.00234261,
-    }
-    return amount / conversion[symbol]
+
+def error_payload(status_code: int, message=None) -> dict:
+    """the JSON body of an error response, see `error_response`"""
+    payload = {"error": HTTP_STATUS_CODES.get(status_code, "Unknown error")}
+    if message:
+        payload["message"] = message
+    return payload
 
 
 def error_response(status_code: int, message=None) -> Tuple[str, str]:
@@ -94,12 +553,13 @@ def error_response(status_code: int, message=None) -> Tuple[str, str]:
     :param message: The error message to return to the client
     :return: A tuple of two strings.
     """
-    payload = {"error": HTTP_STATUS_CODES.get(status_code, "Unknown error")}
-    if message:
-        payload["message"] = message
-    response = jsonify(payload)
-    response.status_code = status_code
-    return response
+    return encoded_response(error_body(status_code, message), status_code)
+
+
+def error_body(status_code: int, message=None) -> bytes:
+    """the encoded JSON body of an error response, pre-encoded for `CONSTANT_ERRORS`"""
+    body = CONSTANT_ERRORS.get((status_code, message))
+    return body if body is not None else dumps(error_payload(status_code, message))
 
 
 def bad_request(message) -> Tuple[str, str]:
@@ -107,17 +567,130 @@ def bad_request(message) -> Tuple[str, str]:
     return error_response(400, message)
 
 
-def verify_currency(user: Users, symbol: str, amount: float) -> None:
+# error bodies that never change, encoded once here instead of on every response
+CONSTANT_ERRORS = {
+    (status_code, message): dumps(error_payload(status_code, message))
+    for status_code, message in [
+        (400, "'client_id' header required"),
+        (400, "'Authorization' header required"),
+        (400, "'transaction_id' header required"),
+        (401, "invalid API key"),
+        (401, "unauthorized client"),
+        (401, "Transaction not found"),
+        (401, "Transaction details do not match"),
+        (401, f"{DuplicateOrderError()}"),
+        (409, CONFLICT_MESSAGE),
+    ]
+}
+
+
+TRADE_ERRORS = (
+    UnauthorizedClientError,
+    DuplicateOrderError,
+    StaleRatesError,
+    InvalidSymbolError,
+    TransactionNotFoundError,
+    TransactionMismatchError,
+    DuplicatePaymentError,
+    UnauthorizedCurrencyError,
+    InsufficientCurrencyError,
+)
+
+
+def trade_error(error: Exception, symbol: str) -> Tuple[int, str]:
+    """
+    maps an exception raised while trading to the status code and message sent to the client
+
+    :param error: One of the exceptions in `TRADE_ERRORS`
+    :param symbol: The symbol the order was for
+    :return: A tuple of the status code and the error message
+    """
+    if isinstance(error, StaleRatesError):
+        return 503, f"{error}"
+    if isinstance(error, InvalidSymbolError):
+        return 404, f"'{symbol}' is not a valid symbol"
+    if isinstance(error, TransactionNotFoundError):
+        return 401, "Transaction not found"
+    if isinstance(error, TransactionMismatchError):
+        return 401, "Transaction details do not match"
+    return 401, f"{error}"
+
+
+def batch_error(payload, max_items: int):
+    """
+    checks the overall shape of a batch request body
+
+    :param payload: The decoded JSON body
+    :param max_items: The largest batch accepted
+    :return: An error message, or None if the batch can be processed
+    """
+    if not isinstance(payload, list) or not payload:
+        return "request body must be a non-empty JSON array"
+    if len(payload) > max_items:
+        return f"batches are limited to {max_items} items"
+    return None
+
+
+def batch_result(item, status: int, message: str = None, key: str = "transaction_id") -> dict:
+    """
+    builds the entry for one item of a batch response
+
+    :param item: The batch item the result is for
+    :param status: The status code the equivalent single request would have returned
+    :param message: The error message, if the item failed
+    :param key: The field of the item that identifies it
+    :return: A dict with the item's `key` field, status and message
+    """
+    result = {
+        key: item.get(key) if isinstance(item, dict) else None,
+        "status": status,
+    }
+    if message:
+        result["message"] = message
+    return result
+
+
+def missing_fields(item, fields: dict) -> list:
+    """
+    lists the fields of a batch item that are missing or of the wrong type
+
+    :param item: One element of a batch request
+    :param fields: Field name to the accepted type(s)
+    :return: The names of the invalid fields
+    """
+    if not isinstance(item, dict):
+        return list(fields)
+    return [
+        name
+        for name, kind in fields.items()
+        if not isinstance(item.get(name), kind) or isinstance(item.get(name), bool)
+    ]
+
+
+def verify_currency(holding: Holdings, amount: float) -> None:
     """
     verifies that the user has enough of the currency they're trying to sell
-    
-    :param user: Users - The user object that you want to verify the currency for
-    :param symbol: The currency symbol, e.g. "BTC"
+
+    :param holding: Holdings - The user's holding of the currency
     :param amount: The amount of currency to be verified
     """
-    if symbol not in ACCEPTED_SYMBOLS:
+    if holding.symbol not in ACCEPTED_SYMBOLS:
         raise InvalidSymbolError
-    try:
-        assert amount <= getattr(user, symbol)
-    except AssertionError:
-        raise InsufficientCurrencyError(user, symbol, amount)
+    if amount > holding.amount:
+        raise InsufficientCurrencyError(holding, amount)
+
+
+def sell_currency(holding: Holdings, amount: float, snapshot: RateSnapshot = None) -> float:
+    """
+    verifies and removes the currency a user is selling from their holdings
+
+    :param holding: Holdings - The (locked) holding of the currency being sold
+    :param amount: The amount of currency being sold
+    :param snapshot: The rates to convert with, defaults to the current `rate_store` snapshot
+    :return: The amount of USD to be paid to the user.
+    """
+    holding.allowed_currency()
+    verify_currency(holding, amount)
+    usd = convert_to_usd(amount, holding.symbol, snapshot)
+    holding.amount -= amount
+    return usd
@@ -0,0 +1,269 @@
+"""Per route request and SQL metrics, and the /metrics endpoint.
+
+`RequestMetrics` times every request of the Flask app. It also counts the SQL statements the
+request sends and how long they take, through engine events, which includes the time spent
+in `SELECT ... FOR UPDATE` statements waiting for row locks. Code can time parts of a request
+with `timed`; `check_api_key` is timed as "auth" and response encoding as "serialize".
+Streamed bodies are encoded after the request is recorded, so their "serialize" time is
+recorded on its own when the stream ends, with `phase_recorder`.
+
+Everything in `project.metrics` is served in the Prometheus text format at `METRICS_PATH`.
+It is served without an API key, or only with `Authorization: Bearer <METRICS_TOKEN>` when
+that is set.
+
+Each gunicorn worker keeps its own metrics, so a scrape would only see the worker that
+answered it. With `METRICS_MULTIPROC_DIR` set, every worker writes its metrics to a file in
+that directory every `METRICS_FLUSH_INTERVAL` seconds, from a daemon thread, and when it
+exits, so an idle worker's file is as current as a busy one's. /metrics
+then serves the sum over all the files. Gauges are served per worker, with a "pid" label,
+and only for workers that are still running. Empty the directory whenever the server
+starts; `gunicorn.conf.py` does that.
+
+Metrics that aren't any process's, like the settlement queue's depth, are measured by the
+collectors added with `RequestMetrics.add_collector` whenever /metrics is served.
+"""
+import atexit
+import glob
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from project.metrics import Counter, Histogram, collect, merge, render
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50, 100)
+
+http_requests = Counter("http_requests_total", "requests answered", ("route", "status"))
+http_request_seconds = Histogram(
+    "http_request_duration_seconds", "time to answer a request", LATENCY_BUCKETS, ("route",)
+)
+http_phase_seconds = Histogram(
+    "http_request_phase_seconds",
+    "time spent in a part of a request: auth (check_api_key) or serialize (JSON encoding)",
+    LATENCY_BUCKETS,
+    ("route", "phase"),
+)
+db_request_statements = Histogram(
+    "db_statements_per_request", "SQL statements sent by a request", STATEMENT_BUCKETS, ("route",)
+)
+db_request_seconds = Histogram(
+    "db_statement_seconds_per_request",
+    "time a request spent executing SQL statements",
+    LATENCY_BUCKETS,
+    ("route",),
+)
+db_lock_wait_seconds = Histogram(
+    "db_lock_wait_seconds_per_request",
+    "time a request spent in SELECT ... FOR UPDATE statements, mostly waiting for row locks",
+    LATENCY_BUCKETS,
+    ("route",),
+)
+
+_local = threading.local()
+
+
+class _RequestTimings:
+    """What the current request spent, filled in by the engine events and `timed`"""
+
+    __slots__ = ("started", "statements", "sql", "lock_wait", "phases")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql = 0.0
+        self.lock_wait = 0.0
+        self.phases = {}
+
+
+@contextmanager
+def timed(phase: str):
+    """adds the time spent in the block to `phase` of the current request's timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+
+def record_phase(phase: str, seconds: float) -> None:
+    """adds `seconds` to `phase` of the current request, if there is one"""
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        timings.phases[phase] = timings.phases.get(phase, 0.0) + seconds
+
+
+def phase_recorder(phase: str) -> Callable[[float], None]:
+    """
+    a function that records `phase` of the current request, if there is one, even after it
+    is over, for work done while its body is streamed
+    """
+    if getattr(_local, "timings", None) is None:
+        return lambda seconds: None
+    series = http_phase_seconds.labels(request.endpoint or "unmatched", phase)
+    return series.observe
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, "timings", None) is not None:
+        _local.statement_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = getattr(_local, "timings", None)
+    if timings is None:
+        return
+    elapsed = time.perf_counter() - _local.statement_started
+    timings.statements += 1
+    timings.sql += elapsed
+    if "FOR UPDATE" in statement:
+        timings.lock_wait += elapsed
+
+
+class RequestMetrics:
+    """Records per route metrics for every request and serves /metrics"""
+
+    def __init__(self, app=None):
+        self.multiproc_dir = None
+        self.flush_interval = 1.0
+        self._flush_lock = threading.Lock()
+        self._flusher_pid = None
+        self.collectors = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.multiproc_dir = app.config["METRICS_MULTIPROC_DIR"]
+        self.flush_interval = app.config["METRICS_FLUSH_INTERVAL"]
+        if self.multiproc_dir:
+            os.makedirs(self.multiproc_dir, exist_ok=True)
+            atexit.register(self.flush)
+            self.start_flusher()
+        app.before_request(self.start_request)
+        app.after_request(self.count_response)
+        app.teardown_request(self.finish_request)
+        if app.config["METRICS_PATH"]:
+            app.add_url_rule(app.config["METRICS_PATH"], "metrics", self.view, methods=["GET"])
+
+    def start_request(self) -> None:
+        _local.timings = _RequestTimings()
+        self.start_flusher()
+
+    def count_response(self, response):
+        http_requests.labels(request.endpoint or "unmatched", response.status_code).inc()
+        return response
+
+    def finish_request(self, exc=None) -> None:
+        timings = getattr(_local, "timings", None)
+        _local.timings = None
+        if timings is None:
+            return
+        route = request.endpoint or "unmatched"
+        http_request_seconds.labels(route).observe(time.perf_counter() - timings.started)
+        db_request_statements.labels(route).observe(timings.statements)
+        db_request_seconds.labels(route).observe(timings.sql)
+        db_lock_wait_seconds.labels(route).observe(timings.lock_wait)
+        for phase, seconds in timings.phases.items():
+            http_phase_seconds.labels(route, phase).observe(seconds)
+
+    def add_collector(self, collector) -> None:
+        """
+        serves what `collector` returns on /metrics as it is, besides the processes' metrics
+
+        :param collector: Called whenever /metrics is served, in the app context, and returns
+            a collection like `project.metrics.collect` does
+        """
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def start_flusher(self) -> None:
+        """
+        starts the daemon thread that `flush`es every `METRICS_FLUSH_INTERVAL`, once per process
+
+        threads don't survive a fork, so a worker forked after `init_app` starts its own on its
+        first request
+        """
+        pid = os.getpid()
+        if not self.multiproc_dir or self._flusher_pid == pid:
+            return
+        with self._flush_lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+        flusher = threading.Thread(target=self._flush_every_interval, name="metrics-flush")
+        flusher.daemon = True
+        flusher.start()
+
+    def _flush_every_interval(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                logging.getLogger(__name__).warning("could not write metrics", exc_info=True)
+
+    def flush(self) -> None:
+        """writes this process's metrics to `METRICS_MULTIPROC_DIR`"""
+        if not self.multiproc_dir:
+            return
+        with self._flush_lock:
+            path = os.path.join(self.multiproc_dir, f"{os.getpid()}.json")
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(collect(), f)
+            os.replace(f"{path}.tmp", path)
+
+    def collect_all(self) -> dict:
+        """the metrics of every worker with `METRICS_MULTIPROC_DIR`, otherwise this process's"""
+        if not self.multiproc_dir:
+            return collect()
+        self.flush()
+        collections, live = {}, set()
+        for path in glob.glob(os.path.join(self.multiproc_dir, "*.json")):
+            pid = int(os.path.basename(path)[: -len(".json")])
+            try:
+                with open(path) as f:
+                    collections[pid] = json.load(f)
+            except (OSError, ValueError):
+                logging.getLogger(__name__).warning("could not read metrics file %s", path)
+                continue
+            if _running(pid):
+                live.add(pid)
+        return merge(collections, live)
+
+    def view(self):
+        from flask import current_app
+
+        from project.helpers import error_response
+
+        token = current_app.config["METRICS_TOKEN"]
+        if token is not None:
+            given = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+                return error_response(401, "invalid metrics token")
+        collected = self.collect_all()
+        for collector in self.collectors:
+            collected.update(collector())
+        return current_app.response_class(render(collected), mimetype="text/plain; version=0.0.4")
+
+
+def _running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # running, as another user
+    return True
+
+
+request_metrics = RequestMetrics()
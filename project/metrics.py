@@ -0,0 +1,276 @@
+import bisect
+import itertools
+import threading
+
+# every metric created, by name
+REGISTRY = {}
+
+
+class _Metric:
+    """Base of the metric types.
+
+    A metric with `labelnames` keeps a separate value for every combination of label values,
+    in the child returned by `labels`. Children aren't registered, their parent is.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames: tuple = (), registry=REGISTRY):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry[name] = self
+
+    def labels(self, *values) -> "_Metric":
+        """the child of this metric for the given label values, in `labelnames` order"""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}")
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+    def _child(self) -> "_Metric":
+        return type(self)(self.name, self.description, registry=None)
+
+    def samples(self) -> list:
+        """(label values, metric) pairs of everything recorded, for `collect`"""
+        if self.labelnames:
+            return sorted(self._children.items())
+        return [((), self)]
+
+    def state(self):
+        """the recorded value(s), as JSON serializable data"""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A thread safe count that only goes up"""
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labelnames: tuple = (), registry=REGISTRY):
+        super().__init__(name, description, labelnames, registry)
+        self._value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def state(self):
+        return self._value
+
+
+class Gauge(_Metric):
+    """A thread safe value that can go up and down"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, description: str, labelnames: tuple = (), registry=REGISTRY):
+        super().__init__(name, description, labelnames, registry)
+        self._value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value) -> None:
+        with self._lock:
+            self._value = value
+
+    @property
+    def value(self):
+        return self._value
+
+    def state(self):
+        return self._value
+
+
+class Histogram(_Metric):
+    """Thread safe counts of observed values, by upper bound, with their sum.
+
+    `buckets` are the upper bounds, in increasing order. An infinite bucket is always added.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        buckets: tuple,
+        labelnames: tuple = (),
+        registry=REGISTRY,
+    ):
+        super().__init__(name, description, labelnames, registry)
+        self.bounds = tuple(buckets) + (float("inf"),)
+        self._counts = [0] * len(self.bounds)
+        self._sum = 0.0
+
+    def _child(self) -> "Histogram":
+        return Histogram(self.name, self.description, self.bounds[:-1], registry=None)
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @property
+    def buckets(self) -> list:
+        """(upper bound, cumulative count) pairs"""
+        with self._lock:
+            return list(zip(self.bounds, itertools.accumulate(self._counts)))
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def state(self):
+        with self._lock:
+            return [list(self._counts), self._sum]
+
+
+def collect(registry=REGISTRY) -> dict:
+    """
+    everything recorded by the metrics in `registry`, as JSON serializable data
+
+    :return: A dict of metric name to its type, description, label names, bucket bounds for
+        histograms, and a list of [label values, state] samples
+    """
+    collected = {}
+    for name, metric in sorted(registry.items()):
+        collected[name] = {
+            "type": metric.type,
+            "help": metric.description,
+            "labelnames": list(metric.labelnames),
+            "bounds": list(getattr(metric, "bounds", ())),
+            "samples": [[list(values), child.state()] for values, child in metric.samples()],
+        }
+    return collected
+
+
+def merge(collections: dict, live: set = None) -> dict:
+    """
+    combines what several processes collected into one collection
+
+    counters and histograms are summed. gauges can't be, so every process's gauges are kept
+    with a "pid" label, and only those of the `live` processes if it's given
+
+    :param collections: A dict of process id to what `collect` returned in that process
+    :param live: The ids of the processes that are still running
+    """
+    merged = {}
+    for pid, collected in sorted(collections.items()):
+        for name, metric in collected.items():
+            target = merged.setdefault(
+                name, dict(metric, samples={}, labelnames=list(metric["labelnames"]))
+            )
+            if metric["type"] == "gauge":
+                if live is not None and pid not in live:
+                    continue
+                if "pid" not in target["labelnames"]:
+                    target["labelnames"].append("pid")
+                for values, state in metric["samples"]:
+                    target["samples"][(*values, str(pid))] = state
+                continue
+            for values, state in metric["samples"]:
+                key = tuple(values)
+                if key not in target["samples"]:
+                    target["samples"][key] = state
+                elif metric["type"] == "histogram":
+                    counts, total = target["samples"][key]
+                    target["samples"][key] = [
+                        [a + b for a, b in zip(counts, state[0])],
+                        total + state[1],
+                    ]
+                else:
+                    target["samples"][key] += state
+    for metric in merged.values():
+        metric["samples"] = [[list(k), v] for k, v in sorted(metric["samples"].items())]
+    return merged
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: tuple = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def render(collected: dict) -> str:
+    """formats a collection in the Prometheus text exposition format"""
+    lines = []
+    for name, metric in collected.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        names = metric["labelnames"]
+        for values, state in metric["samples"]:
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(names, values)} {_format_value(state)}")
+                continue
+            counts, total = state
+            for bound, count in zip(metric["bounds"], itertools.accumulate(counts)):
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(names, values, le)} {count}")
+            lines.append(f"{name}_sum{_format_labels(names, values)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(names, values)} {sum(counts)}")
+    return "\n".join(lines) + "\n"
+
+
+trade_conflicts = Counter(
+    "trade_conflicts_total", "optimistic trades that found their rows changed at commit"
+)
+trade_retries = Counter("trade_retries_total", "optimistic trades retried after a conflict")
+
+settlement_orders = Counter(
+    "settlement_orders_total", "queued orders settled or failed by the workers", ("side", "status")
+)
+settlement_seconds = Histogram(
+    "settlement_seconds",
+    "time from queueing an order to settling or failing it",
+    (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900),
+    ("side",),
+)
+
+db_pool_checkout_seconds = Histogram(
+    "db_pool_checkout_seconds",
+    "time spent getting a connection from the database pool, including opening new ones",
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+db_pool_in_use = Gauge("db_pool_connections_in_use", "database connections checked out of the pool")
+db_pool_overflow = Gauge(
+    "db_pool_overflow_connections", "connections open beyond the pool size, up to its max overflow"
+)
+db_pool_timeouts = Counter(
+    "db_pool_timeouts_total", "checkouts that gave up waiting for a connection after the pool timeout"
+)
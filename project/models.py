@@ -1,7 +1,14 @@
 import secrets
 from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import bindparam, case, event, func, select, tuple_, update
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm.collections import attribute_mapped_collection
 
 from project.app import db
+from project.cache import api_key_cache
 from project.globals import ACCEPTED_SYMBOLS
 
 
@@ -10,46 +17,34 @@ class Users(db.Model):
     __tablename__ = "users"
 
     id = db.Column(db.Integer, primary_key=True)
-    BTC = db.Column(db.Float, default=0.0)
-    BTC_auth = db.Column(db.Boolean, default=False)
-    ETH = db.Column(db.Float, default=0.0)
-    ETH_auth = db.Column(db.Boolean, default=False)
-    DOGE = db.Column(db.Float, default=0.0)
-    DOGE_auth = db.Column(db.Boolean, default=False)
-    USDT = db.Column(db.Float, default=0.0)
-    USDT_auth = db.Column(db.Boolean, default=False)
-    BNB = db.Column(db.Float, default=0.0)
-    BNB_auth = db.Column(db.Boolean, default=False)
 
     client_id = db.Column(db.Integer, db.ForeignKey("clients.id"), nullable=False)
 
-    def purchase(self, symbol: str, usd_amount: float):
-        from project.helpers import convert_to_crypto
-        """This is in place of a purchasing API"""
-        self.allowed_currency(symbol)
-        current = getattr(self, symbol)
-        new = convert_to_crypto(usd_amount, symbol)
-        setattr(self, symbol, current + new)
+    client = db.relationship("Clients", back_populates="users")
+    transactions = db.relationship("Transactions", back_populates="user", lazy="dynamic")
+    holdings = db.relationship(
+        "Holdings",
+        back_populates="user",
+        collection_class=attribute_mapped_collection("symbol"),
+        cascade="all, delete-orphan",
+    )
 
-    def allowed_currency(self, symbol: str):
-        """Checks that the user is allowed to trade in the currency"""
-        from project.exceptions import InvalidSymbolError, UnauthorizedCurrencyError
-        try:
-            assert symbol in ACCEPTED_SYMBOLS
-        except AssertionError:
-            raise InvalidSymbolError
-        if getattr(self, f"{symbol}_auth") is False:
-            raise UnauthorizedCurrencyError(self, symbol)
+    def holding(self, symbol: str) -> "Holdings":
+        """Returns the user's holding of `symbol`, adding an empty unauthorized one if they have none"""
+        if symbol not in self.holdings:
+            self.holdings[symbol] = Holdings(symbol=symbol, amount=0.0, authorized=False)
+        return self.holdings[symbol]
 
     def auth_to_dict(self) -> dict:
         """Returns a dict containing the User's details and the currencies which they are authorized to trade in"""
         data = {
             "id": self.id,
-            "provider": Clients.query.get(self.client_id).name,
+            "provider": self.client.name,
             "auths": [],
         }
         for symbol in ACCEPTED_SYMBOLS:
-            if getattr(self, f"{symbol}_auth") is True:
+            holding = self.holdings.get(symbol)
+            if holding is not None and holding.authorized:
                 data["auths"].append(symbol)
         return data
 
@@ -57,14 +52,210 @@ class Users(db.Model):
         """Returns a dict containing the User's details and their holdings"""
         data = {
             "id": self.id,
-            "provider": Clients.query.get(self.client_id).name,
+            "provider": self.client.name,
             "balances": {},
         }
         for symbol in ACCEPTED_SYMBOLS:
-            if getattr(self, symbol) != 0.0:
-                data["balances"][symbol] = getattr(self, symbol)
+            holding = self.holdings.get(symbol)
+            if holding is not None and holding.amount != 0.0:
+                data["balances"][symbol] = holding.amount
         return data
 
+    @property
+    def version(self) -> int:
+        """Sum of the versions of the user's holdings.
+
+        Every trade and authorization change bumps a holding's version, so this only goes up
+        when the user's balances or authorizations change. It is the ETag of their responses.
+        """
+        return sum(holding.version or 0 for holding in self.holdings.values())
+
+    @staticmethod
+    def owner_and_version(session, user_id: int) -> Optional[tuple]:
+        """(client_id, version) of the user, read from the holdings' primary key index, or None"""
+        return (
+            session.query(Users.client_id, func.coalesce(func.sum(Holdings.version), 0))
+            .outerjoin(Holdings, Holdings.user_id == Users.id)
+            .filter(Users.id == user_id)
+            .group_by(Users.client_id)
+            .first()
+        )
+
+    @staticmethod
+    def balances_query():
+        """Query of (id, provider, *holdings) row tuples, with the client's name joined in.
+
+        The holdings are pivoted into one column per symbol, in the order of `ACCEPTED_SYMBOLS`.
+        """
+        return (
+            db.session.query(
+                Users.id,
+                Clients.name,
+                *[
+                    func.coalesce(
+                        func.sum(case((Holdings.symbol == symbol, Holdings.amount), else_=0.0)),
+                        0.0,
+                    )
+                    for symbol in ACCEPTED_SYMBOLS
+                ],
+            )
+            .join(Clients, Users.client_id == Clients.id)
+            .outerjoin(Holdings, Holdings.user_id == Users.id)
+            .group_by(Users.id, Clients.name)
+            .order_by(Users.id)
+        )
+
+    @staticmethod
+    def balance_row_to_dict(row: tuple) -> dict:
+        """Same output as `balance_to_dict`, built from a `balances_query` row"""
+        user_id, provider, *holdings = row
+        return {
+            "id": user_id,
+            "provider": provider,
+            "balances": {
+                symbol: amount
+                for symbol, amount in zip(ACCEPTED_SYMBOLS, holdings)
+                if amount != 0.0
+            },
+        }
+
+
+def _amount_property(symbol: str) -> property:
+    def get(self) -> float:
+        holding = self.holdings.get(symbol)
+        return holding.amount if holding is not None else 0.0
+
+    def set(self, amount: float):
+        self.holding(symbol).amount = amount
+
+    return property(get, set, doc=f"The user's {symbol} balance")
+
+
+def _auth_property(symbol: str) -> property:
+    def get(self) -> bool:
+        holding = self.holdings.get(symbol)
+        return holding.authorized if holding is not None else False
+
+    def set(self, authorized: bool):
+        self.holding(symbol).authorized = authorized
+
+    return property(get, set, doc=f"Whether the user may trade {symbol}")
+
+
+# `Users.BTC`, `Users.BTC_auth`, ... read and write the user's holdings,
+# for code that wants the whole user rather than a single locked holding
+for _symbol in ACCEPTED_SYMBOLS:
+    setattr(Users, _symbol, _amount_property(_symbol))
+    setattr(Users, f"{_symbol}_auth", _auth_property(_symbol))
+
+
+class Holdings(db.Model):
+    """A user's balance of, and authorization to trade, a single currency.
+
+    Trades lock only the (user_id, symbol) row they change, so a user's trades in different
+    currencies don't wait on each other.
+    """
+
+    __tablename__ = "holdings"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    symbol = db.Column(db.String, primary_key=True)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+    authorized = db.Column(db.Boolean, nullable=False, default=False)
+    # bumped by every update, which only applies if the version is still the one that was read
+    version = db.Column(db.Integer, nullable=False)
+
+    user = db.relationship("Users", back_populates="holdings")
+
+    __mapper_args__ = {"version_id_col": version}
+
+    @classmethod
+    def lock(cls, user_id: int, symbol: str, optimistic: bool = False, session=None) -> "Holdings":
+        """Locks the user's holding of `symbol` with `SELECT ... FOR UPDATE`.
+
+        With `optimistic` the row is read without a lock, and the version check on update
+        raises `StaleDataError` at commit if another trade changed it in the meantime.
+
+        If there is nothing to lock (an unknown symbol, or a currency the user has never been
+        authorized for) an unsaved, unauthorized holding is returned, so that trading it raises
+        the same errors as before.
+
+        `session` defaults to `db.session`.
+        """
+        from project.statements import HOLDING, HOLDING_FOR_UPDATE, first
+
+        session = db.session if session is None else session
+        holding = None
+        if symbol in ACCEPTED_SYMBOLS:
+            statement = HOLDING if optimistic else HOLDING_FOR_UPDATE
+            holding = first(session, statement, user_id=user_id, symbol=symbol)
+        if holding is None:
+            holding = cls(user_id=user_id, symbol=symbol, amount=0.0, authorized=False)
+        return holding
+
+    @classmethod
+    def lock_many(cls, keys) -> dict:
+        """Locks every (user_id, symbol) holding in `keys` with a single `SELECT ... FOR UPDATE`.
+
+        Rows are locked in key order so that concurrent batches cannot deadlock each other.
+        Keys with nothing to lock get an unsaved holding, as in `lock`.
+        """
+        keys = sorted({(user_id, symbol) for user_id, symbol in keys})
+        valid = [key for key in keys if key[1] in ACCEPTED_SYMBOLS]
+        rows = []
+        if valid:
+            rows = (
+                cls.query.filter(tuple_(cls.user_id, cls.symbol).in_(valid))
+                .order_by(cls.user_id, cls.symbol)
+                .with_for_update()
+                .all()
+            )
+        holdings = {(row.user_id, row.symbol): row for row in rows}
+        for user_id, symbol in keys:
+            if (user_id, symbol) not in holdings:
+                holdings[(user_id, symbol)] = cls(
+                    user_id=user_id, symbol=symbol, amount=0.0, authorized=False
+                )
+        return holdings
+
+    @classmethod
+    def save_many(cls, holdings) -> None:
+        """Writes changed, locked holdings with a single executemany UPDATE.
+
+        The ORM would send one UPDATE per row, because of the version check, which rows locked
+        by `lock_many` don't need. The written holdings are detached from the session.
+        """
+        changed = [h for h in holdings if h in db.session and db.session.is_modified(h)]
+        if not changed:
+            return
+        table = cls.__table__
+        db.session.execute(
+            table.update()
+            .where(
+                table.c.user_id == bindparam("b_user_id"),
+                table.c.symbol == bindparam("b_symbol"),
+            )
+            .values(amount=bindparam("b_amount"), version=table.c.version + 1),
+            [{"b_user_id": h.user_id, "b_symbol": h.symbol, "b_amount": h.amount} for h in changed],
+        )
+        for holding in changed:
+            db.session.expunge(holding)
+
+    def purchase(self, usd_amount: float, snapshot=None):
+        from project.helpers import convert_to_crypto
+        """This is in place of a purchasing API"""
+        self.allowed_currency()
+        self.amount += convert_to_crypto(usd_amount, self.symbol, snapshot)
+
+    def allowed_currency(self):
+        """Checks that the user is allowed to trade in the currency"""
+        from project.exceptions import InvalidSymbolError, UnauthorizedCurrencyError
+
+        if self.symbol not in ACCEPTED_SYMBOLS:
+            raise InvalidSymbolError
+        if not self.authorized:
+            raise UnauthorizedCurrencyError(self)
+
 
 class Clients(db.Model):
     __tablename__ = "clients"
@@ -73,15 +264,18 @@ class Clients(db.Model):
     name = db.Column(db.String, nullable=False)
     key_id = db.Column(db.Integer, db.ForeignKey("keys.id"), nullable=False)
 
+    api_key = db.relationship("Keys", back_populates="clients")
+    users = db.relationship("Users", back_populates="client", lazy="dynamic")
+
     @property
     def key(self):
-        return Keys.query.get(self.key_id).key
+        return self.api_key.key
 
     def auth_key(self, key: str):
         """Checks that API key is valid"""
         from project.exceptions import InvalidTokenError
 
-        if not secrets.compare_digest(key, Keys.query.get(self.key_id).key):
+        if not secrets.compare_digest(key, self.api_key.key):
             raise InvalidTokenError
 
 
@@ -91,6 +285,8 @@ class Keys(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.String, nullable=False, default=secrets.token_urlsafe())
 
+    clients = db.relationship("Clients", back_populates="api_key")
+
 
 class Transactions(db.Model):
     """This table represents incoming varified payments. used to confirm and release assets through API"""
@@ -99,21 +295,344 @@ class Transactions(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     usd_amount = db.Column(db.Float)
-    inc_time = db.Column(db.DateTime, default=datetime.utcnow())
+    inc_time = db.Column(db.DateTime, default=datetime.utcnow)
     complete_time = db.Column(db.DateTime)
     complete = db.Column(db.Boolean, default=False)
     inc_key = db.Column(db.String)
+    client_ref = db.Column(db.String)  # the client's reference of a bulk deposit
+    rate_version = db.Column(db.Integer)  # version of the rate snapshot the trade was priced with
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     client_id = db.Column(db.Integer, db.ForeignKey("clients.id"), nullable=False)
 
+    user = db.relationship("Users", back_populates="transactions")
+    client = db.relationship("Clients")
+
+    __table_args__ = (
+        # a client's confirmation keys are unique, NULLs (deposits) don't conflict
+        db.Index("ix_transactions_client_id_inc_key", "client_id", "inc_key", unique=True),
+        # a client's deposit references are unique, see `project.deposits`
+        db.Index("ix_transactions_client_id_client_ref", "client_id", "client_ref", unique=True),
+        # keyset pagination of a client's or a user's history, see `history_query`
+        db.Index("ix_transactions_client_id_inc_time_id", "client_id", "inc_time", "id"),
+        db.Index("ix_transactions_user_id_inc_time_id", "user_id", "inc_time", "id"),
+    )
+
+    @staticmethod
+    def history_query():
+        """Select of the rows of `history_row_to_dict`, oldest first, in (inc_time, id) order."""
+        return select(
+            Transactions.id,
+            Transactions.user_id,
+            Transactions.usd_amount,
+            Transactions.inc_key,
+            Transactions.client_ref,
+            Transactions.inc_time,
+            Transactions.complete,
+            Transactions.complete_time,
+            Transactions.rate_version,
+        ).order_by(Transactions.inc_time, Transactions.id)
+
+    @staticmethod
+    def history_row_to_dict(row: tuple) -> dict:
+        """A `history_query` row as sent by GET /transactions, with ISO 8601 times"""
+        (
+            id,
+            user_id,
+            usd_amount,
+            inc_key,
+            client_ref,
+            inc_time,
+            complete,
+            complete_time,
+            rate_version,
+        ) = row
+        return {
+            "id": id,
+            "user_id": user_id,
+            "usd_amount": usd_amount,
+            "inc_key": inc_key,
+            "client_ref": client_ref,
+            "inc_time": inc_time.isoformat() if inc_time else None,
+            "complete": complete,
+            "complete_time": complete_time.isoformat() if complete_time else None,
+            "rate_version": rate_version,
+        }
+
     @classmethod
-    def create(cls, usd_amount: int, user_id: int, client_id: int, inc_key: str):
+    def create(
+        cls, usd_amount: int, user_id: int, client_id: int, inc_key: str, rate_version: int = None
+    ):
         """creates and adds new transaction to the database"""
-        new = cls(usd_amount=usd_amount, user_id=user_id, client_id=client_id, inc_key=inc_key)
+        new = cls(
+            usd_amount=usd_amount,
+            user_id=user_id,
+            client_id=client_id,
+            inc_key=inc_key,
+            rate_version=rate_version,
+        )
         db.session.add(new)
         return new
 
-    def completed(self):
+    @classmethod
+    def create_unique(
+        cls,
+        usd_amount: int,
+        user_id: int,
+        client_id: int,
+        inc_key: str,
+        rate_version: int = None,
+        session=None,
+    ) -> Optional[int]:
+        """Inserts a new transaction unless the client already sent one with the same `inc_key`.
+
+        This is a single `INSERT ... ON CONFLICT DO NOTHING` against the unique
+        (client_id, inc_key) index, so there is no read before the insert and concurrent
+        workers can't both insert the same key.
+
+        :param session: The session to insert with, defaults to `db.session`
+        :return: The new transaction's id, or None if it was a duplicate
+        """
+        session = db.session if session is None else session
+        dialect = session.bind.dialect.name
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = (
+            insert(cls)
+            .values(
+                usd_amount=usd_amount,
+                user_id=user_id,
+                client_id=client_id,
+                inc_key=inc_key,
+                rate_version=rate_version,
+            )
+            .on_conflict_do_nothing(index_elements=["client_id", "inc_key"])
+        )
+        if dialect == "postgresql":
+            return session.execute(statement.returning(cls.id)).scalar()
+        # sqlite has no RETURNING before 3.35 and SQLAlchemy 1.4 doesn't use it
+        result = session.execute(statement)
+        return result.inserted_primary_key[0] if result.rowcount == 1 else None
+
+    @classmethod
+    def create_unique_many(cls, rows: list, session=None) -> set:
+        """Inserts the transactions whose `inc_key` the client hasn't already sent.
+
+        Like `create_unique` this is a single `INSERT ... ON CONFLICT DO NOTHING` against the
+        unique (client_id, inc_key) index, for all the rows at once.
+
+        :param rows: Dicts of `create_unique`'s arguments, with different inc_keys
+        :param session: The session to insert with, defaults to `db.session`
+        :return: The inc_keys of the inserted rows
+        """
+        if not rows:
+            return set()
+        session = db.session if session is None else session
+        dialect = session.bind.dialect.name
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = (
+            insert(cls).values(rows).on_conflict_do_nothing(index_elements=["client_id", "inc_key"])
+        )
+        if dialect == "postgresql":
+            return set(session.execute(statement.returning(cls.inc_key)).scalars())
+        # no RETURNING on sqlite with SQLAlchemy 1.4, but the rows a single INSERT adds get
+        # consecutive rowids, up to the last one
+        result = session.execute(statement)
+        if result.rowcount < 1:
+            return set()
+        first = result.lastrowid - result.rowcount + 1
+        return set(
+            session.execute(
+                select(cls.inc_key).where(cls.id.between(first, result.lastrowid))
+            ).scalars()
+        )
+
+    @classmethod
+    def complete_pending(cls, transaction_id: int, rate_version: int = None, session=None):
+        """Completes the transaction with a conditional UPDATE, for optimistic trades that didn't lock it.
+
+        Raises `StaleDataError` if it was completed after it was read.
+        """
+        session = db.session if session is None else session
+        result = session.execute(
+            update(cls)
+            .where(cls.id == transaction_id, cls.complete.is_(False))
+            .values(complete=True, complete_time=datetime.utcnow(), rate_version=rate_version)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            raise StaleDataError(f"transaction {transaction_id} was completed concurrently")
+
+    def completed(self, rate_version: int = None):
         """Sets the transactions to 'complete' this is to ensure the same transaction is not executed twice"""
         self.complete = True
         self.complete_time = datetime.utcnow()
+        self.rate_version = rate_version
+
+
+class Orders(db.Model):
+    """Buy and sell orders waiting for, or done with, settlement by `project.settlement` workers"""
+
+    __tablename__ = "orders"
+
+    QUEUED = "queued"
+    SETTLED = "settled"
+    FAILED = "failed"
+
+    id = db.Column(db.Integer, primary_key=True)
+    side = db.Column(db.String, nullable=False)  # "buy" or "sell"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    client_id = db.Column(db.Integer, db.ForeignKey("clients.id"), nullable=False)
+    symbol = db.Column(db.String, nullable=False)
+    amount = db.Column(db.Float, nullable=False)  # usd_amount of a buy, currency_amount of a sell
+    transaction_id = db.Column(db.String, nullable=False)  # the order's transaction_id header
+    status = db.Column(db.String, nullable=False, default=QUEUED)
+    enqueued_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    settled_at = db.Column(db.DateTime)
+    # the Transactions row that recorded a settled order: the spent deposit, or the sell order
+    settled_transaction_id = db.Column(db.Integer)
+    # the error /buy or /sell would have answered a failed order with
+    error_status = db.Column(db.Integer)
+    error_message = db.Column(db.String)
+
+    __table_args__ = (
+        # resending an order finds the one already queued instead of queueing it twice
+        db.Index(
+            "ix_orders_client_id_side_transaction_id",
+            "client_id",
+            "side",
+            "transaction_id",
+            unique=True,
+        ),
+        # the queue itself: only the queued orders, which workers claim in id order
+        db.Index(
+            "ix_orders_queued",
+            "id",
+            postgresql_where=db.text("status = 'queued'"),
+            sqlite_where=db.text("status = 'queued'"),
+        ),
+    )
+
+    @classmethod
+    def enqueue(
+        cls,
+        side: str,
+        user_id: int,
+        client_id: int,
+        symbol: str,
+        amount: float,
+        transaction_id: str,
+        session=None,
+    ) -> tuple:
+        """Queues an order, unless the client already sent the same side and `transaction_id`.
+
+        Like `Transactions.create_unique` this is a single `INSERT ... ON CONFLICT DO NOTHING`,
+        against the unique (client_id, side, transaction_id) index. A resent order isn't
+        compared with the queued one, its own amount and symbol are ignored.
+
+        :param session: The session to insert with, defaults to `db.session`
+        :return: A tuple of the order's id and status, "queued" unless it was resent
+        """
+        session = db.session if session is None else session
+        dialect = session.bind.dialect.name
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = (
+            insert(cls)
+            .values(
+                side=side,
+                user_id=user_id,
+                client_id=client_id,
+                symbol=symbol,
+                amount=amount,
+                transaction_id=transaction_id,
+                status=cls.QUEUED,
+                enqueued_at=datetime.utcnow(),
+            )
+            .on_conflict_do_nothing(index_elements=["client_id", "side", "transaction_id"])
+        )
+        if dialect == "postgresql":
+            order_id = session.execute(statement.returning(cls.id)).scalar()
+        else:
+            result = session.execute(statement)
+            order_id = result.inserted_primary_key[0] if result.rowcount == 1 else None
+        if order_id is not None:
+            return order_id, cls.QUEUED
+        return session.execute(
+            select(cls.id, cls.status).where(
+                cls.client_id == client_id, cls.side == side, cls.transaction_id == transaction_id
+            )
+        ).one()
+
+    @classmethod
+    def claim(cls, limit: int, session=None) -> list:
+        """Locks up to `limit` queued orders, oldest first, skipping those other workers locked.
+
+        This is `SELECT ... FOR UPDATE SKIP LOCKED`, so concurrent workers claim different
+        orders without waiting on each other. The orders stay claimed until the transaction
+        ends, and a worker that dies leaves them queued. SQLite has no row locks and ignores it.
+        """
+        session = db.session if session is None else session
+        return (
+            session.execute(
+                select(cls)
+                .where(cls.status == cls.QUEUED)
+                .order_by(cls.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+            .scalars()
+            .all()
+        )
+
+    @staticmethod
+    def queue_stats(session) -> tuple:
+        """(number, oldest enqueued_at) of the queued orders, read from the queue's index"""
+        return session.execute(
+            select(func.count(Orders.id), func.min(Orders.enqueued_at)).where(
+                Orders.status == Orders.QUEUED
+            )
+        ).one()
+
+    def settled(self, transaction_id: int):
+        """Marks the order settled, recorded by the Transactions row `transaction_id`"""
+        self.status = self.SETTLED
+        self.settled_at = datetime.utcnow()
+        self.settled_transaction_id = transaction_id
+
+    def failed(self, status: int, message: str):
+        """Marks the order failed, with the error /buy or /sell would have answered"""
+        self.status = self.FAILED
+        self.settled_at = datetime.utcnow()
+        self.error_status = status
+        self.error_message = message
+
+    def to_dict(self) -> dict:
+        """The order as sent by GET /orders/<id>, with ISO 8601 times"""
+        amount = "usd_amount" if self.side == "buy" else "currency_amount"
+        error = None
+        if self.status == self.FAILED:
+            error = {"status": self.error_status, "message": self.error_message}
+        return {
+            "order_id": self.id,
+            "side": self.side,
+            "user_id": self.user_id,
+            "symbol": self.symbol,
+            amount: self.amount,
+            "transaction_id": self.transaction_id,
+            "status": self.status,
+            "enqueued_at": self.enqueued_at.isoformat(),
+            "settled_at": self.settled_at.isoformat() if self.settled_at else None,
+            "settled_transaction_id": self.settled_transaction_id,
+            "error": error,
+        }
+
+
+@event.listens_for(Keys, "after_update")
+@event.listens_for(Keys, "after_delete")
+def _invalidate_rotated_key(mapper, connection, target: Keys):
+    """a rotated or revoked key may be shared by several clients, so every cached verification is dropped"""
+    api_key_cache.invalidate()
+
+
+@event.listens_for(Clients, "after_update")
+@event.listens_for(Clients, "after_delete")
+def _invalidate_client_key(mapper, connection, target: Clients):
+    api_key_cache.invalidate(target.id)
@@ -0,0 +1,94 @@
+"""Database connection pool settings and instrumentation.
+
+`engine_options` turns the `DB_POOL_*` settings in `project.config` into `create_engine`
+arguments. The pools it selects record every checkout in `project.metrics`: how long it
+waited, how many connections are in use, how far into overflow the pool is, and how many
+checkouts timed out. Each worker process has its own pool, so a deployment opens up to
+workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections, which must stay below Postgres'
+max_connections.
+"""
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+from project.metrics import (
+    db_pool_checkout_seconds,
+    db_pool_in_use,
+    db_pool_overflow,
+    db_pool_timeouts,
+)
+
+
+class _InstrumentedPool:
+    """Records every checkout and checkin of the pool in `project.metrics`"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            db_pool_timeouts.inc()
+            raise
+        finally:
+            db_pool_checkout_seconds.observe(time.perf_counter() - start)
+        db_pool_in_use.inc()
+        self._record_overflow()
+        return connection
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        db_pool_in_use.dec()
+        self._record_overflow()
+
+    def _record_overflow(self):
+        if isinstance(self, QueuePool):
+            db_pool_overflow.set(max(0, self.overflow()))
+
+
+class InstrumentedQueuePool(_InstrumentedPool, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+class InstrumentedNullPool(_InstrumentedPool, NullPool):
+    pass
+
+
+def engine_options(config, uri: str = None, asyncio: bool = False) -> dict:
+    """
+    the `create_engine` arguments for the pool configured by the `DB_POOL_*` settings
+
+    :param config: The app's config
+    :param uri: The database uri, defaults to `SQLALCHEMY_DATABASE_URI`
+    :param asyncio: Whether the options are for `create_async_engine`
+    :return: Keyword arguments for `create_engine`, `SQLALCHEMY_ENGINE_OPTIONS` for the app
+    """
+    url = make_url(uri or config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # a single shared connection holds the whole database, there is nothing to pool
+        return {}
+    if config["DB_POOL_PROFILE"] == "pgbouncer":
+        # in transaction mode PgBouncer does the pooling and may run every transaction on a
+        # different server connection, so nothing may be kept per connection: no local pool,
+        # and none of asyncpg's server side prepared statements
+        options = {"poolclass": InstrumentedNullPool}
+        if asyncio:
+            options["connect_args"] = {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+        return options
+    options = {
+        "poolclass": InstrumentedAsyncQueuePool if asyncio else InstrumentedQueuePool,
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+    }
+    if url.get_backend_name() == "sqlite" and not asyncio:
+        # pooled connections are handed from thread to thread, one at a time
+        options["connect_args"] = {"check_same_thread": False}
+    return options
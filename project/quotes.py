@@ -0,0 +1,114 @@
+from typing import Tuple
+
+import numpy as np
+
+from project.exceptions import InvalidSymbolError
+from project.globals import ACCEPTED_SYMBOLS
+from project.rates import RateSnapshot
+
+# position of each symbol in `ACCEPTED_SYMBOLS`, the code used by the binary quote format
+SYMBOL_CODES = {symbol: code for code, symbol in enumerate(ACCEPTED_SYMBOLS)}
+
+# one record of a binary quote request: a symbol code followed by the amount
+QUOTE_RECORD = np.dtype([("symbol", "u1"), ("amount", "<f8")])
+
+# (snapshot, rates array) of the last snapshot quoted against
+_rate_vector = (None, None)
+
+
+def rate_vector(snapshot: RateSnapshot) -> np.ndarray:
+    """
+    the snapshot's rates as an array indexed by symbol code
+
+    :param snapshot: The rates to vectorize
+    :return: A float64 array of crypto per USD, in `ACCEPTED_SYMBOLS` order
+    """
+    global _rate_vector
+    cached, vector = _rate_vector
+    if cached is not snapshot:
+        vector = np.array([snapshot.rates[s] for s in ACCEPTED_SYMBOLS], dtype=np.float64)
+        _rate_vector = (snapshot, vector)
+    return vector
+
+
+def read_json_quotes(body, max_items: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    reads a quote request sent as JSON
+
+    :param body: Either a list of {"symbol", "amount"} objects or columnar {"symbols": [...], "amounts": [...]}
+    :param max_items: The largest request accepted
+    :return: A tuple of the symbol codes and the amounts
+    """
+    if isinstance(body, list):
+        if not all(isinstance(item, dict) for item in body):
+            raise ValueError("every item must be a {'symbol', 'amount'} object")
+        symbols = [item.get("symbol") for item in body]
+        amounts = [item.get("amount") for item in body]
+    elif isinstance(body, dict):
+        symbols, amounts = body.get("symbols"), body.get("amounts")
+        if not isinstance(symbols, list) or not isinstance(amounts, list) or len(symbols) != len(amounts):
+            raise ValueError("'symbols' and 'amounts' must be lists of the same length")
+    else:
+        raise ValueError("request body must be a JSON array or a columnar JSON object")
+    check_size(len(symbols), max_items)
+    values = np.asarray(amounts)
+    if values.dtype.kind not in "iuf" or values.ndim != 1:
+        raise ValueError("every amount must be a number")
+    return symbol_codes(symbols), values.astype(np.float64, copy=False)
+
+
+def symbol_codes(symbols: list) -> np.ndarray:
+    """
+    maps symbols to their codes
+
+    :param symbols: A list of symbols, e.g. ["BTC", "ETH"]
+    :return: A uint8 array of symbol codes
+    """
+    try:
+        return np.fromiter(map(SYMBOL_CODES.__getitem__, symbols), dtype=np.uint8, count=len(symbols))
+    except (KeyError, TypeError):
+        raise InvalidSymbolError(next(s for s in symbols if not isinstance(s, str) or s not in SYMBOL_CODES))
+
+
+def read_binary_quotes(data: bytes, max_items: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    reads a quote request sent as packed `QUOTE_RECORD`s
+
+    :param data: The request body
+    :param max_items: The largest request accepted
+    :return: A tuple of the symbol codes and the amounts
+    """
+    if len(data) % QUOTE_RECORD.itemsize:
+        raise ValueError(f"binary quotes are {QUOTE_RECORD.itemsize} byte records")
+    records = np.frombuffer(data, dtype=QUOTE_RECORD)
+    check_size(len(records), max_items)
+    if records.size and records["symbol"].max() >= len(ACCEPTED_SYMBOLS):
+        raise ValueError(f"symbol codes must be below {len(ACCEPTED_SYMBOLS)}")
+    return records["symbol"], records["amount"]
+
+
+def check_size(size: int, max_items: int) -> None:
+    if not size:
+        raise ValueError("at least one quote is required")
+    if size > max_items:
+        raise ValueError(f"quotes are limited to {max_items} items")
+
+
+def quote(codes: np.ndarray, amounts: np.ndarray, to: str, snapshot: RateSnapshot) -> np.ndarray:
+    """
+    vectorized `convert_to_usd`/`convert_to_crypto`
+
+    every symbol's rate is gathered from the snapshot in one indexing operation and the
+    conversion is a single array division or multiplication, with the same floating point
+    results as the scalar helpers.
+
+    :param codes: The symbol code of each item
+    :param amounts: The amount of each item, crypto when `to` is "usd" and USD when it is "crypto"
+    :param to: "usd" to price crypto amounts in USD, "crypto" to convert USD amounts to crypto
+    :param snapshot: The rates to convert with
+    :return: A float64 array of converted amounts, in input order
+    """
+    rates = rate_vector(snapshot)[codes]
+    if to == "usd":
+        return amounts / rates
+    return amounts * rates
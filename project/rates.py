@@ -0,0 +1,163 @@
+import json
+import logging
+import threading
+import time
+import urllib.request
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Tuple
+
+from project.globals import ACCEPTED_SYMBOLS
+
+# units of crypto bought with one USD
+DEFAULT_RATES = {
+    "BTC": 0.0000233678,
+    "ETH": 0.00030321,
+    "DOGE": 8.10,
+    "USDT": 1,
+    "BNB": 0.00234261,
+}
+
+
+class RateSnapshot(NamedTuple):
+    """Immutable set of conversion rates, in units of crypto per USD"""
+
+    version: int
+    rates: Mapping[str, float]
+    fetched_at: float
+
+    def age(self) -> float:
+        """seconds since the rates were fetched"""
+        return time.time() - self.fetched_at
+
+
+class RateFeeder:
+    """Source of conversion rates.
+
+    `fetch` returns a tuple of (version, rates). The version may be None, in which case the
+    store numbers the snapshot itself.
+    """
+
+    def fetch(self) -> Tuple[int, dict]:
+        raise NotImplementedError
+
+
+class StaticFeeder(RateFeeder):
+    """Serves a fixed set of rates, the stand-in for a real price feed"""
+
+    def __init__(self, rates: dict = None, version: int = None):
+        self.rates = dict(DEFAULT_RATES if rates is None else rates)
+        self.version = version
+
+    def fetch(self) -> Tuple[int, dict]:
+        return self.version, self.rates
+
+
+def parse_rates(payload: dict) -> Tuple[int, dict]:
+    """
+    reads a feed payload of the form {"version": 3, "rates": {"BTC": 0.0000233678, ...}}
+
+    :param payload: The decoded JSON document
+    :return: A tuple of the version (or None) and the rates
+    """
+    return payload.get("version"), payload["rates"]
+
+
+class FileFeeder(RateFeeder):
+    """Reads rates from a local JSON file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def fetch(self) -> Tuple[int, dict]:
+        with open(self.path) as f:
+            return parse_rates(json.load(f))
+
+
+class HTTPFeeder(RateFeeder):
+    """Reads rates from a JSON document served over HTTP"""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self) -> Tuple[int, dict]:
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            return parse_rates(json.load(response))
+
+
+FEEDERS = {
+    "static": lambda source: StaticFeeder(),
+    "file": FileFeeder,
+    "http": HTTPFeeder,
+}
+
+
+class RateStore:
+    """Holds the current `RateSnapshot`.
+
+    Readers take `snapshot` once and use it for the whole trade. `refresh` builds a new
+    snapshot and swaps it in with a single reference assignment, so readers always see
+    either the old or the new rates, never a mix.
+    """
+
+    def __init__(self, app=None):
+        self.max_age = None
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._snapshot = None
+        self.feeder = StaticFeeder()
+        self.refresh()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.max_age = app.config["RATES_MAX_AGE"]
+        self.feeder = FEEDERS[app.config["RATES_FEEDER"]](app.config["RATES_SOURCE"])
+        self.refresh()
+        interval = app.config["RATES_REFRESH_INTERVAL"]
+        if interval and self._refresher is None:
+            self._refresher = threading.Thread(
+                target=self._refresh_forever, args=(interval,), daemon=True
+            )
+            self._refresher.start()
+
+    @property
+    def snapshot(self) -> RateSnapshot:
+        return self._snapshot
+
+    def fresh(self) -> RateSnapshot:
+        """returns the current snapshot, raising `StaleRatesError` if it is older than `max_age`"""
+        from project.exceptions import StaleRatesError
+
+        snapshot = self._snapshot
+        if self.max_age is not None and snapshot.age() > self.max_age:
+            raise StaleRatesError(snapshot)
+        return snapshot
+
+    def refresh(self) -> RateSnapshot:
+        """fetches rates from the feeder and atomically swaps in a new snapshot"""
+        version, rates = self.feeder.fetch()
+        missing = [symbol for symbol in ACCEPTED_SYMBOLS if not rates.get(symbol, 0) > 0]
+        if missing:
+            raise ValueError(f"rate feed is missing valid rates for {missing}")
+        with self._lock:
+            if version is None:
+                version = self._snapshot.version + 1 if self._snapshot else 1
+            self._snapshot = RateSnapshot(
+                version=version,
+                rates=MappingProxyType({s: float(rates[s]) for s in ACCEPTED_SYMBOLS}),
+                fetched_at=time.time(),
+            )
+        return self._snapshot
+
+    def _refresh_forever(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except Exception:
+                # keep serving the last good snapshot, `fresh` reports it once it is too old
+                logging.getLogger(__name__).exception("refreshing rates failed")
+
+
+rate_store = RateStore()
@@ -0,0 +1,152 @@
+"""Read replica routing for the read only routes.
+
+With `REPLICA_DATABASE_URI` set, views decorated with `read_only` query the replica instead of
+the primary that trades lock rows on. A view still reads from the primary when:
+
+- the calling client traded in the last `REPLICA_PIN_SECONDS`, so it reads its own writes
+- the replica is more than `REPLICA_MAX_LAG` seconds behind, or its lag can't be measured
+
+Pins are kept per process, like the API key cache, so a client whose trade went to another
+worker isn't pinned on this one. Keep REPLICA_MAX_LAG below the pin time to bound that.
+"""
+import logging
+import threading
+import time
+from functools import wraps
+
+from flask import request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import orm, text
+
+from project.cache import LRUCache
+from project.metrics import Counter, Gauge
+
+replica_reads = Counter("replica_reads_total", "read only requests served from the replica")
+replica_fallbacks = Counter(
+    "replica_fallbacks_total", "read only requests sent to the primary because the replica lagged"
+)
+replica_lag = Gauge("replica_lag_seconds", "last measured replication lag of the replica")
+
+# seconds since the replica last replayed a transaction from the primary. an idle primary
+# looks like lag, which only costs some reads going to the primary
+POSTGRES_LAG = text(
+    "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+)
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends queries to the replica while `info["replica"]` is set.
+
+    Flushes always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.info.get("replica") and not self._flushing:
+            return get_state(self.app).db.get_engine(self.app, bind="replica")
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy, with `RoutingSession` sessions"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaRouter:
+    """Decides whether a read only request may use the replica"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.max_lag = 0.0
+        self.lag_interval = 1.0
+        self._pins = LRUCache()
+        self._lag = (0.0, 0.0)  # (measured at, lag)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.enabled = app.config["REPLICA_DATABASE_URI"] is not None
+        self.max_lag = app.config["REPLICA_MAX_LAG"]
+        self.lag_interval = app.config["REPLICA_LAG_CHECK_INTERVAL"]
+        self._pins = LRUCache(maxsize=100_000, ttl=app.config["REPLICA_PIN_SECONDS"])
+        self._lag = (0.0, 0.0)
+        if self.enabled:
+            app.config["SQLALCHEMY_BINDS"] = dict(
+                app.config.get("SQLALCHEMY_BINDS") or {}, replica=app.config["REPLICA_DATABASE_URI"]
+            )
+
+    def pin(self, client_id: int) -> None:
+        """sends the client's reads to the primary for the next `REPLICA_PIN_SECONDS`"""
+        if self.enabled and self._pins.ttl:
+            self._pins.set(client_id, True)
+
+    def pinned(self, client_id: int) -> bool:
+        return self._pins.get(client_id, False)
+
+    def measure_lag(self, engine) -> float:
+        """seconds the replica is behind the primary. only Postgres replicas can lag"""
+        if engine.dialect.name != "postgresql":
+            return 0.0
+        with engine.connect() as conn:
+            return float(conn.execute(POSTGRES_LAG).scalar())
+
+    def lag(self, engine) -> float:
+        """the replica's lag, measured at most once every `REPLICA_LAG_CHECK_INTERVAL` seconds
+
+        a replica that can't be reached counts as infinitely behind
+        """
+        measured_at, lag = self._lag
+        if time.monotonic() - measured_at < self.lag_interval:
+            return lag
+        with self._lock:
+            try:
+                lag = self.measure_lag(engine)
+            except Exception:
+                logging.getLogger(__name__).exception("measuring replica lag failed")
+                lag = float("inf")
+            self._lag = (time.monotonic(), lag)
+        replica_lag.set(lag)
+        return lag
+
+    def use_replica(self, client_id: int, engine) -> bool:
+        """whether this client's read only request may go to the replica"""
+        if not self.enabled or self.pinned(client_id):
+            return False
+        if self.lag(engine) > self.max_lag:
+            replica_fallbacks.inc()
+            return False
+        return True
+
+
+replica_router = ReplicaRouter()
+
+
+def read_only(view):
+    """
+    decorator for views that only read, running their queries on the replica when it's allowed
+
+    the session's transaction is ended afterwards, so that nothing read from the replica is
+    reused by later queries on the primary
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        from project.app import db
+
+        client_id = request.headers.get("client_id", type=int)
+        if not (
+            replica_router.enabled
+            and replica_router.use_replica(client_id, db.get_engine(bind="replica"))
+        ):
+            return view(*args, **kwargs)
+        replica_reads.inc()
+        db.session.info["replica"] = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            db.session.info.pop("replica", None)
+            db.session.rollback()
+
+    return wrapper
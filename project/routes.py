@@ -1,24 +1,59 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, request, url_for
 
+from project.cache import api_key_cache
+from project.encoding import csv_lines, dumps_lines, encoded_response, iter_object, json_response
 from project.exceptions import (
-    DuplicatePaymentError,
-    InsufficientCurrencyError,
+    DuplicateOrderError,
     InvalidSymbolError,
     InvalidTokenError,
-    TransactionMismatchError,
-    TransactionNotFoundError,
-    UnauthorizedCurrencyError,
     MissingHeaderError,
+    StaleRatesError,
+    TransactionNotFoundError,
+    UnauthorizedClientError,
 )
 from project.helpers import (
-    convert_to_usd,
+    TRADE_ERRORS,
+    batch_error,
+    batch_result,
+    buy_order,
+    changed_users,
+    client_credentials,
     db_session,
-    transaction,
-    verify_currency,
+    deposit_id,
+    history_cursor,
+    history_statement,
+    lock_rows,
+    missing_fields,
+    optimistic,
+    query_param,
+    required_header,
+    retry_on_conflict,
+    sell_currency,
+    sell_order,
+    stream_rows,
+    user_response,
+    trade_error,
+    user_owners,
+    verify_client,
+    verify_transaction,
     bad_request,
     error_response,
 )
-from project.models import Users, Clients, Transactions
+from project.app import db
+from project.budget import query_budget
+from project.deposits import (
+    insert_deposits,
+    invalid_fields,
+    read_csv_deposits,
+    read_json_deposits,
+)
+from project.globals import ACCEPTED_SYMBOLS
+from project.instrumentation import timed
+from project.models import Holdings, Orders, Transactions, Users
+from project.quotes import quote, read_binary_quotes, read_json_quotes
+from project.rates import rate_store
+from project.replica import read_only, replica_router
+from project.settlement import enqueue_order, queued
 
 api = Blueprint("main", __name__)
 
@@ -26,106 +61,561 @@ api = Blueprint("main", __name__)
 @api.before_request
 def check_api_key():
     """pre-route request validation"""
-    try:
-        client_id = request.headers.get("client_id", type=int)
-        if client_id is None:
-            raise MissingHeaderError
-    except (MissingHeaderError, TypeError):
-        return bad_request("'client_id' header required")
-    try:
-        auth = request.headers.get("authorization", type=str)
-        if auth is None:
-            raise MissingHeaderError
-    except MissingHeaderError:
-        return bad_request("'Authorization' header required")
-    client = Clients.query.get_or_404(client_id)
-    try:
-        client.auth_key(auth)
-    except InvalidTokenError:
-        return error_response(401, "invalid API key")
+    with timed("auth"):
+        try:
+            client_id, auth = client_credentials(request.headers)
+        except MissingHeaderError as e:
+            return bad_request(f"{e}")
+        if api_key_cache.verified(client_id, auth):
+            return
+        try:
+            verify_client(db.session, client_id, auth)
+        except InvalidTokenError:
+            return error_response(401, "invalid API key")
+
+
+# routes that change a client's data, after which it reads from the primary for a while
+WRITE_ENDPOINTS = {
+    "main.buy",
+    "main.buy_batch",
+    "main.deposits_bulk",
+    "main.sell",
+    "main.sell_batch",
+}
+
+
+@api.after_request
+def pin_writers(response):
+    """pins clients that just traded to the primary, so they read their own writes"""
+    if request.endpoint in WRITE_ENDPOINTS and response.status_code < 300:
+        replica_router.pin(request.headers.get("client_id", type=int))
+    return response
 
 
 @api.route("/list/<int:id>", methods=["GET"])
+@read_only
+@query_budget(2)
 def currency_list(id):
     """Currency list: For a given user, get the curriencies they can transact"""
-    user = Users.query.get_or_404(id)
-    if user.client_id != request.headers.get("client_id", type=int):
-        return error_response(401, "unauthorized client")
-    return jsonify(user.auth_to_dict()), 200
+    return user_view("auths", id)
 
 
 @api.route("/buy/<int:id>/<symbol>/<float:usd_amount>", methods=["POST"])
+@retry_on_conflict
+@query_budget(5)
 def buy(id: int, symbol: str, usd_amount: float):
     """Buy: For a given User, buy a selected Currency"""
 
-    with db_session():
+    with db_session() as sess:
         try:
-            transaction_id = request.headers.get("transaction_id")
-            if transaction_id is None:
-                raise MissingHeaderError
-        except MissingHeaderError:
-            return bad_request("'transaction_id' header required")
+            transaction_id = required_header(request.headers, "transaction_id")
+            deposit = deposit_id(transaction_id)
+        except MissingHeaderError as e:
+            return bad_request(f"{e}")
+        except TransactionNotFoundError as e:
+            return error_response(*trade_error(e, symbol))
+        if queued():
+            return queued_order(sess, "buy", id, symbol, usd_amount, transaction_id)
         try:
-            user = Users.query.with_for_update().get_or_404(id)
-            if user.client_id != request.headers.get("client_id", type=int):
-                return error_response(401, "unauthorized client")
-            with transaction(transaction_id, usd_amount, user.id):
-                user.purchase(symbol, usd_amount)
-        except InvalidSymbolError:
-            return error_response(404, f"'{symbol}' is not a valid symbol")
-        except TransactionNotFoundError:
-            return error_response(401, "Transaction not found")
-        except TransactionMismatchError:
-            return error_response(401, "Transaction details do not match")
-        except DuplicatePaymentError as e:
-            return error_response(401, f"{e}")
-        except UnauthorizedCurrencyError as e:
-            return error_response(401, f"{e}")
+            buy_order(
+                sess,
+                id,
+                symbol,
+                usd_amount,
+                request.headers.get("client_id", type=int),
+                deposit,
+                optimistic(),
+            )
+        except TRADE_ERRORS as e:
+            # the message may read the rows, which the rollback expires
+            response = error_response(*trade_error(e, symbol))
+            sess.rollback()
+            return response
     return "", 204
 
 
+def queued_order(session, side: str, user_id: int, symbol: str, amount: float, transaction_id: str):
+    """queues a /buy or /sell order for the settlement workers, see `project.settlement`"""
+    try:
+        order_id, status = enqueue_order(
+            session,
+            side,
+            user_id,
+            symbol,
+            amount,
+            request.headers.get("client_id", type=int),
+            transaction_id,
+        )
+    except TRADE_ERRORS as e:
+        return error_response(*trade_error(e, symbol))
+    response = json_response({"order_id": order_id, "status": status}, 202)
+    response.headers["Location"] = url_for("main.order_status", id=order_id)
+    return response
+
+
+@api.route("/orders/<int:id>", methods=["GET"])
+@query_budget(1)
+def order_status(id: int):
+    """Order status: how settling a queued /buy or /sell order went, see `project.settlement`"""
+    order = db.session.get(Orders, id)
+    if order is None:
+        return error_response(404, "Order not found")
+    if order.client_id != request.headers.get("client_id", type=int):
+        return error_response(401, "unauthorized client")
+    return json_response(order.to_dict())
+
+
+BUY_BATCH_FIELDS = {
+    "user_id": int,
+    "symbol": str,
+    "usd_amount": (int, float),
+    "transaction_id": int,
+}
+
+
+@api.route("/buy/batch", methods=["POST"])
+@query_budget(5)
+def buy_batch():
+    """Batch buy: settle many pre-deposited transactions in a single database transaction
+
+    expects a JSON array of {"user_id", "symbol", "usd_amount", "transaction_id"} objects
+    and returns one result per item, in input order
+    """
+    items = request.get_json(silent=True)
+    error = batch_error(items, current_app.config["BATCH_MAX_ITEMS"])
+    if error:
+        return bad_request(error)
+    client_id = request.headers.get("client_id", type=int)
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        missing = missing_fields(item, BUY_BATCH_FIELDS)
+        if missing:
+            results[index] = batch_result(item, 400, f"invalid or missing fields: {missing}")
+        else:
+            valid.append(index)
+    try:
+        snapshot = rate_store.fresh()
+    except StaleRatesError as e:
+        return error_response(503, f"{e}")
+    with db_session() as sess:
+        valid = owned_items(items, valid, results, client_id)
+        holdings = Holdings.lock_many((items[i]["user_id"], items[i]["symbol"]) for i in valid)
+        transactions = lock_rows(Transactions, (items[i]["transaction_id"] for i in valid))
+        for index in valid:
+            item = items[index]
+            tran = transactions.get(item["transaction_id"])
+            try:
+                verify_transaction(tran, item["usd_amount"], item["user_id"])
+                holdings[(item["user_id"], item["symbol"])].purchase(item["usd_amount"], snapshot)
+            except TRADE_ERRORS as e:
+                results[index] = batch_result(item, *trade_error(e, item["symbol"]))
+                continue
+            tran.completed(snapshot.version)
+            results[index] = batch_result(item, 204)
+        Holdings.save_many(holdings.values())
+        changed_users(sess, client_id, traded_users(items, results))
+    return json_response(results)
+
+
 @api.route("/sell/<int:user_id>/<symbol>/<float:currency_amount>", methods=["POST"])
+@retry_on_conflict
+@query_budget(4)
 def sell(user_id: int, symbol: str, currency_amount: float):
     """Sell: for a given User, sell a selected Currency"""
-    with db_session():
-        try:
-            transaction_id = request.headers.get("transaction_id")
-            if transaction_id is None:
-                raise MissingHeaderError
-        except MissingHeaderError:
-            return bad_request("'transaction_id' header required")
-        user = Users.query.with_for_update().get(user_id)
-        if user.client_id != request.headers.get("client_id", type=int):
-            return error_response(401, "unauthorized client")
+    with db_session() as sess:
         try:
-            order = Transactions.query.filter_by(inc_key=transaction_id).first()
-            assert order is None
-        except AssertionError:
-            return error_response(401, "Sell order already submitted")
+            transaction_id = required_header(request.headers, "transaction_id")
+        except MissingHeaderError as e:
+            return bad_request(f"{e}")
+        if queued():
+            return queued_order(sess, "sell", user_id, symbol, currency_amount, transaction_id)
         try:
-            user.allowed_currency(symbol)
-            verify_currency(user, symbol, currency_amount)
-            usd = convert_to_usd(currency_amount, symbol)
-            setattr(user, symbol, getattr(user, symbol) - currency_amount)
-            Transactions.create(
-                usd_amount=-usd,
-                user_id=user.id,
-                inc_key=transaction_id,
-                client_id=int(request.headers.get("client_id")),
+            sell_order(
+                sess,
+                user_id,
+                symbol,
+                currency_amount,
+                request.headers.get("client_id", type=int),
+                transaction_id,
+                optimistic(),
             )
-        except InvalidSymbolError:
-            return error_response(404, f"'{symbol}' is not a valid symbol")
-        except InsufficientCurrencyError as e:
-            return error_response(401, f"{e}")
-        except UnauthorizedCurrencyError as e:
-            return error_response(401, f"{e}")
+        except TRADE_ERRORS as e:
+            # the message may read the rows, which the rollback expires
+            response = error_response(*trade_error(e, symbol))
+            sess.rollback()
+            return response
     return "", 204
 
 
+SELL_BATCH_FIELDS = {
+    "user_id": int,
+    "symbol": str,
+    "currency_amount": (int, float),
+    "transaction_id": str,
+}
+
+
+@api.route("/sell/batch", methods=["POST"])
+@query_budget(5)
+def sell_batch():
+    """Batch sell: submit many sell orders in a single database transaction
+
+    expects a JSON array of {"user_id", "symbol", "currency_amount", "transaction_id"} objects
+    and returns one result per order, in input order. failed orders don't abort the batch
+    """
+    items = request.get_json(silent=True)
+    error = batch_error(items, current_app.config["BATCH_MAX_ITEMS"])
+    if error:
+        return bad_request(error)
+    client_id = request.headers.get("client_id", type=int)
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        missing = missing_fields(item, SELL_BATCH_FIELDS)
+        if missing:
+            results[index] = batch_result(item, 400, f"invalid or missing fields: {missing}")
+        else:
+            valid.append(index)
+    try:
+        snapshot = rate_store.fresh()
+    except StaleRatesError as e:
+        return error_response(503, f"{e}")
+    with db_session() as sess:
+        valid = owned_items(items, valid, results, client_id)
+        holdings = Holdings.lock_many((items[i]["user_id"], items[i]["symbol"]) for i in valid)
+        amounts = {key: holding.amount for key, holding in holdings.items()}
+        orders, keys = {}, set()
+        for index in valid:
+            item = items[index]
+            if item["transaction_id"] in keys:
+                results[index] = batch_result(item, 401, f"{DuplicateOrderError()}")
+                continue
+            try:
+                holding = holdings[(item["user_id"], item["symbol"])]
+                usd = sell_currency(holding, item["currency_amount"], snapshot)
+            except TRADE_ERRORS as e:
+                results[index] = batch_result(item, *trade_error(e, item["symbol"]))
+                continue
+            keys.add(item["transaction_id"])
+            orders[index] = {
+                "usd_amount": -usd,
+                "user_id": item["user_id"],
+                "inc_key": item["transaction_id"],
+                "client_id": client_id,
+                "rate_version": snapshot.version,
+            }
+        # orders whose transaction_id the client already sent, in an earlier or a concurrent
+        # request, aren't inserted. the holdings are written by `save_many`, not flushed here
+        with sess.no_autoflush:
+            inserted = Transactions.create_unique_many(list(orders.values()), sess)
+        for index in orders:
+            if items[index]["transaction_id"] in inserted:
+                results[index] = batch_result(items[index], 204)
+            else:
+                results[index] = batch_result(items[index], 401, f"{DuplicateOrderError()}")
+        if len(inserted) < len(orders):
+            # sell only the inserted orders: put the holdings back and debit those again
+            for key, holding in holdings.items():
+                holding.amount = amounts[key]
+            for index in orders:
+                if results[index]["status"] == 204:
+                    item = items[index]
+                    holding = holdings[(item["user_id"], item["symbol"])]
+                    sell_currency(holding, item["currency_amount"], snapshot)
+        Holdings.save_many(holdings.values())
+        changed_users(sess, client_id, traded_users(items, results))
+    return json_response(results)
+
+
+def owned_items(
+    items: list, valid: list, results: list, client_id: int, key: str = "transaction_id"
+) -> list:
+    """
+    looks up the owners of every user in a batch with one query
+
+    items for users that don't exist or belong to another client get their result filled in
+
+    :param items: The batch
+    :param valid: Indexes of the well formed items
+    :param results: The batch's results, by index
+    :param client_id: The calling client
+    :param key: The field that identifies an item, see `batch_result`
+    :return: The indexes of the items that can be traded
+    """
+    owners = user_owners(items[i]["user_id"] for i in valid)
+    for index in valid:
+        owner = owners.get(items[index]["user_id"])
+        if owner is None:
+            results[index] = batch_result(items[index], 404, "User not found", key)
+        elif owner != client_id:
+            results[index] = batch_result(items[index], 401, "unauthorized client", key)
+    return [i for i in valid if results[i] is None]
+
+
+@api.route("/deposits/bulk", methods=["POST"])
+@query_budget(4)
+def deposits_bulk():
+    """Bulk deposits: record many of the client's deposits, which buys can then spend
+
+    expects {"user_id", "usd_amount", "client_ref"} records as a JSON array, or with
+    `Content-Type: text/csv` as CSV with a user_id,usd_amount,client_ref header, see
+    `project.deposits`. returns one result per record, in input order: 201 with the new
+    "transaction_id", or an error status. records with a client_ref the client already used,
+    in this batch or an earlier one, get a 409 and aren't inserted again
+    """
+    max_items = current_app.config["BATCH_MAX_ITEMS"]
+    try:
+        if request.mimetype == "text/csv":
+            records = read_csv_deposits(request.get_data(), max_items)
+        else:
+            records = read_json_deposits(request.get_json(silent=True), max_items)
+    except ValueError as e:
+        return bad_request(f"{e}")
+    client_id = request.headers.get("client_id", type=int)
+    results = [None] * len(records)
+    valid, refs = [], set()
+    for index, record in enumerate(records):
+        invalid = invalid_fields(record)
+        if invalid:
+            message = f"invalid or missing fields: {invalid}"
+            results[index] = batch_result(record, 400, message, "client_ref")
+        elif record["client_ref"] in refs:
+            results[index] = batch_result(record, 409, DUPLICATE_DEPOSIT, "client_ref")
+        else:
+            refs.add(record["client_ref"])
+            valid.append(index)
+    with db_session() as sess:
+        valid = owned_items(records, valid, results, client_id, "client_ref")
+        created = insert_deposits(sess, client_id, [records[i] for i in valid])
+    for index in valid:
+        record = records[index]
+        transaction_id = created.get(record["client_ref"])
+        if transaction_id is None:
+            results[index] = batch_result(record, 409, DUPLICATE_DEPOSIT, "client_ref")
+        else:
+            results[index] = dict(
+                batch_result(record, 201, key="client_ref"), transaction_id=transaction_id
+            )
+    return json_response(results)
+
+
+DUPLICATE_DEPOSIT = "client_ref already used"
+
+
+def user_view(kind: str, user_id: int):
+    """serves one of the user's cacheable, conditional responses, see `user_response`"""
+    try:
+        status, etag, body = user_response(
+            db.session,
+            kind,
+            user_id,
+            request.headers.get("client_id", type=int),
+            request.if_none_match,
+        )
+    except UnauthorizedClientError as e:
+        return error_response(401, f"{e}")
+    response = current_app.response_class(body, status=status, mimetype="application/json")
+    response.set_etag(etag)
+    return response
+
+
+def traded_users(items: list, results: list) -> set:
+    """the users of the batch items that succeeded"""
+    return {item["user_id"] for item, result in zip(items, results) if result["status"] == 204}
+
+
 @api.route("/balances/<int:id>", methods=["GET"])
+@read_only
+@query_budget(2)
 def balances(id):
     """Balances: For a given User, get a list of Balances"""
-    user = Users.query.get_or_404(id)
-    if user.client_id != request.headers.get("client_id", type=int):
+    return user_view("balances", id)
+
+
+@api.route("/balances", methods=["GET"])
+@read_only
+@query_budget(1)
+def balances_many():
+    """Balances: For several of the client's Users, get their Balances
+
+    takes the user ids as a comma separated `ids` query parameter. ids that don't exist
+    or belong to another client are listed under "not_found"
+    """
+    try:
+        ids = {int(i) for i in request.args.get("ids", "").split(",")}
+    except ValueError:
+        return bad_request("'ids' must be a comma separated list of user ids")
+    if len(ids) > current_app.config["BATCH_MAX_ITEMS"]:
+        return bad_request(f"at most {current_app.config['BATCH_MAX_ITEMS']} ids are accepted")
+    rows = (
+        Users.balances_query()
+        .filter(Users.id.in_(ids), Users.client_id == request.headers.get("client_id", type=int))
+        .all()
+    )
+    found = {row[0] for row in rows}
+    return encoded_response(
+        iter_object(
+            {"not_found": sorted(ids - found)}, "balances", map(Users.balance_row_to_dict, rows)
+        )
+    )
+
+
+@api.route("/clients/<int:id>/balances", methods=["GET"])
+@read_only
+@query_budget(1)
+def client_balances(id: int):
+    """Client balances: get the Balances of every User of a Client, one page at a time"""
+    if id != request.headers.get("client_id", type=int):
         return error_response(401, "unauthorized client")
-    return jsonify(user.balance_to_dict()), 200
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", 100, type=int)
+    if page < 1 or not 0 < per_page <= current_app.config["BATCH_MAX_ITEMS"]:
+        return bad_request(
+            f"'page' must be positive and 'per_page' between 1 and {current_app.config['BATCH_MAX_ITEMS']}"
+        )
+    rows = (
+        Users.balances_query()
+        .filter(Users.client_id == id)
+        .offset((page - 1) * per_page)
+        .limit(per_page + 1)
+        .all()
+    )
+    fields = {
+        "page": page,
+        "per_page": per_page,
+        "next_page": page + 1 if len(rows) > per_page else None,
+    }
+    return encoded_response(
+        iter_object(fields, "balances", map(Users.balance_row_to_dict, rows[:per_page]))
+    )
+
+
+@api.route("/transactions", methods=["GET"])
+@read_only
+@query_budget(1)
+def transactions():
+    """Transactions: the calling client's transaction history, oldest first
+
+    filtered by the `user_id`, `since` and `until` (ISO 8601 bounds of `inc_time`, `since`
+    included) and `complete` (true or false) query parameters. pages of `limit` transactions,
+    100 by default, are read with keyset pagination on (inc_time, id): a page's "next" is the
+    `after` parameter of the next page, and null on the last one. with `format=ndjson` or
+    `Accept: application/x-ndjson` every matching transaction, or the first `limit`, is
+    streamed instead, one JSON object per line, from a server side cursor
+    """
+    args = request.args
+    if args.get("format", "json") not in ("json", "ndjson"):
+        return bad_request("'format' must be 'json' or 'ndjson'")
+    stream = args.get("format") == "ndjson" or (
+        "format" not in args and request.accept_mimetypes.best == "application/x-ndjson"
+    )
+    max_limit = current_app.config["BATCH_MAX_ITEMS"]
+    try:
+        statement = history_statement(args, request.headers.get("client_id", type=int))
+        limit = None if stream else 100
+        if "limit" in args:
+            limit = query_param(args, "limit", int, "a positive number")
+            if limit < 1 or (not stream and limit > max_limit):
+                raise ValueError(f"'limit' must be between 1 and {max_limit}")
+    except ValueError as e:
+        return bad_request(f"{e}")
+    if stream:
+        if limit is not None:
+            statement = statement.limit(limit)
+        chunks = stream_rows(
+            db.session.get_bind(Transactions.__mapper__),
+            statement,
+            lambda rows: dumps_lines(map(Transactions.history_row_to_dict, rows)),
+        )
+        return current_app.response_class(chunks, mimetype="application/x-ndjson")
+    rows = db.session.execute(statement.limit(limit + 1)).all()
+    fields = {"next": history_cursor(rows[limit - 1]) if len(rows) > limit else None}
+    return encoded_response(
+        iter_object(fields, "transactions", map(Transactions.history_row_to_dict, rows[:limit]))
+    )
+
+
+# export formats, by name and media type
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+@api.route("/clients/<int:id>/export", methods=["GET"])
+@read_only
+@query_budget(0)
+def client_export(id: int):
+    """Client export: the Balances of every User of a Client, streamed as CSV or NDJSON
+
+    the format is the `format` query parameter, "csv" or "ndjson", or else the one the Accept
+    header prefers, CSV by default. CSV has a column per currency, in `ACCEPTED_SYMBOLS`
+    order, and NDJSON a /balances/<id> body per line. users are read from a server side
+    cursor as the response is sent, and the response is gzipped for clients that accept it
+    """
+    if id != request.headers.get("client_id", type=int):
+        return error_response(401, "unauthorized client")
+    name = request.args.get("format")
+    if name is None:
+        mimetype = request.accept_mimetypes.best_match(EXPORT_FORMATS.values(), "text/csv")
+        name = next(key for key, value in EXPORT_FORMATS.items() if value == mimetype)
+    if name not in EXPORT_FORMATS:
+        return bad_request("'format' must be 'csv' or 'ndjson'")
+    if name == "csv":
+        head = csv_lines([("id", "provider", *ACCEPTED_SYMBOLS)])
+        encode = csv_lines
+    else:
+        head = b""
+        encode = balance_lines
+    gzip = request.accept_encodings["gzip"] > 0
+    statement = Users.balances_query().filter(Users.client_id == id).statement
+    response = current_app.response_class(
+        stream_rows(db.session.get_bind(Users.__mapper__), statement, encode, head, gzip),
+        mimetype=EXPORT_FORMATS[name],
+    )
+    response.headers["Content-Disposition"] = f'attachment; filename="client-{id}.{name}"'
+    response.vary.update(("Accept", "Accept-Encoding"))
+    if gzip:
+        response.content_encoding = "gzip"
+    return response
+
+
+def balance_lines(rows) -> bytes:
+    """`balances_query` rows as NDJSON /balances/<id> bodies"""
+    return dumps_lines(map(Users.balance_row_to_dict, rows))
+
+
+@api.route("/quote/batch", methods=["POST"])
+@query_budget(0)
+def quote_batch():
+    """Quote: price many (symbol, amount) pairs against a single rate snapshot
+
+    `?to=usd` (the default) prices crypto amounts in USD, `?to=crypto` converts USD amounts
+    to crypto. the body is a JSON array of {"symbol", "amount"} objects, columnar JSON
+    {"symbols": [...], "amounts": [...]}, or with `Content-Type: application/octet-stream`
+    packed `project.quotes.QUOTE_RECORD`s, in which case the quotes are returned as packed
+    little endian float64s. quotes are always returned in input order
+    """
+    to = request.args.get("to", "usd")
+    if to not in ("usd", "crypto"):
+        return bad_request("'to' must be 'usd' or 'crypto'")
+    max_items = current_app.config["QUOTE_MAX_ITEMS"]
+    binary = request.mimetype == "application/octet-stream"
+    try:
+        if binary:
+            codes, amounts = read_binary_quotes(request.get_data(), max_items)
+        else:
+            codes, amounts = read_json_quotes(request.get_json(silent=True), max_items)
+        snapshot = rate_store.fresh()
+    except ValueError as e:
+        return bad_request(f"{e}")
+    except InvalidSymbolError as e:
+        return error_response(404, f"'{e}' is not a valid symbol")
+    except StaleRatesError as e:
+        return error_response(503, f"{e}")
+    quotes = quote(codes, amounts, to, snapshot)
+    if binary:
+        return (
+            quotes.astype("<f8").tobytes(),
+            200,
+            {"Content-Type": "application/octet-stream", "X-Rate-Version": str(snapshot.version)},
+        )
+    return json_response({"rate_version": snapshot.version, "quotes": quotes})
@@ -0,0 +1,275 @@
+"""Settlement queue: /buy and /sell orders settled by worker processes instead of the request.
+
+With `TRADE_SETTLEMENT = "queued"`, /buy and /sell only check that the user exists, belongs
+to the calling client and that the symbol is one of `ACCEPTED_SYMBOLS`, record the order in
+the `orders` table and answer 202 with `{"order_id", "status"}` and a Location header. The
+request doesn't lock anything. Sending the same order again, with the same transaction_id,
+answers with the order already queued. GET /orders/<order_id> reports the order's progress:
+"queued", then "settled" with the "settled_transaction_id" that recorded it, or "failed" with
+the "error" /buy or /sell would have answered with, e.g. a 401 for a spent deposit.
+
+Workers are started with `flask settle --workers 4`. Each one claims up to
+`SETTLEMENT_BATCH_SIZE` queued orders with `SELECT ... FOR UPDATE SKIP LOCKED`, so workers
+never claim the same order or wait on each other's claims, and settles them in one
+transaction with `buy_order` / `sell_order`, the same code as the synchronous routes. Every
+order runs in its own savepoint, so a failed one doesn't undo the others. A worker that dies
+mid-batch leaves its orders queued for the next one. Orders whose rates are stale stay queued
+until the rates are fresh again. SQLite has neither row locks nor SKIP LOCKED, so there it
+runs a single worker.
+
+Workers invalidate the response cache of their own process only, which with the "local"
+`RESPONSE_CACHE_BACKEND` frees nothing in the app's workers. Their cached /balances/<id>
+responses are still never served after a settlement, which bumps the user's version.
+
+The ASGI app's /buy and /sell queue their orders too, see `project.asgi`, but the batch routes
+and the Socket.IO order channel still settle synchronously. /metrics serves
+the queue's depth and lag, measured from the database when it is scraped, and the workers'
+settled orders when `METRICS_MULTIPROC_DIR` is shared with them.
+"""
+import logging
+import multiprocessing
+import signal
+import threading
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import HTTPException, NotFound
+
+from project.app import db
+from project.exceptions import InvalidSymbolError, StaleRatesError, UnauthorizedClientError
+from project.globals import ACCEPTED_SYMBOLS
+from project.helpers import (
+    TRADE_ERRORS,
+    after_commit,
+    buy_order,
+    db_session,
+    deposit_id,
+    sell_order,
+    trade_error,
+)
+from project.instrumentation import request_metrics
+from project.metrics import Gauge, collect, settlement_orders, settlement_seconds
+from project.models import Orders
+from project.statements import USER, first
+
+TRADES = {"buy": buy_order, "sell": sell_order}
+
+# measured from the database when /metrics is served, so they aren't kept by any one process
+QUEUE_METRICS = {}
+settlement_queue_depth = Gauge(
+    "settlement_queue_depth", "orders queued for settlement", registry=QUEUE_METRICS
+)
+settlement_queue_lag = Gauge(
+    "settlement_queue_lag_seconds",
+    "time the oldest queued order has been waiting for settlement",
+    registry=QUEUE_METRICS,
+)
+
+
+def queued() -> bool:
+    """whether /buy and /sell queue their orders, see `TRADE_SETTLEMENT` in `project.config`"""
+    return current_app.config["TRADE_SETTLEMENT"] == "queued"
+
+
+def enqueue_order(
+    session,
+    side: str,
+    user_id: int,
+    symbol: str,
+    amount: float,
+    client_id: int,
+    transaction_id: str,
+) -> tuple:
+    """
+    checks what can be checked without locks and queues the order, see `Orders.enqueue`
+
+    raises werkzeug's `NotFound` if the user doesn't exist, `UnauthorizedClientError` if they
+    belong to another client and `InvalidSymbolError` for an unknown symbol. the caller commits
+
+    :param side: "buy" or "sell"
+    :param amount: The usd_amount of a buy, the currency_amount of a sell
+    :return: A tuple of the order's id and status
+    """
+    user = first(session, USER, user_id=user_id)
+    if user is None:
+        raise NotFound()
+    if user.client_id != client_id:
+        raise UnauthorizedClientError
+    if symbol not in ACCEPTED_SYMBOLS:
+        raise InvalidSymbolError
+    return Orders.enqueue(side, user_id, client_id, symbol, amount, transaction_id, session)
+
+
+def settle_batch(session, batch_size: int) -> int:
+    """
+    claims up to `batch_size` queued orders and settles them. the caller commits
+
+    orders are settled in (user_id, symbol) order, so that concurrent workers lock the
+    holdings in the same order and can't deadlock, and in queue order for each holding
+
+    :param session: The session to settle in, whose transaction holds the claims
+    :return: The number of orders settled or failed
+    """
+    orders = Orders.claim(batch_size, session)
+    done = []
+    for order in sorted(orders, key=lambda order: (order.user_id, order.symbol, order.id)):
+        try:
+            settle(session, order)
+        except StaleRatesError:
+            # not the order's fault, so it and the rest of the batch stay queued
+            logging.getLogger(__name__).warning("rates are stale, settlement paused")
+            break
+        done.append(order)
+    outcomes = [(order.side, order.status, order.settled_at - order.enqueued_at) for order in done]
+    after_commit(session, lambda: _count_settled(outcomes))
+    return len(done)
+
+
+def settle(session, order: Orders) -> None:
+    """
+    settles one claimed order in a savepoint, marking it settled or failed
+
+    raises `StaleRatesError`, leaving the order queued, and database errors
+    """
+    savepoint = session.begin_nested()
+    try:
+        # the queue keeps transaction_ids as they were sent, buys spend an integer id
+        key = deposit_id(order.transaction_id) if order.side == "buy" else order.transaction_id
+        transaction_id = TRADES[order.side](
+            session,
+            order.user_id,
+            order.symbol,
+            order.amount,
+            order.client_id,
+            key,
+        )
+    except StaleRatesError:
+        savepoint.rollback()
+        raise
+    except TRADE_ERRORS as e:
+        # the message may read the rows, which the rollback expires
+        error = trade_error(e, order.symbol)
+    except HTTPException as e:
+        error = (e.code, e.description)
+    else:
+        savepoint.commit()
+        order.settled(transaction_id)
+        return
+    savepoint.rollback()
+    order.failed(*error)
+
+
+def _count_settled(outcomes: list) -> None:
+    for side, status, waited in outcomes:
+        settlement_orders.labels(side, status).inc()
+        settlement_seconds.labels(side).observe(waited.total_seconds())
+
+
+def work(app, stop, batch_size: int = None, poll_interval: float = None) -> None:
+    """
+    settles queued orders until `stop` is set
+
+    a batch that fails with a database error, e.g. a deadlock, is rolled back and its
+    orders stay queued
+
+    :param stop: A `threading.Event` or `multiprocessing.Event`
+    :param batch_size: Defaults to `SETTLEMENT_BATCH_SIZE`
+    :param poll_interval: Defaults to `SETTLEMENT_POLL_INTERVAL`
+    """
+    with app.app_context():
+        batch_size = batch_size or app.config["SETTLEMENT_BATCH_SIZE"]
+        poll_interval = poll_interval or app.config["SETTLEMENT_POLL_INTERVAL"]
+        while not stop.is_set():
+            try:
+                with db_session() as sess:
+                    done = settle_batch(sess, batch_size)
+            except SQLAlchemyError:
+                logging.getLogger(__name__).exception("settlement batch failed, retrying")
+                done = 0
+            if not done:
+                stop.wait(poll_interval)
+        request_metrics.flush()
+
+
+def _worker(stop, batch_size: int, poll_interval: float) -> None:
+    """a worker process, with an app and connection pool of its own"""
+    from project.app import create_app
+
+    # Ctrl-C reaches the whole process group, the parent stops the workers instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    work(create_app(), stop, batch_size, poll_interval)
+
+
+@click.command("settle")
+@click.option("--workers", default=1, show_default=True, help="worker processes")
+@click.option("--batch-size", type=int, help="orders claimed at a time [SETTLEMENT_BATCH_SIZE]")
+@click.option(
+    "--poll-interval",
+    type=float,
+    help="seconds between looks at an empty queue [SETTLEMENT_POLL_INTERVAL]",
+)
+@with_appcontext
+def settle_command(workers: int, batch_size: int, poll_interval: float):
+    """Settles the orders queued by /buy and /sell, until interrupted."""
+    if workers < 1:
+        raise click.BadParameter("must be at least 1", param_hint="--workers")
+    if workers > 1 and db.engine.dialect.name != "postgresql":
+        raise click.UsageError("several workers need Postgres's SKIP LOCKED, use --workers 1")
+    if workers == 1:
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        try:
+            work(current_app._get_current_object(), stop, batch_size, poll_interval)
+        except KeyboardInterrupt:
+            pass
+        return
+    # spawned, not forked, so no worker inherits the parent's connections
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    processes = [
+        context.Process(target=_worker, args=(stop, batch_size, poll_interval), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for process in processes:
+            process.join()
+
+
+def queue_metrics() -> dict:
+    """the settlement queue's depth and lag, for /metrics"""
+    try:
+        depth, oldest = Orders.queue_stats(db.session)
+    except SQLAlchemyError:
+        db.session.rollback()
+        logging.getLogger(__name__).warning("could not measure the settlement queue", exc_info=True)
+        return {}
+    settlement_queue_depth.set(depth)
+    settlement_queue_lag.set((datetime.utcnow() - oldest).total_seconds() if oldest else 0.0)
+    return collect(QUEUE_METRICS)
+
+
+class SettlementQueue:
+    """Adds the `flask settle` command and the queue's metrics"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        if app.config["TRADE_SETTLEMENT"] not in ("sync", "queued"):
+            raise ValueError("TRADE_SETTLEMENT must be 'sync' or 'queued'")
+        app.cli.add_command(settle_command)
+        request_metrics.add_collector(queue_metrics)
+
+
+settlement_queue = SettlementQueue()
@@ -0,0 +1,256 @@
+"""Socket.IO order channel: buys and sells over one persistent connection.
+
+A client connects to the "/orders" namespace with its credentials in the connection's auth
+payload, `{"client_id": 1, "authorization": "<key>"}`, or in the same headers as the HTTP
+routes. The key is checked once, when connecting, and a missing or invalid one refuses the
+connection with the error body the HTTP routes would have sent.
+
+Events the client sends, each answered through the Socket.IO acknowledgement:
+
+- "buy" `{"user_id", "symbol", "usd_amount", "transaction_id"}`, the same order as
+  POST /buy/<user_id>/<symbol>/<usd_amount> with a transaction_id header
+- "sell" `{"user_id", "symbol", "currency_amount", "transaction_id"}`, like POST /sell/...
+- "subscribe" and "unsubscribe" `{"user_ids": [...]}`, the client's users to get "balance"
+  events for
+
+Orders are acknowledged with `{"transaction_id", "status", "message"}` like the items of the
+batch routes, where status is the one the HTTP route would have answered with. Successful
+ones also carry "order_id", the id of the transaction that recorded the order: the spent
+deposit of a buy, the new transaction of a sell. A client doesn't have to wait for an order's
+acknowledgement before sending the next one. Every message is handled in its own thread, so
+the acknowledgements can arrive in any order.
+
+After every committed trade, whichever route or connection made it, the subscribers of the
+users it changed get a "balance" event with the body of /balances/<user_id>. Events are sent
+by the worker that made the trade, so with several workers set `SOCKETIO_MESSAGE_QUEUE` (e.g.
+a redis:// url) to reach clients connected to the others.
+"""
+import time
+
+from flask import current_app, has_app_context, request
+from flask_socketio import Namespace, SocketIO, join_room, leave_room
+from socketio.exceptions import ConnectionRefusedError
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.datastructures import Headers
+from werkzeug.exceptions import HTTPException
+
+from project.app import db
+from project.cache import api_key_cache
+from project.exceptions import InvalidTokenError, MissingHeaderError
+from project.helpers import (
+    CONFLICT_MESSAGE,
+    TRADE_ERRORS,
+    batch_error,
+    batch_result,
+    buy_order,
+    client_credentials,
+    conflict_backoff,
+    db_session,
+    deposit_id,
+    error_payload,
+    missing_fields,
+    optimistic,
+    sell_order,
+    trade_error,
+    user_change_listeners,
+    user_owners,
+    verify_client,
+)
+from project.metrics import trade_conflicts, trade_retries
+from project.models import Users
+from project.replica import replica_router
+
+NAMESPACE = "/orders"
+
+BUY_FIELDS = {
+    "user_id": int,
+    "symbol": str,
+    "usd_amount": (int, float),
+    "transaction_id": (int, str),
+}
+SELL_FIELDS = {
+    "user_id": int,
+    "symbol": str,
+    "currency_amount": (int, float),
+    "transaction_id": (int, str),
+}
+
+socketio = SocketIO()
+
+
+def user_room(user_id: int) -> str:
+    """the room of a user's "balance" events"""
+    return f"user:{user_id}"
+
+
+class OrderNamespace(Namespace):
+    """The "/orders" namespace, see the module's docstring"""
+
+    def __init__(self, namespace: str = NAMESPACE):
+        super().__init__(namespace)
+        self.clients = {}  # sid -> id of the client authenticated on the connection
+
+    def on_connect(self, auth=None):
+        credentials = Headers(auth) if isinstance(auth, dict) else request.headers
+        try:
+            client_id, key = client_credentials(credentials)
+        except MissingHeaderError as e:
+            raise ConnectionRefusedError(error_payload(400, f"{e}"))
+        if not api_key_cache.verified(client_id, key):
+            with db_session(autocommit=False) as sess:
+                try:
+                    verify_client(sess, client_id, key)
+                except InvalidTokenError:
+                    raise ConnectionRefusedError(error_payload(401, "invalid API key"))
+                except HTTPException as e:
+                    raise ConnectionRefusedError(error_payload(e.code))
+        self.clients[request.sid] = client_id
+
+    def on_disconnect(self):
+        self.clients.pop(request.sid, None)
+
+    def on_buy(self, message):
+        return self.order(buy_order, message, BUY_FIELDS, "usd_amount")
+
+    def on_sell(self, message):
+        return self.order(sell_order, message, SELL_FIELDS, "currency_amount")
+
+    def order(self, order, message, fields: dict, amount: str) -> dict:
+        """validates an order message like the batch routes do their items, then trades it"""
+        missing = missing_fields(message, fields)
+        if not missing and message[amount] < 0:
+            # the routes' float converter doesn't match negative amounts either
+            missing = [amount]
+        if missing:
+            return batch_result(message, 400, f"invalid or missing fields: {missing}")
+        return trade(
+            order,
+            self.clients[request.sid],
+            message["user_id"],
+            message["symbol"],
+            message[amount],
+            message["transaction_id"],
+        )
+
+    def on_subscribe(self, message):
+        user_ids = message.get("user_ids") if isinstance(message, dict) else None
+        error = self.user_ids_error(user_ids)
+        if error:
+            return error_payload(400, error)
+        client_id = self.clients[request.sid]
+        with db_session(autocommit=False):
+            owners = user_owners(user_ids)
+        result = {"subscribed": [], "not_found": [], "unauthorized": []}
+        for user_id in sorted(set(user_ids)):
+            owner = owners.get(user_id)
+            if owner is None:
+                result["not_found"].append(user_id)
+            elif owner != client_id:
+                result["unauthorized"].append(user_id)
+            else:
+                join_room(user_room(user_id))
+                result["subscribed"].append(user_id)
+        return result
+
+    def on_unsubscribe(self, message):
+        user_ids = message.get("user_ids") if isinstance(message, dict) else None
+        error = self.user_ids_error(user_ids)
+        if error:
+            return error_payload(400, error)
+        for user_id in set(user_ids):
+            leave_room(user_room(user_id))
+        return {"unsubscribed": sorted(set(user_ids))}
+
+    @staticmethod
+    def user_ids_error(user_ids):
+        if not isinstance(user_ids, list) or any(
+            not isinstance(user_id, int) or isinstance(user_id, bool) for user_id in user_ids
+        ):
+            return "'user_ids' must be a list of user ids"
+        return batch_error(user_ids, current_app.config["BATCH_MAX_ITEMS"])
+
+
+def trade(order, client_id: int, user_id: int, symbol: str, amount: float, transaction_id) -> dict:
+    """
+    runs `buy_order` or `sell_order` in its own transaction, like the /buy and /sell routes
+
+    optimistic trades that conflict are re-run with the same backoff as `retry_on_conflict`
+
+    :return: The order's acknowledgement
+    """
+    item = {"transaction_id": transaction_id}
+    config = current_app.config
+    for attempt in range(config["OPTIMISTIC_MAX_RETRIES"] + 1):
+        try:
+            with db_session() as sess:
+                try:
+                    # a buy's deposit id is checked like the /buy header, see `deposit_id`
+                    key = deposit_id(f"{transaction_id}") if order is buy_order else transaction_id
+                    order_id = order(sess, user_id, symbol, amount, client_id, key, optimistic())
+                except TRADE_ERRORS as e:
+                    # the message may read the rows, which the rollback expires
+                    result = batch_result(item, *trade_error(e, symbol))
+                    sess.rollback()
+                    return result
+        except StaleDataError:
+            trade_conflicts.inc()
+        except HTTPException as e:
+            return batch_result(item, e.code, e.description)
+        else:
+            replica_router.pin(client_id)
+            return dict(batch_result(item, 204), order_id=order_id)
+        if attempt < config["OPTIMISTIC_MAX_RETRIES"]:
+            trade_retries.inc()
+            time.sleep(conflict_backoff(attempt, config))
+    return batch_result(item, 409, CONFLICT_MESSAGE)
+
+
+class OrderChannel:
+    """Serves the "/orders" namespace on `socketio` and pushes its "balance" events"""
+
+    def __init__(self, app=None):
+        self.message_queue = None
+        socketio.on_namespace(OrderNamespace())
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.message_queue = app.config["SOCKETIO_MESSAGE_QUEUE"]
+        socketio.init_app(app, message_queue=self.message_queue)
+        if self.users_changed not in user_change_listeners:
+            user_change_listeners.append(self.users_changed)
+
+    def users_changed(self, client_id: int, user_ids: list) -> None:
+        """pushes the users' new balances to their subscribers, from a background task"""
+        if not has_app_context():
+            # a trade of the asyncio serving mode (`project.asgi`), which has no socket server
+            return
+        if self.message_queue is None:
+            # with a queue the subscribers may be connected to any worker
+            user_ids = [user_id for user_id in user_ids if self.subscribed(user_id)]
+        if user_ids:
+            socketio.start_background_task(
+                self.push_balances, current_app._get_current_object(), user_ids
+            )
+
+    @staticmethod
+    def subscribed(user_id: int) -> bool:
+        manager = socketio.server.manager
+        return NAMESPACE in manager.rooms and any(
+            manager.get_participants(NAMESPACE, user_room(user_id))
+        )
+
+    @staticmethod
+    def push_balances(app, user_ids: list) -> None:
+        with app.app_context():
+            try:
+                rows = Users.balances_query().filter(Users.id.in_(user_ids)).all()
+            finally:
+                db.session.remove()
+        for row in rows:
+            socketio.emit(
+                "balance", Users.balance_row_to_dict(row), to=user_room(row[0]), namespace=NAMESPACE
+            )
+
+
+order_channel = OrderChannel()
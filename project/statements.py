@@ -0,0 +1,40 @@
+"""Pre-built statements of the lookups every trading request makes.
+
+`session.get` and `session.query(...).get` build a new statement on every call, and
+SQLAlchemy then walks it to generate the key of its compiled SQL cache, which costs more CPU
+than running a primary key lookup on a local database. The statements here are built once,
+with bound parameters, so their cache key is generated once and every execution reuses the
+compiled SQL:
+
+    user = first(session, USER, user_id=user_id)
+
+Unlike `session.get`, they always send their query, even for rows already in the session.
+Rows already in the session aren't overwritten by it.
+
+On Postgres, the asyncpg driver of the asyncio serving mode prepares every statement on the
+server and keeps it per connection, so a statement's SQL text staying the same also means it
+is parsed and planned once per connection. psycopg2 has no server side prepared statements.
+"""
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm import joinedload
+
+from project.models import Clients, Holdings, Transactions, Users
+
+# the client and its API key, for `check_api_key`
+CLIENT_WITH_KEY = (
+    select(Clients)
+    .options(joinedload(Clients.api_key))
+    .where(Clients.id == bindparam("client_id"))
+)
+USER = select(Users).where(Users.id == bindparam("user_id"))
+HOLDING = select(Holdings).where(
+    Holdings.user_id == bindparam("user_id"), Holdings.symbol == bindparam("symbol")
+)
+HOLDING_FOR_UPDATE = HOLDING.with_for_update()
+TRANSACTION = select(Transactions).where(Transactions.id == bindparam("transaction_id"))
+TRANSACTION_FOR_UPDATE = TRANSACTION.with_for_update()
+
+
+def first(session, statement, **params):
+    """the first entity `statement` selects with `params`, None if there's none"""
+    return session.execute(statement, params).scalars().first()
@@ -7,8 +7,10 @@ from flask.testing import FlaskClient
 from flask_migrate import init, migrate, upgrade
 
 from project.app import create_app
+from project.cache import api_key_cache, response_cache
 from project.helpers import db_session
-from project.models import Clients, Keys, Transactions, Users
+from project.models import Clients, Holdings, Keys, Orders, Transactions, Users
+from tests.helpers import client_headers, fill_mock
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -42,9 +44,19 @@ def set_database(temp_dir, test_client: FlaskClient):
 @pytest.fixture(autouse=True)
 def mock(test_client: FlaskClient):
     yield test_client
-    models = [Users, Clients, Transactions, Keys]
+    models = [Orders, Holdings, Users, Clients, Transactions, Keys]
     with db_session() as sess:
         for m in models:
             sess.query(m).delete()
+    api_key_cache.invalidate()
+    response_cache.init_app(test_client.application)
     for m in models:
         assert len(m.query.all()) == 0
+
+
+@pytest.fixture
+def assets() -> dict:
+    """`fill_mock`'s key, client and user, and the client's request headers under "headers"."""
+    assets = fill_mock()
+    assets["headers"] = client_headers(assets)
+    return assets
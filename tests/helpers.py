@@ -1,3 +1,8 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
 from project.app import db
 from project.models import Clients, Keys, Transactions, Users
 
@@ -139,3 +144,51 @@ def fill_mock() -> dict[Keys, Clients, Users, Transactions]:
         "client": client,
         "user": user,
     }
+
+
+def client_headers(assets: dict) -> dict:
+    """the client_id and authorization headers of the client of `fill_mock`'s assets"""
+    return {"client_id": assets["client"]["id"], "authorization": assets["client"]["key"]}
+
+
+@contextmanager
+def count_queries():
+    """
+    counts the SQL statements sent to the database inside the `with` block
+
+    the session is removed first so that nothing is served from its identity map
+
+    :return: A list that is filled with the executed statements
+    """
+    db.session.remove()
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+@contextmanager
+def bound_parameters(fragment: str):
+    """
+    collects the parameters bound to the statements containing `fragment` inside the `with`
+    block, as the driver gets them, on every engine
+
+    :return: A list that is filled with the parameters of each statement
+    """
+    parameters = []
+
+    def before_cursor_execute(conn, cursor, statement, params, context, executemany):
+        if fragment in statement:
+            parameters.append(params)
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield parameters
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
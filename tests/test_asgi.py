@@ -0,0 +1,204 @@
+import asyncio
+import json
+import os
+import secrets
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from project.app import db
+from project.asgi import AsyncAPI, async_database_uri
+from project.helpers import convert_to_crypto
+from project.models import Clients, Holdings, Keys, Orders, Transactions, Users
+from tests.helpers import bound_parameters
+
+
+class AsgiClient:
+    """calls an ASGI app in process, one request at a time, on a single event loop"""
+
+    def __init__(self, api: AsyncAPI):
+        self.api = api
+        self.loop = asyncio.new_event_loop()
+
+    def request(self, method: str, url: str, headers: dict = None):
+        scope = {
+            "type": "http",
+            "method": method.upper(),
+            "path": url,
+            "query_string": b"",
+            "headers": [(k.encode(), str(v).encode()) for k, v in (headers or {}).items()],
+        }
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        self.loop.run_until_complete(self.api(scope, receive, send))
+        return sent[0]["status"], sent[1]["body"]
+
+    def close(self):
+        self.loop.run_until_complete(self.api.engine.dispose())
+        self.loop.close()
+
+
+@pytest.fixture(scope="module")
+def database(temp_dir):
+    """a file database, so the sync seeding session and the async app see the same data"""
+    uri = f"sqlite:///{os.path.join(temp_dir, 'asgi.db')}"
+    engine = create_engine(uri)
+    db.metadata.create_all(engine)
+    yield uri, engine
+    engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def client(app: Flask, database):
+    api = AsyncAPI(dict(app.config, SQLALCHEMY_DATABASE_URI=database[0]))
+    caller = AsgiClient(api)
+    yield caller
+    caller.close()
+
+
+@pytest.fixture
+def assets(database):
+    with Session(database[1], expire_on_commit=False) as sess:
+        key = Keys(key=secrets.token_urlsafe())
+        chase = Clients(name="chase", api_key=key)
+        user = Users(client=chase, BTC=1.0, BTC_auth=True, ETH_auth=True)
+        deposit = Transactions(usd_amount=100.0, user=user, client=chase)
+        sess.add_all([key, chase, user, deposit])
+        sess.commit()
+        yield {
+            "user": user.id,
+            "deposit": deposit.id,
+            "headers": {"client_id": chase.id, "authorization": key.key},
+        }
+
+
+def holding(database, user_id: int, symbol: str) -> float:
+    with Session(database[1]) as sess:
+        return sess.get(Holdings, (user_id, symbol)).amount
+
+
+def test_async_database_uri():
+    assert async_database_uri("postgresql://u:p@host:5432/db") == "postgresql+asyncpg://u:p@host:5432/db"
+    assert async_database_uri("postgresql+psycopg2://h/db") == "postgresql+asyncpg://h/db"
+    assert async_database_uri("sqlite:///:memory:") == "sqlite+aiosqlite:///:memory:"
+
+
+def test_list_and_balances(client: AsgiClient, assets: dict):
+    status, body = client.request("get", f"/list/{assets['user']}", assets["headers"])
+    assert status == 200
+    assert json.loads(body) == {"id": assets["user"], "provider": "chase", "auths": ["BTC", "ETH"]}
+    status, body = client.request("get", f"/balances/{assets['user']}", assets["headers"])
+    assert status == 200
+    assert json.loads(body) == {"id": assets["user"], "provider": "chase", "balances": {"BTC": 1.0}}
+    headers = dict(assets["headers"], **{"If-None-Match": '"2"'})
+    assert client.request("get", f"/balances/{assets['user']}", headers) == (304, b"")
+
+
+def test_request_validation(client: AsgiClient, assets: dict):
+    url = f"/balances/{assets['user']}"
+    status, body = client.request("get", url, {"client_id": assets["headers"]["client_id"]})
+    assert (status, json.loads(body)["message"]) == (400, "'Authorization' header required")
+    headers = dict(assets["headers"], authorization="wrong")
+    status, body = client.request("get", url, headers)
+    assert (status, json.loads(body)["message"]) == (401, "invalid API key")
+    status, _ = client.request("get", url, dict(assets["headers"], client_id=0))
+    assert status == 404
+    status, body = client.request("post", url, assets["headers"])
+    assert status == 405
+    assert b"method is not allowed" in body
+    status, _ = client.request("get", f"/balances/{assets['user']}/BTC", assets["headers"])
+    assert status == 404
+    status, body = client.request("post", f"/sell/{assets['user']}/BTC/0.1", assets["headers"])
+    assert (status, json.loads(body)["message"]) == (400, "'transaction_id' header required")
+
+
+def test_buy(client: AsgiClient, assets: dict, database):
+    headers = dict(assets["headers"], transaction_id=assets["deposit"])
+    status, body = client.request("post", f"/buy/{assets['user']}/BTC/100.0", headers)
+    assert (status, body) == (204, b"")
+    assert holding(database, assets["user"], "BTC") == 1.0 + convert_to_crypto(100.0, "BTC")
+    status, body = client.request("post", f"/buy/{assets['user']}/BTC/100.0", headers)
+    assert status == 401
+    assert "Already completed" in json.loads(body)["message"]
+
+
+def test_transaction_id_is_bound_as_an_integer(client: AsgiClient, assets: dict):
+    url = f"/buy/{assets['user']}/BTC/100.0"
+    with bound_parameters("FROM transactions") as parameters:
+        status, body = client.request("post", url, dict(assets["headers"], transaction_id="abc"))
+        assert (status, json.loads(body)["message"]) == (401, "Transaction not found")
+        assert parameters == []
+        headers = dict(assets["headers"], transaction_id=assets["deposit"])
+        assert client.request("post", url, headers) == (204, b"")
+    # asyncpg refuses a str for the id's INTEGER parameter, aiosqlite doesn't
+    assert [type(value) for value in parameters[0]] == [int]
+
+
+def test_sell(client: AsgiClient, assets: dict, database):
+    headers = dict(assets["headers"], transaction_id=secrets.token_urlsafe())
+    status, _ = client.request("post", f"/sell/{assets['user']}/BTC/0.25", headers)
+    assert status == 204
+    status, body = client.request("post", f"/sell/{assets['user']}/BTC/0.25", headers)
+    assert (status, json.loads(body)["message"]) == (401, "Sell order already submitted")
+    assert holding(database, assets["user"], "BTC") == 0.75
+    status, body = client.request("post", f"/sell/{assets['user']}/DOGE/0.25", headers)
+    assert status == 401
+    assert "not authorized" in json.loads(body)["message"]
+
+
+def test_queued_orders(client: AsgiClient, assets: dict, database, monkeypatch):
+    monkeypatch.setitem(client.api.config, "TRADE_SETTLEMENT", "queued")
+    headers = dict(assets["headers"], transaction_id=assets["deposit"])
+    status, body = client.request("post", f"/buy/{assets['user']}/BTC/100.0", headers)
+    assert status == 202
+    order_id = json.loads(body)["order_id"]
+    assert json.loads(body) == {"order_id": order_id, "status": "queued"}
+    # nothing is traded until a worker settles the order
+    assert holding(database, assets["user"], "BTC") == 1.0
+    status, body = client.request("get", f"/orders/{order_id}", assets["headers"])
+    assert status == 200
+    assert json.loads(body)["status"] == "queued"
+    assert json.loads(body)["transaction_id"] == str(assets["deposit"])
+    # the queue runs the same checks as the Flask routes
+    status, body = client.request("post", f"/buy/{assets['user']}/XYZ/100.0", headers)
+    assert (status, json.loads(body)["message"]) == (404, "'XYZ' is not a valid symbol")
+    status, body = client.request("get", f"/orders/{order_id + 1}", assets["headers"])
+    assert (status, json.loads(body)["message"]) == (404, "Order not found")
+
+
+def test_unauthorized_client(client: AsgiClient, assets: dict, database):
+    with Session(database[1]) as sess:
+        key = Keys(key=secrets.token_urlsafe())
+        other = Clients(name="citi", api_key=key)
+        order = Orders(
+            side="sell",
+            user_id=assets["user"],
+            client_id=assets["headers"]["client_id"],
+            symbol="BTC",
+            amount=0.25,
+            transaction_id=secrets.token_urlsafe(),
+        )
+        sess.add_all([key, other, order])
+        sess.commit()
+        order_id = order.id
+        headers = {
+            "client_id": other.id,
+            "authorization": key.key,
+            "transaction_id": secrets.token_urlsafe(),
+        }
+    for method, url in [
+        ("get", f"/list/{assets['user']}"),
+        ("get", f"/balances/{assets['user']}"),
+        ("post", f"/sell/{assets['user']}/BTC/0.25"),
+        ("get", f"/orders/{order_id}"),
+    ]:
+        status, body = client.request(method, url, headers)
+        assert (status, json.loads(body)["message"]) == (401, "unauthorized client")
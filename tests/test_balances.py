@@ -1,7 +1,7 @@
 from flask.testing import FlaskClient
 from project.globals import ACCEPTED_SYMBOLS
 from project.helpers import convert_to_crypto
-from tests.helpers import fill_mock, send_transaction
+from tests.helpers import fill_mock, send_transaction, send_user
 
 # Happy path
 def test_balance_is_accurate(mock: FlaskClient):
@@ -100,3 +100,83 @@ def test_user_does_not_belong_to_client(mock: FlaskClient):
     ret = mock.get(url, headers=headers)
     assert ret.status_code == 401
     assert b"unauthorized client" in ret.data
+
+
+def test_balances_for_many_users(mock: FlaskClient):
+    print("test_balances_for_many_users")
+    assets = fill_mock()
+    other = fill_mock()
+    users = [assets["user"]] + [send_user(assets["client"]["id"], BTC=i, DOGE=2.0) for i in range(1, 4)]
+    headers = {
+        "client_id": assets["client"]["id"],
+        "authorization": assets["client"]["key"],
+    }
+    ids = [u["id"] for u in users] + [other["user"]["id"], 10_000]
+    ret = mock.get(f"/balances?ids={','.join(map(str, ids))}", headers=headers)
+    assert ret.status_code == 200
+    assert ret.is_streamed
+    data = ret.get_json()
+    assert [b["id"] for b in data["balances"]] == [u["id"] for u in users]
+    for balance, user in zip(data["balances"], users):
+        assert balance["provider"] == "chase"
+        check(balance, user)
+    assert data["balances"][0]["balances"] == {}
+    assert data["not_found"] == sorted([other["user"]["id"], 10_000])
+
+
+def test_balances_for_many_users_invalid_ids(mock: FlaskClient):
+    print("test_balances_for_many_users_invalid_ids")
+    assets = fill_mock()
+    headers = {
+        "client_id": assets["client"]["id"],
+        "authorization": assets["client"]["key"],
+    }
+    for query in ["", "?ids=", "?ids=1,a", "?ids=1,,2"]:
+        ret = mock.get(f"/balances{query}", headers=headers)
+        assert ret.status_code == 400
+        assert b"comma separated list" in ret.data
+
+
+def test_client_balances_are_paginated(mock: FlaskClient):
+    print("test_client_balances_are_paginated")
+    assets = fill_mock()
+    fill_mock()
+    users = [assets["user"]] + [send_user(assets["client"]["id"], ETH=i) for i in range(1, 5)]
+    headers = {
+        "client_id": assets["client"]["id"],
+        "authorization": assets["client"]["key"],
+    }
+    seen = []
+    url = f"/clients/{assets['client']['id']}/balances?per_page=2&page=1"
+    pages = 0
+    while url:
+        ret = mock.get(url, headers=headers)
+        assert ret.status_code == 200
+        data = ret.get_json()
+        assert len(data["balances"]) <= 2
+        seen += data["balances"]
+        pages += 1
+        url = (
+            f"/clients/{assets['client']['id']}/balances?per_page=2&page={data['next_page']}"
+            if data["next_page"]
+            else None
+        )
+    assert pages == 3
+    assert [b["id"] for b in seen] == [u["id"] for u in users]
+    for balance, user in zip(seen, users):
+        check(balance, user)
+
+
+def test_client_balances_of_another_client(mock: FlaskClient):
+    print("test_client_balances_of_another_client")
+    assets1 = fill_mock()
+    assets2 = fill_mock()
+    headers = {
+        "client_id": assets2["client"]["id"],
+        "authorization": assets2["client"]["key"],
+    }
+    ret = mock.get(f"/clients/{assets1['client']['id']}/balances", headers=headers)
+    assert ret.status_code == 401
+    assert b"unauthorized client" in ret.data
+    ret = mock.get(f"/clients/{assets2['client']['id']}/balances?per_page=0", headers=headers)
+    assert ret.status_code == 400
@@ -0,0 +1,85 @@
+import logging
+
+import pytest
+from flask import Flask
+
+from project.app import db
+from project.budget import query_budget, stream_budget, track_statements
+from project.exceptions import QueryBudgetError
+from project.models import Users
+from tests.helpers import fill_mock, send_user
+
+
+def load_users(ids):
+    """the N+1 pattern: one query per user"""
+    db.session.remove()
+    return [Users.query.filter_by(id=i).one() for i in ids]
+
+
+def test_track_statements():
+    client = fill_mock()["client"]
+    ids = [send_user(client["id"])["id"] for _ in range(3)]
+    with track_statements() as outer:
+        load_users(ids[:1])
+        with track_statements(budget=2, repeat_limit=2) as inner:
+            load_users(ids)
+    assert len(outer) == 4
+    assert len(inner) == 3
+    (budget, stack), (repeat, _) = inner.violations
+    assert budget == "more than 2 statements"
+    assert repeat.startswith("statement sent with more than 2 different parameters")
+    assert any("in load_users" in frame for frame in stack)
+
+
+def test_repeats_with_the_same_parameters_are_not_n_plus_one():
+    user = send_user(fill_mock()["client"]["id"])
+    with track_statements(repeat_limit=1) as tracker:
+        load_users([user["id"]] * 3)
+    assert len(tracker) == 3
+    assert tracker.violations == []
+
+
+def test_query_budget(app: Flask, monkeypatch, caplog):
+    client = fill_mock()["client"]
+    ids = [send_user(client["id"])["id"] for _ in range(3)]
+
+    @query_budget(1)
+    def view():
+        return load_users(ids)
+
+    with app.test_request_context("/users"):
+        with pytest.raises(QueryBudgetError, match="sent 3 statements: more than 1 statements"):
+            view()
+        monkeypatch.setitem(app.config, "QUERY_BUDGET", "warn")
+        with caplog.at_level(logging.WARNING, logger="project.budget"):
+            assert len(view()) == 3
+        assert "N+1" in caplog.text and "in load_users" in caplog.text
+        monkeypatch.setitem(app.config, "QUERY_BUDGET", "off")
+        assert len(view()) == 3
+
+
+def test_stream_budget(app: Flask, monkeypatch):
+    client = fill_mock()["client"]
+    ids = [send_user(client["id"])["id"] for _ in range(2)]
+
+    def body(ids):
+        for user in load_users(ids):
+            yield str(user.id).encode()
+
+    with app.test_request_context("/export"):
+        within, over = stream_budget(body(ids[:1]), 1), stream_budget(body(ids), 1)
+        monkeypatch.setitem(app.config, "QUERY_BUDGET", "off")
+        off = stream_budget(body(ids), 1)
+    # sent in turn, each body only counts its own statements
+    assert next(over) == str(ids[0]).encode()
+    assert list(within) == [str(ids[0]).encode()]
+    with pytest.raises(QueryBudgetError, match="streaming its body sent 2 statements"):
+        list(over)
+    assert len(list(off)) == 2
+
+
+def test_every_route_has_a_budget(app: Flask):
+    endpoints = [rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint.startswith("main.")]
+    assert endpoints
+    for endpoint in endpoints:
+        assert isinstance(getattr(app.view_functions[endpoint], "query_budget", None), int), endpoint
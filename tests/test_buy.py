@@ -3,7 +3,7 @@ from flask.testing import FlaskClient
 from project.globals import ACCEPTED_SYMBOLS
 from project.helpers import convert_to_crypto
 from project.models import Users
-from tests.helpers import fill_mock, send_transaction, send_user
+from tests.helpers import bound_parameters, fill_mock, send_transaction, send_user
 
 # happy path
 def test_client_can_buy_currency(mock: FlaskClient):
@@ -196,3 +196,17 @@ def test_user_is_not_authorized_for_currency(mock: FlaskClient):
         not_authorized = mock.post(url, headers=headers)
         assert not_authorized.status_code == 401
         assert b"not authorized to purchase" in not_authorized.data
+
+
+def test_transaction_id_is_bound_as_an_integer(mock: FlaskClient):
+    assets = fill_mock()
+    deposit = send_transaction(1.0, assets["user"]["id"], assets["client"]["id"]).id
+    headers = {"client_id": assets["client"]["id"], "authorization": assets["client"]["key"]}
+    url = f"/buy/{assets['user']['id']}/BTC/1.0"
+    with bound_parameters("FROM transactions") as parameters:
+        for transaction_id in ["abc", "-1", "1.0", "99999999999"]:
+            ret = mock.post(url, headers=dict(headers, transaction_id=transaction_id))
+            assert (ret.status_code, ret.json["message"]) == (401, "Transaction not found")
+        assert parameters == []
+        assert mock.post(url, headers=dict(headers, transaction_id=str(deposit))).status_code == 204
+    assert [type(value) for value in parameters[0]] == [int]
@@ -0,0 +1,91 @@
+from flask.testing import FlaskClient
+
+from project.helpers import convert_to_crypto
+from project.models import Transactions, Users
+from tests.helpers import client_headers, fill_mock, send_transaction, send_user
+
+URL = "/buy/batch"
+
+
+# happy path
+def test_client_can_buy_in_batch(mock: FlaskClient):
+    assets = fill_mock()
+    second = send_user(assets["client"]["id"])
+    items = []
+    for user_id in [assets["user"]["id"], second["id"]]:
+        for sym, usd in [("BTC", 10.0), ("ETH", 2.5), ("BTC", 1)]:
+            tran = send_transaction(usd, user_id, assets["client"]["id"])
+            items.append(
+                {"user_id": user_id, "symbol": sym, "usd_amount": usd, "transaction_id": tran.id}
+            )
+    ret = mock.post(URL, json=items, headers=client_headers(assets))
+    assert ret.status_code == 200
+    results = ret.get_json()
+    assert [r["transaction_id"] for r in results] == [i["transaction_id"] for i in items]
+    assert all(r["status"] == 204 for r in results)
+    for user_id in [assets["user"]["id"], second["id"]]:
+        user = Users.query.get(user_id)
+        assert user.BTC == convert_to_crypto(10.0, "BTC") + convert_to_crypto(1, "BTC")
+        assert user.ETH == convert_to_crypto(2.5, "ETH")
+    assert all(t.complete for t in Transactions.query.all())
+
+
+def test_failed_items_do_not_abort_batch(mock: FlaskClient):
+    assets = fill_mock()
+    other = fill_mock()
+    unauthorized = send_user(assets["client"]["id"], DOGE_auth=False)
+    ok = send_transaction(5.0, assets["user"]["id"], assets["client"]["id"])
+    spent = send_transaction(5.0, assets["user"]["id"], assets["client"]["id"])
+    spent.completed()
+    wrong_amount = send_transaction(5.0, assets["user"]["id"], assets["client"]["id"])
+    no_auth = send_transaction(5.0, unauthorized["id"], assets["client"]["id"])
+    items = [
+        {"user_id": assets["user"]["id"], "symbol": "BTC", "usd_amount": 5.0, "transaction_id": ok.id},
+        {"user_id": assets["user"]["id"], "symbol": "BTC", "usd_amount": 5.0, "transaction_id": ok.id},
+        {"user_id": assets["user"]["id"], "symbol": "BTC", "usd_amount": 5.0, "transaction_id": spent.id},
+        {"user_id": assets["user"]["id"], "symbol": "BTC", "usd_amount": 6.0, "transaction_id": wrong_amount.id},
+        {"user_id": assets["user"]["id"], "symbol": "BTC", "usd_amount": 5.0, "transaction_id": 10_000},
+        {"user_id": assets["user"]["id"], "symbol": "WRONG", "usd_amount": 5.0, "transaction_id": wrong_amount.id},
+        {"user_id": unauthorized["id"], "symbol": "DOGE", "usd_amount": 5.0, "transaction_id": no_auth.id},
+        {"user_id": other["user"]["id"], "symbol": "BTC", "usd_amount": 5.0, "transaction_id": ok.id},
+        {"user_id": 10_000, "symbol": "BTC", "usd_amount": 5.0, "transaction_id": ok.id},
+        {"user_id": assets["user"]["id"], "symbol": "BTC"},
+    ]
+    ret = mock.post(URL, json=items, headers=client_headers(assets))
+    assert ret.status_code == 200
+    results = ret.get_json()
+    assert [r["status"] for r in results] == [204, 401, 401, 401, 401, 404, 401, 401, 404, 400]
+    assert "Already completed." in results[1]["message"]
+    assert "Already completed." in results[2]["message"]
+    assert results[3]["message"] == "Transaction details do not match"
+    assert results[4]["message"] == "Transaction not found"
+    assert results[5]["message"] == "'WRONG' is not a valid symbol"
+    assert "not authorized to purchase" in results[6]["message"]
+    assert results[7]["message"] == "unauthorized client"
+    assert Users.query.get(assets["user"]["id"]).BTC == convert_to_crypto(5.0, "BTC")
+    assert Transactions.query.get(items[3]["transaction_id"]).complete is False
+
+
+# negative tests
+def test_invalid_body(mock: FlaskClient):
+    assets = fill_mock()
+    for body in [None, {}, [], {"user_id": 1}]:
+        ret = mock.post(URL, json=body, headers=client_headers(assets))
+        assert ret.status_code == 400
+
+
+def test_batch_too_large(mock: FlaskClient, app):
+    assets = fill_mock()
+    items = [{}] * (app.config["BATCH_MAX_ITEMS"] + 1)
+    ret = mock.post(URL, json=items, headers=client_headers(assets))
+    assert ret.status_code == 400
+    assert b"batches are limited" in ret.data
+
+
+def test_invalid_token(mock: FlaskClient):
+    assets = fill_mock()
+    headers = client_headers(assets)
+    headers["authorization"] += "wrong"
+    ret = mock.post(URL, json=[{}], headers=headers)
+    assert ret.status_code == 401
+    assert b"invalid API key" in ret.data
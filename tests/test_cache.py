@@ -0,0 +1,144 @@
+import time
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from project.app import db
+from project.cache import (
+    LRUCache,
+    ResponseCache,
+    api_key_cache,
+    response_cache,
+    response_cache_hits,
+    response_cache_misses,
+)
+from project.config import BaseConfig
+from project.models import Keys, Users
+from tests.helpers import count_queries, send_client, send_transaction
+
+
+def test_cached_key_skips_database(mock: FlaskClient, assets: dict):
+    headers = assets["headers"]
+    url = f"/balances/{assets['user']['id']}"
+    hits, misses = api_key_cache.hits, api_key_cache.misses
+    assert mock.get(url, headers=headers).status_code == 200
+    assert api_key_cache.misses == misses + 1
+    assert mock.get(url, headers=headers).status_code == 200
+    assert api_key_cache.hits == hits + 1
+
+
+def test_wrong_key_is_not_cached(mock: FlaskClient, assets: dict):
+    headers = dict(assets["headers"], authorization=assets["client"]["key"] + "wrong")
+    url = f"/balances/{assets['user']['id']}"
+    for _ in range(2):
+        ret = mock.get(url, headers=headers)
+        assert ret.status_code == 401
+        assert b"invalid API key" in ret.data
+    assert not api_key_cache.verified(assets["client"]["id"], headers["authorization"])
+
+
+def test_key_rotation_invalidates_cache(mock: FlaskClient, assets: dict):
+    headers = assets["headers"]
+    url = f"/balances/{assets['user']['id']}"
+    assert mock.get(url, headers=headers).status_code == 200
+    assert api_key_cache.verified(assets["client"]["id"], assets["client"]["key"])
+    key = Keys.query.get(assets["key"]["id"])
+    key.key = "rotated"
+    db.session.commit()
+    assert not api_key_cache.verified(assets["client"]["id"], assets["client"]["key"])
+    ret = mock.get(url, headers=headers)
+    assert ret.status_code == 401
+    headers["authorization"] = "rotated"
+    assert mock.get(url, headers=headers).status_code == 200
+
+
+def test_lru_cache_evicts_and_expires():
+    cache = LRUCache(maxsize=2, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 2, "misses": 2, "size": 1}
+
+
+@pytest.fixture
+def assets(assets: dict) -> dict:
+    user = Users.query.get(assets["user"]["id"])
+    user.BTC = 1.0
+    db.session.commit()
+    return assets
+
+
+def test_local_response_cache_is_off_by_default():
+    app = Flask(__name__)
+    app.config.from_object(BaseConfig())
+    assert not ResponseCache(app).enabled
+    app.config["RESPONSE_CACHE_ENABLED"] = True
+    assert ResponseCache(app).enabled
+
+
+def test_cached_response_skips_database(mock: FlaskClient, assets: dict):
+    url = f"/balances/{assets['user']['id']}"
+    hits, misses = response_cache_hits.value, response_cache_misses.value
+    first = mock.get(url, headers=assets["headers"])
+    assert response_cache_misses.value == misses + 1
+    with count_queries() as statements:
+        second = mock.get(url, headers=assets["headers"])
+    # only the user's version, to check the cached body is current
+    assert len(statements) == 1
+    assert response_cache_hits.value == hits + 1
+    assert (second.status_code, second.data, second.mimetype) == (200, first.data, "application/json")
+
+
+def test_trades_invalidate_cached_responses(mock: FlaskClient, assets: dict):
+    user_id = assets["user"]["id"]
+    url = f"/balances/{user_id}"
+    assert mock.get(url, headers=assets["headers"]).json["balances"]["BTC"] == 1.0
+    assert mock.get(f"/list/{user_id}", headers=assets["headers"]).status_code == 200
+    headers = dict(assets["headers"], transaction_id="sell-1")
+    assert mock.post(f"/sell/{user_id}/BTC/0.25", headers=headers).status_code == 204
+    assert mock.get(url, headers=assets["headers"]).json["balances"]["BTC"] == 0.75
+    deposit = send_transaction(100.0, user_id, assets["client"]["id"]).id
+    batch = [{"user_id": user_id, "symbol": "BTC", "usd_amount": 100.0, "transaction_id": deposit}]
+    assert mock.post("/buy/batch", json=batch, headers=assets["headers"]).json[0]["status"] == 204
+    assert mock.get(url, headers=assets["headers"]).json["balances"]["BTC"] > 0.75
+
+
+def test_failed_trades_keep_cached_responses(mock: FlaskClient, assets: dict):
+    url = f"/balances/{assets['user']['id']}"
+    mock.get(url, headers=assets["headers"])
+    hits = response_cache_hits.value
+    headers = dict(assets["headers"], transaction_id="sell-1")
+    assert mock.post(f"/sell/{assets['user']['id']}/BTC/5.0", headers=headers).status_code == 401
+    assert mock.get(url, headers=assets["headers"]).status_code == 200
+    assert response_cache_hits.value == hits + 1
+
+
+def test_stale_cached_response_is_not_served(mock: FlaskClient, assets: dict):
+    user_id = assets["user"]["id"]
+    url = f"/balances/{user_id}"
+    stale = mock.get(url, headers=assets["headers"])
+    headers = dict(assets["headers"], transaction_id="sell-1")
+    assert mock.post(f"/sell/{user_id}/BTC/0.25", headers=headers).status_code == 204
+    # a reader that built its body before the sell caches it after the sell's invalidation
+    response_cache.set(
+        "balances", assets["client"]["id"], user_id, stale.get_etag()[0], stale.data
+    )
+    ret = mock.get(url, headers=assets["headers"])
+    assert ret.json["balances"]["BTC"] == 0.75
+    assert ret.get_etag()[0] != stale.get_etag()[0]
+
+
+def test_cached_response_is_not_served_to_other_clients(mock: FlaskClient, assets: dict):
+    url = f"/balances/{assets['user']['id']}"
+    assert mock.get(url, headers=assets["headers"]).status_code == 200
+    other = send_client("citi", assets["key"]["id"])
+    headers = {"client_id": other["id"], "authorization": other["key"]}
+    ret = mock.get(url, headers=headers)
+    assert ret.status_code == 401
+    assert b"unauthorized client" in ret.data
@@ -0,0 +1,63 @@
+import pytest
+from flask.testing import FlaskClient
+
+from project.app import db
+from project.cache import api_key_cache
+from project.models import Users
+from tests.helpers import count_queries, send_client
+
+
+@pytest.fixture
+def assets(assets: dict) -> dict:
+    user = Users.query.get(assets["user"]["id"])
+    user.BTC = 1.0
+    db.session.commit()
+    return assets
+
+
+def test_matching_etag_is_not_modified(mock: FlaskClient, assets: dict):
+    url = f"/balances/{assets['user']['id']}"
+    first = mock.get(url, headers=assets["headers"])
+    assert first.status_code == 200
+    assert first.get_etag() == (str(Users.query.get(assets["user"]["id"]).version), False)
+    api_key_cache.store(assets["client"]["id"], assets["client"]["key"])
+    headers = dict(assets["headers"], **{"If-None-Match": first.headers["ETag"]})
+    with count_queries() as statements:
+        ret = mock.get(url, headers=headers)
+    assert (ret.status_code, ret.data) == (304, b"")
+    assert ret.headers["ETag"] == first.headers["ETag"]
+    # only the version lookup, the user isn't loaded
+    assert len(statements) == 1
+
+
+def test_trades_change_the_etag(mock: FlaskClient, assets: dict):
+    user_id = assets["user"]["id"]
+    first = mock.get(f"/balances/{user_id}", headers=assets["headers"])
+    headers = dict(assets["headers"], transaction_id="sell-1")
+    assert mock.post(f"/sell/{user_id}/BTC/0.25", headers=headers).status_code == 204
+    headers = dict(assets["headers"], **{"If-None-Match": first.headers["ETag"]})
+    ret = mock.get(f"/balances/{user_id}", headers=headers)
+    assert ret.status_code == 200
+    assert ret.headers["ETag"] != first.headers["ETag"]
+    assert ret.json["balances"]["BTC"] == 0.75
+
+
+def test_authorization_changes_change_the_etag(mock: FlaskClient, assets: dict):
+    user_id = assets["user"]["id"]
+    first = mock.get(f"/list/{user_id}", headers=assets["headers"])
+    assert "ETH" in first.json["auths"]
+    user = Users.query.get(user_id)
+    user.ETH_auth = False
+    db.session.commit()
+    headers = dict(assets["headers"], **{"If-None-Match": first.headers["ETag"]})
+    ret = mock.get(f"/list/{user_id}", headers=headers)
+    assert ret.status_code == 200
+    assert "ETH" not in ret.json["auths"]
+
+
+def test_etag_of_another_clients_user(mock: FlaskClient, assets: dict):
+    url = f"/balances/{assets['user']['id']}"
+    etag = mock.get(url, headers=assets["headers"]).headers["ETag"]
+    other = send_client("citi", assets["key"]["id"])
+    headers = {"client_id": other["id"], "authorization": other["key"], "If-None-Match": etag}
+    assert mock.get(url, headers=headers).status_code == 401
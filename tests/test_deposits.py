@@ -0,0 +1,103 @@
+import pytest
+from flask.testing import FlaskClient
+
+from project.app import db
+from project.deposits import insert_deposits
+from project.models import Transactions, Users
+from tests.helpers import send_client, send_key, send_user
+
+CSV_HEADER = "user_id,usd_amount,client_ref"
+
+
+def test_bulk_deposits(mock: FlaskClient, assets: dict):
+    user_id = assets["user"]["id"]
+    other = send_user(client_id=send_client("other", send_key()["id"])["id"])
+    records = [
+        {"user_id": user_id, "usd_amount": 10.0, "client_ref": "a"},
+        {"user_id": user_id, "usd_amount": -1.0, "client_ref": "b"},
+        {"user_id": other["id"], "usd_amount": 1.0, "client_ref": "c"},
+        {"user_id": user_id + 1000, "usd_amount": 1.0, "client_ref": "d"},
+        {"user_id": user_id, "usd_amount": 2, "client_ref": "e"},
+        {"user_id": user_id, "usd_amount": 3.0, "client_ref": "a"},
+        {"user_id": user_id, "client_ref": "f"},
+    ]
+    response = mock.post("/deposits/bulk", json=records, headers=assets["headers"])
+    assert response.status_code == 200
+    results = response.get_json()
+    statuses = [(result["client_ref"], result["status"]) for result in results]
+    assert statuses == [
+        ("a", 201),
+        ("b", 400),
+        ("c", 401),
+        ("d", 404),
+        ("e", 201),
+        ("a", 409),
+        ("f", 400),
+    ]
+    created = {r["client_ref"]: r["transaction_id"] for r in results if r["status"] == 201}
+    for ref, amount in [("a", 10.0), ("e", 2.0)]:
+        deposit = db.session.get(Transactions, created[ref])
+        assert (deposit.usd_amount, deposit.user_id, deposit.client_ref) == (amount, user_id, ref)
+        assert deposit.inc_key is None
+        assert not deposit.complete
+        assert deposit.client_id == assets["client"]["id"]
+
+    # the deposits can be spent
+    headers = dict(assets["headers"], transaction_id=str(created["a"]))
+    assert mock.post(f"/buy/{user_id}/BTC/10.0", headers=headers).status_code == 204
+    # sell orders' transaction_ids don't collide with deposit references
+    headers = dict(assets["headers"], transaction_id="e")
+    amount = Users.query.get(user_id).BTC / 2
+    assert mock.post(f"/sell/{user_id}/BTC/{amount}", headers=headers).status_code == 204
+
+    # resending the batch inserts nothing
+    count = Transactions.query.count()
+    results = mock.post("/deposits/bulk", json=records[:1], headers=assets["headers"]).get_json()
+    assert results == [{"client_ref": "a", "status": 409, "message": "client_ref already used"}]
+    assert Transactions.query.count() == count
+
+
+def test_csv_deposits(mock: FlaskClient, assets: dict):
+    user_id = assets["user"]["id"]
+    body = f"client_ref,user_id,usd_amount\nx1,{user_id},5.5\nx2,{user_id},abc\nx3,{user_id},7\n"
+    response = mock.post(
+        "/deposits/bulk",
+        data=body,
+        headers=dict(assets["headers"], **{"Content-Type": "text/csv"}),
+    )
+    results = response.get_json()
+    assert [result["status"] for result in results] == [201, 400, 201]
+    amounts = [db.session.get(Transactions, results[i]["transaction_id"]).usd_amount for i in (0, 2)]
+    assert amounts == [5.5, 7.0]
+
+
+
+def test_insert_returns_only_its_own_rows(assets: dict):
+    user_id, client_id = assets["user"]["id"], assets["client"]["id"]
+    records = [{"user_id": user_id, "usd_amount": 1.0, "client_ref": ref} for ref in ("r1", "r2")]
+    # r1 was inserted by another request, whose row conflicts with this one's
+    earlier = insert_deposits(db.session, client_id, records[:1])
+    created = insert_deposits(db.session, client_id, records)
+    assert list(created) == ["r2"]
+    assert created["r2"] != earlier["r1"]
+    assert db.session.get(Transactions, created["r2"]).client_ref == "r2"
+    db.session.rollback()
+
+
+@pytest.mark.parametrize(
+    "kwargs,message",
+    [
+        ({"json": {"user_id": 1}}, "request body must be a non-empty JSON array"),
+        ({"json": [{}] * 5001}, "batches are limited to 5000 items"),
+        ({"data": "user_id,usd_amount\n1,2\n"}, f"CSV body must start with a {CSV_HEADER} header"),
+        ({"data": f"{CSV_HEADER}\n"}, "CSV body must have at least one record"),
+        ({"data": f"{CSV_HEADER}\n" + "1,1.0,r\n" * 5001}, "batches are limited to 5000 items"),
+    ],
+)
+def test_invalid_bodies(mock: FlaskClient, assets: dict, kwargs: dict, message: str):
+    headers = dict(assets["headers"])
+    if "data" in kwargs:
+        headers["Content-Type"] = "text/csv"
+    response = mock.post("/deposits/bulk", headers=headers, **kwargs)
+    assert response.status_code == 400
+    assert response.get_json()["message"] == message
@@ -0,0 +1,53 @@
+import json
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from flask import Flask
+
+from project import encoding
+from project.encoding import dumps, iter_object, std_dumps
+from project.helpers import CONSTANT_ERRORS, error_body, error_response
+
+PAYLOADS = [
+    {"id": 1, "provider": "chase", "balances": {"ETH": 2.5, "BTC": 0.1}},
+    {"id": 1, "provider": "chase", "auths": ["BTC", "ETH"]},
+    [{"index": 0, "status": 204}, {"index": 1, "status": 401, "message": "é"}],
+    {"quotes": [1e-05, 123456.789, 0.0], "rate_version": 3},
+]
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_dumps_matches_the_standard_library(payload):
+    assert json.loads(dumps(payload)) == json.loads(std_dumps(payload)) == payload
+
+
+def test_dumps_is_compact_and_sorted():
+    assert dumps({"b": 1, "a": {"d": [1, 2], "c": None}}) == b'{"a":{"c":null,"d":[1,2]},"b":1}\n'
+    assert std_dumps({"b": 1, "a": {"d": [1, 2], "c": None}}) == b'{"a":{"c":null,"d":[1,2]},"b":1}\n'
+
+
+def test_dumps_falls_back(monkeypatch):
+    assert json.loads(dumps({"big": 2**70, "price": Decimal("1.5")})) == {"big": 2**70, "price": "1.5"}
+    assert json.loads(dumps({"quotes": np.array([1.5, 2.5])})) == {"quotes": [1.5, 2.5]}
+    monkeypatch.setattr(encoding, "orjson", None)
+    assert dumps({"b": np.float64(1.5), "a": [1]}) == b'{"a":[1],"b":1.5}\n'
+
+
+@pytest.mark.parametrize("fields", [{}, {"page": 1, "next_page": None}])
+def test_iter_object(fields):
+    rows = [{"id": i} for i in range(3)]
+    body = b"".join(iter_object(fields, "balances", iter(rows)))
+    assert json.loads(body) == dict(fields, balances=rows)
+    assert json.loads(b"".join(iter_object(fields, "balances", []))) == dict(fields, balances=[])
+
+
+def test_constant_errors_are_pre_encoded(app: Flask):
+    body = error_body(401, "invalid API key")
+    assert body is CONSTANT_ERRORS[(401, "invalid API key")]
+    assert json.loads(body) == {"error": "Unauthorized", "message": "invalid API key"}
+    assert json.loads(error_body(404, "'XRP' is not a valid symbol"))["message"] == "'XRP' is not a valid symbol"
+    with app.test_request_context():
+        response = error_response(409)
+    assert (response.status_code, response.mimetype) == (409, "application/json")
+    assert response.json == {"error": "Conflict"}
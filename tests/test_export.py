@@ -0,0 +1,71 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from project.globals import ACCEPTED_SYMBOLS
+from tests.helpers import send_client, send_key, send_user
+
+
+@pytest.fixture
+def assets(assets: dict, app: Flask, monkeypatch):
+    monkeypatch.setitem(app.config, "STREAM_YIELD_PER", 2)
+    client_id = assets["client"]["id"]
+    assets["users"] = [assets["user"]] + [
+        send_user(client_id=client_id, BTC=1.5 * n, DOGE=n) for n in range(1, 5)
+    ]
+    send_user(client_id=send_client("other", send_key()["id"])["id"], BTC=9.0)
+    return assets
+
+
+def test_csv_export(mock: FlaskClient, assets: dict):
+    client_id = assets["client"]["id"]
+    response = mock.get(f"/clients/{client_id}/export", headers=assets["headers"])
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert response.is_streamed
+    assert response.headers["Content-Disposition"] == f'attachment; filename="client-{client_id}.csv"'
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == ["id", "provider", *ACCEPTED_SYMBOLS]
+    assert rows[1:] == [
+        [str(user["id"]), "chase", *[str(float(user[symbol])) for symbol in ACCEPTED_SYMBOLS]]
+        for user in assets["users"]
+    ]
+
+
+def test_ndjson_export(mock: FlaskClient, assets: dict):
+    client_id = assets["client"]["id"]
+    headers = dict(assets["headers"], Accept="application/x-ndjson")
+    response = mock.get(f"/clients/{client_id}/export", headers=headers)
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data().splitlines()]
+    assert lines == [
+        mock.get(f"/balances/{user['id']}", headers=assets["headers"]).get_json()
+        for user in assets["users"]
+    ]
+    # the format parameter wins over the Accept header
+    response = mock.get(f"/clients/{client_id}/export?format=csv", headers=headers)
+    assert response.mimetype == "text/csv"
+
+
+def test_gzip_export(mock: FlaskClient, assets: dict):
+    url = f"/clients/{assets['client']['id']}/export?format=ndjson"
+    plain = mock.get(url, headers=assets["headers"])
+    assert "Content-Encoding" not in plain.headers
+    compressed = mock.get(url, headers=dict(assets["headers"], **{"Accept-Encoding": "gzip"}))
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in compressed.headers["Vary"]
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
+
+
+def test_export_errors(mock: FlaskClient, assets: dict):
+    client_id = assets["client"]["id"]
+    response = mock.get(f"/clients/{client_id + 1}/export", headers=assets["headers"])
+    assert response.status_code == 401
+    response = mock.get(f"/clients/{client_id}/export?format=xml", headers=assets["headers"])
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "'format' must be 'csv' or 'ndjson'"
@@ -0,0 +1,159 @@
+import json
+import os
+import time
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from project.app import db
+from project.helpers import convert_to_crypto
+from project.instrumentation import (
+    db_lock_wait_seconds,
+    db_request_statements,
+    http_phase_seconds,
+    http_requests,
+    request_metrics,
+)
+from project.metrics import Counter, Gauge, Histogram, collect, merge, render
+from project.models import Users
+from tests.helpers import send_transaction
+
+
+@pytest.fixture
+def assets(assets: dict):
+    user = Users.query.get(assets["user"]["id"])
+    user.BTC = convert_to_crypto(1_000.00, "BTC")
+    db.session.commit()
+    return assets
+
+
+def test_render():
+    registry = {}
+    Counter("orders_total", "orders", ("route",), registry).labels('a"b').inc(2)
+    Gauge("in_use", "in use", registry=registry).set(3)
+    latency = Histogram("latency_seconds", "latency", (0.1, 1), registry=registry)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    assert render(collect(registry)).splitlines() == [
+        "# HELP in_use in use",
+        "# TYPE in_use gauge",
+        "in_use 3",
+        "# HELP latency_seconds latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 2',
+        "latency_seconds_sum 0.55",
+        "latency_seconds_count 2",
+        "# HELP orders_total orders",
+        "# TYPE orders_total counter",
+        'orders_total{route="a\\"b"} 2',
+    ]
+
+
+def test_merge():
+    registry = {}
+    orders = Counter("orders_total", "orders", ("route",), registry)
+    in_use = Gauge("in_use", "in use", registry=registry)
+    latency = Histogram("latency_seconds", "latency", (1,), registry=registry)
+    orders.labels("buy").inc()
+    in_use.set(2)
+    latency.observe(0.5)
+    first = json.loads(json.dumps(collect(registry)))
+    orders.labels("sell").inc()
+    latency.observe(5)
+    second = collect(registry)
+    merged = merge({10: first, 11: second, 12: first}, live={10, 11})
+    assert merged["orders_total"]["samples"] == [[["buy"], 3], [["sell"], 1]]
+    assert merged["in_use"]["samples"] == [[["10"], 2], [["11"], 2]]
+    assert merged["in_use"]["labelnames"] == ["pid"]
+    assert merged["latency_seconds"]["samples"] == [[[], [[3, 1], 6.5]]]
+
+
+def test_requests_are_recorded(mock: FlaskClient, assets: dict):
+    buys = db_request_statements.labels("main.buy").count
+    auths = http_phase_seconds.labels("main.balances", "auth").count
+    ok = http_requests.labels("main.balances", 200).value
+    tran = send_transaction(1.0, assets["user"]["id"], assets["client"]["id"])
+    headers = dict(assets["headers"], transaction_id=tran.id)
+    assert mock.post(f"/buy/{assets['user']['id']}/BTC/1.0", headers=headers).status_code == 204
+    assert mock.get(f"/balances/{assets['user']['id']}", headers=assets["headers"]).status_code == 200
+    # the test client keeps a request's context until the next request, which is when the
+    # request is recorded
+    response = mock.get("/metrics")
+    assert db_request_statements.labels("main.buy").count == buys + 1
+    assert db_request_statements.labels("main.buy").sum >= 5
+    assert db_lock_wait_seconds.labels("main.buy").count == buys + 1
+    assert http_phase_seconds.labels("main.balances", "auth").count == auths + 1
+    assert http_requests.labels("main.balances", 200).value == ok + 1
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    assert f'http_requests_total{{route="main.balances",status="200"}} {ok + 1}' in body
+    assert 'db_lock_wait_seconds_per_request_bucket{route="main.buy",le="+Inf"}' in body
+    assert "# TYPE db_pool_checkout_seconds histogram" in body
+
+
+def test_streamed_bodies_are_recorded(mock: FlaskClient, assets: dict):
+    count = http_phase_seconds.labels("main.client_balances", "serialize").count
+    url = f"/clients/{assets['client']['id']}/balances"
+    response = mock.get(url, headers=assets["headers"])
+    assert "Content-Length" not in response.headers
+    # recorded once the body is sent, after the request itself
+    assert response.get_json()["balances"][0]["id"] == assets["user"]["id"]
+    assert http_phase_seconds.labels("main.client_balances", "serialize").count == count + 1
+
+
+def test_metrics_token(mock: FlaskClient, app: Flask, monkeypatch):
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", "scraper")
+    assert mock.get("/metrics").status_code == 401
+    assert mock.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert mock.get("/metrics", headers={"Authorization": "Bearer scraper"}).status_code == 200
+
+
+def test_multiple_workers(mock: FlaskClient, temp_dir, monkeypatch):
+    directory = os.path.join(temp_dir, "metrics")
+    os.makedirs(directory, exist_ok=True)
+    monkeypatch.setattr(request_metrics, "multiproc_dir", directory)
+    other = {
+        "http_requests_total": {
+            "type": "counter",
+            "help": "requests answered",
+            "labelnames": ["route", "status"],
+            "bounds": [],
+            "samples": [[["main.sell", "204"], 1000]],
+        },
+        "db_pool_connections_in_use": {
+            "type": "gauge",
+            "help": "in use",
+            "labelnames": [],
+            "bounds": [],
+            "samples": [[[], 7]],
+        },
+    }
+    # a worker that has exited: its counts stay, its gauges don't
+    with open(os.path.join(directory, "999999999.json"), "w") as f:
+        json.dump(other, f)
+    sells = http_requests.labels("main.sell", 204).value
+    body = mock.get("/metrics").get_data(as_text=True)
+    assert f'http_requests_total{{route="main.sell",status="204"}} {sells + 1000}' in body
+    assert f'db_pool_connections_in_use{{pid="{os.getpid()}"}}' in body
+    assert 'pid="999999999"' not in body
+    assert os.path.exists(os.path.join(directory, f"{os.getpid()}.json"))
+
+
+def test_idle_workers_flush(temp_dir, monkeypatch):
+    directory = os.path.join(temp_dir, "idle")
+    os.makedirs(directory, exist_ok=True)
+    monkeypatch.setattr(request_metrics, "multiproc_dir", directory)
+    monkeypatch.setattr(request_metrics, "flush_interval", 0.01)
+    monkeypatch.setattr(request_metrics, "_flusher_pid", None)
+    request_metrics.start_flusher()
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    # written by the thread, without any request
+    deadline = time.monotonic() + 2
+    while not os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert os.path.exists(path)
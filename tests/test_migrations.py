@@ -0,0 +1,66 @@
+import os
+
+import pytest
+import sqlalchemy as sa
+from flask import Flask
+from flask_migrate import downgrade, upgrade
+
+from project.app import db, migrate
+from project.config import TestConfig
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations")
+INITIAL = "d2d331b1db58"  # the schema with a column per currency on users
+
+
+@pytest.fixture
+def migrated(temp_dir):
+    """an app on its own SQLite file, to run the committed migrations against"""
+    app = Flask(__name__)
+    app.config.from_object(TestConfig())
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(temp_dir, 'migrations.db')}"
+    db.init_app(app)
+    migrate.init_app(app, db)
+    with app.app_context():
+        yield db.get_engine()
+        db.get_engine().dispose()
+
+
+def holdings(engine) -> set:
+    with engine.connect() as conn:
+        return set(conn.execute(sa.text("SELECT user_id, symbol, amount, authorized FROM holdings")))
+
+
+def test_holdings_survive_a_round_trip(migrated):
+    upgrade(directory=MIGRATIONS, revision=INITIAL)
+    with migrated.begin() as conn:
+        conn.execute(sa.text("INSERT INTO keys (id, key) VALUES (1, 'k')"))
+        conn.execute(sa.text("INSERT INTO clients (id, name, key_id) VALUES (1, 'chase', 1)"))
+        conn.execute(
+            sa.text(
+                "INSERT INTO users (id, client_id, BTC, BTC_auth, ETH, ETH_auth)"
+                " VALUES (1, 1, 1.5, 1, 0.25, 0), (2, 1, NULL, NULL, 3.0, 1)"
+            )
+        )
+    expected = {
+        (1, "BTC", 1.5, True),
+        (1, "ETH", 0.25, False),
+        (2, "ETH", 3.0, True),
+        *{(1, s, 0.0, False) for s in ("DOGE", "USDT", "BNB")},
+        *{(2, s, 0.0, False) for s in ("BTC", "DOGE", "USDT", "BNB")},
+    }
+
+    upgrade(directory=MIGRATIONS)
+    assert holdings(migrated) == expected
+    with migrated.connect() as conn:
+        assert set(conn.execute(sa.text("SELECT version FROM holdings"))) == {(1,)}
+
+    downgrade(directory=MIGRATIONS, revision=INITIAL)
+    with migrated.connect() as conn:
+        users = conn.execute(
+            sa.text("SELECT id, BTC, BTC_auth, ETH, ETH_auth, DOGE FROM users ORDER BY id")
+        ).all()
+    assert users == [(1, 1.5, True, 0.25, False, 0.0), (2, 0.0, False, 3.0, True, 0.0)]
+    assert "holdings" not in sa.inspect(migrated).get_table_names()
+
+    upgrade(directory=MIGRATIONS)
+    assert holdings(migrated) == expected
@@ -0,0 +1,121 @@
+import secrets
+
+import pytest
+from flask.testing import FlaskClient
+from sqlalchemy import update
+
+import project.routes as routes
+from project.app import db
+from project.helpers import convert_to_crypto
+from project.metrics import trade_conflicts, trade_retries
+from project.models import Holdings, Transactions, Users
+from tests.helpers import client_headers, fill_mock, send_transaction
+
+
+@pytest.fixture
+def optimistic(app, monkeypatch):
+    monkeypatch.setitem(app.config, "TRADE_LOCKING", "optimistic")
+    monkeypatch.setitem(app.config, "OPTIMISTIC_BACKOFF", 0)
+    yield app
+
+
+def conflict_on_first(monkeypatch, method: str, times: int):
+    """makes another trade change the holding between the read and the commit, `times` times"""
+    original = getattr(Holdings, method)
+    calls = {"n": 0}
+
+    def conflicting(self, *args, **kwargs):
+        calls["n"] += 1
+        if calls["n"] <= times:
+            db.session.execute(
+                update(Holdings)
+                .where(Holdings.user_id == self.user_id, Holdings.symbol == self.symbol)
+                .values(version=Holdings.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+        return original(self, *args, **kwargs)
+
+    monkeypatch.setattr(Holdings, method, conflicting)
+    return calls
+
+
+def headers_for(assets: dict, transaction_id) -> dict:
+    return dict(client_headers(assets), transaction_id=transaction_id)
+
+
+# happy path
+def test_optimistic_buy_retries_conflicts(mock: FlaskClient, optimistic, monkeypatch):
+    assets = fill_mock()
+    tran_id = send_transaction(10.0, assets["user"]["id"], assets["client"]["id"]).id
+    calls = conflict_on_first(monkeypatch, "purchase", 2)
+    conflicts, retries = trade_conflicts.value, trade_retries.value
+    ret = mock.post(f"/buy/{assets['user']['id']}/BTC/10.0", headers=headers_for(assets, tran_id))
+    assert ret.status_code == 204
+    assert calls["n"] == 3
+    assert trade_conflicts.value == conflicts + 2
+    assert trade_retries.value == retries + 2
+    assert Users.query.get(assets["user"]["id"]).BTC == convert_to_crypto(10.0, "BTC")
+    assert Transactions.query.get(tran_id).complete is True
+
+
+def test_optimistic_sell_retries_conflicts(mock: FlaskClient, optimistic, monkeypatch):
+    assets = fill_mock()
+    user = Users.query.get(assets["user"]["id"])
+    user.BTC = 1.0
+    db.session.commit()
+    monkeypatch.setattr(routes, "sell_currency", _conflicting_sell(routes.sell_currency))
+    inc_key = secrets.token_urlsafe()
+    ret = mock.post(f"/sell/{assets['user']['id']}/BTC/0.25", headers=headers_for(assets, inc_key))
+    assert ret.status_code == 204
+    assert Users.query.get(assets["user"]["id"]).BTC == 0.75
+    assert Transactions.query.filter_by(inc_key=inc_key).count() == 1
+
+
+def _conflicting_sell(original):
+    calls = {"n": 0}
+
+    def conflicting(holding, *args, **kwargs):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            db.session.execute(
+                update(Holdings)
+                .where(Holdings.user_id == holding.user_id, Holdings.symbol == holding.symbol)
+                .values(version=Holdings.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+        return original(holding, *args, **kwargs)
+
+    return conflicting
+
+
+# negative tests
+def test_optimistic_buy_gives_up(mock: FlaskClient, optimistic, monkeypatch):
+    assets = fill_mock()
+    tran_id = send_transaction(10.0, assets["user"]["id"], assets["client"]["id"]).id
+    calls = conflict_on_first(monkeypatch, "purchase", 100)
+    ret = mock.post(f"/buy/{assets['user']['id']}/BTC/10.0", headers=headers_for(assets, tran_id))
+    assert ret.status_code == 409
+    assert calls["n"] == optimistic.config["OPTIMISTIC_MAX_RETRIES"] + 1
+    assert Users.query.get(assets["user"]["id"]).BTC == 0.0
+    assert Transactions.query.get(tran_id).complete is False
+
+
+def test_optimistic_buy_cannot_spend_a_deposit_twice(mock: FlaskClient, optimistic, monkeypatch):
+    assets = fill_mock()
+    tran_id = send_transaction(10.0, assets["user"]["id"], assets["client"]["id"]).id
+    original = Holdings.purchase
+
+    def spent_concurrently(self, *args, **kwargs):
+        db.session.execute(
+            update(Transactions)
+            .where(Transactions.id == tran_id)
+            .values(complete=True)
+            .execution_options(synchronize_session=False)
+        )
+        return original(self, *args, **kwargs)
+
+    monkeypatch.setattr(Holdings, "purchase", spent_concurrently)
+    ret = mock.post(f"/buy/{assets['user']['id']}/BTC/10.0", headers=headers_for(assets, tran_id))
+    monkeypatch.setattr(Holdings, "purchase", original)
+    assert ret.status_code == 409
+    assert Users.query.get(assets["user"]["id"]).BTC == 0.0
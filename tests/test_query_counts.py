@@ -0,0 +1,115 @@
+"""Regression tests for the number of SQL statements each route sends to the database"""
+import secrets
+
+import pytest
+from flask.testing import FlaskClient
+
+from project.app import db
+from project.cache import api_key_cache
+from project.helpers import convert_to_crypto
+from project.models import Users
+from tests.helpers import count_queries, send_transaction, send_user
+
+# statements spent by `check_api_key` when the API key is not cached
+AUTH = 1
+# the user's version, looked up by `user_response` while the response cache is enabled
+VERSION = 1
+
+
+@pytest.fixture
+def assets(assets: dict):
+    user = Users.query.get(assets["user"]["id"])
+    user.BTC = convert_to_crypto(1_000_000.00, "BTC")
+    db.session.commit()
+    return assets
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_currency_list(mock: FlaskClient, assets: dict, cached: bool):
+    if cached:
+        api_key_cache.store(assets["client"]["id"], assets["client"]["key"])
+    with count_queries() as statements:
+        ret = mock.get(f"/list/{assets['user']['id']}", headers=assets["headers"])
+    assert ret.status_code == 200
+    assert len(statements) == (0 if cached else AUTH) + VERSION + 1
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_balances(mock: FlaskClient, assets: dict, cached: bool):
+    if cached:
+        api_key_cache.store(assets["client"]["id"], assets["client"]["key"])
+    with count_queries() as statements:
+        ret = mock.get(f"/balances/{assets['user']['id']}", headers=assets["headers"])
+    assert ret.status_code == 200
+    assert len(statements) == (0 if cached else AUTH) + VERSION + 1
+
+
+def test_buy(mock: FlaskClient, assets: dict):
+    tran = send_transaction(1.0, assets["user"]["id"], assets["client"]["id"])
+    headers = dict(assets["headers"], transaction_id=tran.id)
+    with count_queries() as statements:
+        ret = mock.post(f"/buy/{assets['user']['id']}/BTC/1.0", headers=headers)
+    assert ret.status_code == 204
+    # read user, lock holding, lock transaction, update holding, update transaction
+    assert len(statements) == AUTH + 5
+    assert not [s for s in statements if s.startswith("UPDATE users")]
+
+
+def test_sell(mock: FlaskClient, assets: dict):
+    headers = dict(assets["headers"], transaction_id=secrets.token_urlsafe())
+    with count_queries() as statements:
+        ret = mock.post(f"/sell/{assets['user']['id']}/BTC/0.01", headers=headers)
+    assert ret.status_code == 204
+    # read user, lock holding, update holding, insert transaction (no duplicate pre-read)
+    assert len(statements) == AUTH + 4
+    assert not [s for s in statements if s.startswith("SELECT transactions")]
+
+
+@pytest.mark.parametrize("size", [1, 50])
+def test_buy_batch(mock: FlaskClient, assets: dict, size: int):
+    users = [send_user(assets["client"]["id"]) for _ in range(size)]
+    items = []
+    for user in users:
+        tran = send_transaction(1.0, user["id"], assets["client"]["id"])
+        items.append({"user_id": user["id"], "symbol": "ETH", "usd_amount": 1.0, "transaction_id": tran.id})
+    with count_queries() as statements:
+        ret = mock.post("/buy/batch", json=items, headers=assets["headers"])
+    assert ret.status_code == 200
+    assert all(r["status"] == 204 for r in ret.get_json())
+    # read owners, lock holdings, lock transactions, update holdings, update transactions
+    assert len(statements) == AUTH + 5
+
+
+@pytest.mark.parametrize("size", [1, 50])
+def test_sell_batch(mock: FlaskClient, assets: dict, size: int):
+    items = [
+        {"user_id": assets["user"]["id"], "symbol": "BTC", "currency_amount": 0.01, "transaction_id": secrets.token_urlsafe()}
+        for _ in range(size)
+    ]
+    with count_queries() as statements:
+        ret = mock.post("/sell/batch", json=items, headers=assets["headers"])
+    assert ret.status_code == 200
+    assert all(r["status"] == 204 for r in ret.get_json())
+    # duplicate check, read owners, lock holdings, update holdings, insert transactions
+    assert len(statements) == AUTH + 5
+
+
+@pytest.mark.parametrize("size", [1, 50])
+def test_balances_many(mock: FlaskClient, assets: dict, size: int):
+    ids = [send_user(assets["client"]["id"], ETH=1.0)["id"] for _ in range(size)]
+    with count_queries() as statements:
+        ret = mock.get(f"/balances?ids={','.join(map(str, ids))}", headers=assets["headers"])
+    assert ret.status_code == 200
+    assert len(ret.get_json()["balances"]) == size
+    assert len(statements) == AUTH + 1
+
+
+@pytest.mark.parametrize("size", [1, 50])
+def test_client_balances(mock: FlaskClient, assets: dict, size: int):
+    for _ in range(size):
+        send_user(assets["client"]["id"], ETH=1.0)
+    with count_queries() as statements:
+        ret = mock.get(f"/clients/{assets['client']['id']}/balances", headers=assets["headers"])
+    assert ret.status_code == 200
+    assert len(ret.get_json()["balances"]) == size + 1
+    assert len(statements) == AUTH + 1
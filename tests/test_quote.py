@@ -0,0 +1,67 @@
+import random
+
+import numpy as np
+from flask.testing import FlaskClient
+
+from project.globals import ACCEPTED_SYMBOLS
+from project.helpers import convert_to_crypto, convert_to_usd
+from project.quotes import QUOTE_RECORD, SYMBOL_CODES
+from project.rates import rate_store
+from tests.helpers import client_headers, fill_mock
+
+URL = "/quote/batch"
+
+
+def basket(size: int) -> list:
+    rand = random.Random(size)
+    return [(rand.choice(ACCEPTED_SYMBOLS), rand.uniform(0.0001, 1_000_000)) for _ in range(size)]
+
+
+# happy path
+def test_quotes_match_scalar_helpers(mock: FlaskClient):
+    assets = fill_mock()
+    items = basket(1000)
+    rows = [{"symbol": s, "amount": a} for s, a in items]
+    columns = {"symbols": [s for s, _ in items], "amounts": [a for _, a in items]}
+    for to, convert in [("usd", convert_to_usd), ("crypto", convert_to_crypto)]:
+        expected = [convert(a, s) for s, a in items]
+        for body in [rows, columns]:
+            ret = mock.post(f"{URL}?to={to}", json=body, headers=client_headers(assets))
+            assert ret.status_code == 200
+            data = ret.get_json()
+            assert data["rate_version"] == rate_store.snapshot.version
+            assert data["quotes"] == expected
+
+
+def test_binary_quotes(mock: FlaskClient):
+    assets = fill_mock()
+    items = basket(1000)
+    records = np.array([(SYMBOL_CODES[s], a) for s, a in items], dtype=QUOTE_RECORD)
+    headers = dict(client_headers(assets), **{"Content-Type": "application/octet-stream"})
+    ret = mock.post(URL, data=records.tobytes(), headers=headers)
+    assert ret.status_code == 200
+    assert ret.headers["X-Rate-Version"] == str(rate_store.snapshot.version)
+    assert np.frombuffer(ret.data, dtype="<f8").tolist() == [convert_to_usd(a, s) for s, a in items]
+
+
+# negative tests
+def test_invalid_quotes(mock: FlaskClient, app):
+    assets = fill_mock()
+    headers = client_headers(assets)
+    for body in [None, [], {"symbols": ["BTC"]}, [{"symbol": "BTC", "amount": "1"}], ["BTC"]]:
+        ret = mock.post(URL, json=body, headers=headers)
+        assert ret.status_code == 400
+    too_many = {"symbols": ["BTC"] * (app.config["QUOTE_MAX_ITEMS"] + 1)}
+    too_many["amounts"] = [1.0] * len(too_many["symbols"])
+    ret = mock.post(URL, json=too_many, headers=headers)
+    assert ret.status_code == 400
+    assert b"quotes are limited" in ret.data
+    ret = mock.post(URL, json=[{"symbol": "WRONG", "amount": 1.0}], headers=headers)
+    assert ret.status_code == 404
+    assert b"'WRONG' is not a valid symbol" in ret.data
+    ret = mock.post(f"{URL}?to=eur", json=[{"symbol": "BTC", "amount": 1.0}], headers=headers)
+    assert ret.status_code == 400
+    binary = dict(headers, **{"Content-Type": "application/octet-stream"})
+    for data in [b"", b"\x00" * 10, np.array([(9, 1.0)], dtype=QUOTE_RECORD).tobytes()]:
+        ret = mock.post(URL, data=data, headers=binary)
+        assert ret.status_code == 400
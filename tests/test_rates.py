@@ -0,0 +1,144 @@
+import json
+import os
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from flask.testing import FlaskClient
+
+from project.app import db
+from project.helpers import convert_to_crypto, convert_to_usd
+from project.models import Transactions, Users
+from project.rates import DEFAULT_RATES, FileFeeder, HTTPFeeder, RateStore, StaticFeeder, rate_store
+from tests.helpers import fill_mock, send_transaction
+
+FEED = {"version": 42, "rates": dict(DEFAULT_RATES, BTC=0.00005)}
+
+
+@pytest.fixture
+def restore_rates():
+    feeder, max_age = rate_store.feeder, rate_store.max_age
+    yield rate_store
+    rate_store.feeder, rate_store.max_age = feeder, max_age
+    rate_store.refresh()
+
+
+def test_file_feeder(temp_dir):
+    path = os.path.join(temp_dir, "rates.json")
+    with open(path, "w") as f:
+        json.dump(FEED, f)
+    store = RateStore()
+    store.feeder = FileFeeder(path)
+    snapshot = store.refresh()
+    assert snapshot.version == 42
+    assert snapshot.rates["BTC"] == 0.00005
+    assert convert_to_crypto(10, "BTC", snapshot) == 10 * 0.00005
+
+
+def test_http_feeder():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(FEED).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        store = RateStore()
+        store.feeder = HTTPFeeder(f"http://127.0.0.1:{server.server_port}/rates")
+        assert store.refresh().version == 42
+    finally:
+        server.shutdown()
+
+
+def test_incomplete_feed_keeps_current_snapshot():
+    store = RateStore()
+    before = store.snapshot
+    store.feeder = StaticFeeder({"BTC": 1.0})
+    with pytest.raises(ValueError):
+        store.refresh()
+    assert store.snapshot is before
+
+
+def test_unversioned_feeds_are_numbered():
+    store = RateStore()
+    first = store.snapshot.version
+    assert store.refresh().version == first + 1
+
+
+def test_snapshots_are_swapped_atomically():
+    store = RateStore()
+    feeds = [StaticFeeder({s: float(n) for s in DEFAULT_RATES}, version=n) for n in range(1, 3)]
+    store.feeder = feeds[0]
+    store.refresh()
+    done = threading.Event()
+    torn = []
+
+    def read():
+        while not done.is_set():
+            snapshot = store.snapshot
+            if set(snapshot.rates.values()) != {float(snapshot.version)}:
+                torn.append(snapshot)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for r in readers:
+        r.start()
+    for n in range(2000):
+        store.feeder = feeds[n % 2]
+        store.refresh()
+    done.set()
+    for r in readers:
+        r.join()
+    assert torn == []
+    with pytest.raises(TypeError):
+        store.snapshot.rates["BTC"] = 1.0
+
+
+def test_trades_record_rate_version(mock: FlaskClient, restore_rates):
+    restore_rates.feeder = StaticFeeder(FEED["rates"], version=7)
+    restore_rates.refresh()
+    assets = fill_mock()
+    tran = send_transaction(10.0, assets["user"]["id"], assets["client"]["id"])
+    headers = {
+        "client_id": assets["client"]["id"],
+        "authorization": assets["client"]["key"],
+        "transaction_id": tran.id,
+    }
+    ret = mock.post(f"/buy/{assets['user']['id']}/BTC/10.0", headers=headers)
+    assert ret.status_code == 204
+    assert Users.query.get(assets["user"]["id"]).BTC == 10.0 * 0.00005
+    headers["transaction_id"] = secrets.token_urlsafe()
+    ret = mock.post(f"/sell/{assets['user']['id']}/BTC/0.0001", headers=headers)
+    assert ret.status_code == 204
+    sale = Transactions.query.filter_by(inc_key=headers["transaction_id"]).one()
+    assert sale.usd_amount == -convert_to_usd(0.0001, "BTC", restore_rates.snapshot)
+    assert [t.rate_version for t in Transactions.query.all()] == [7, 7]
+
+
+def test_stale_rates_stop_trading(mock: FlaskClient, restore_rates):
+    restore_rates.max_age = 0
+    assets = fill_mock()
+    user = Users.query.get(assets["user"]["id"])
+    user.BTC = 1.0
+    db.session.commit()
+    tran_id = send_transaction(10.0, assets["user"]["id"], assets["client"]["id"]).id
+    headers = {
+        "client_id": assets["client"]["id"],
+        "authorization": assets["client"]["key"],
+        "transaction_id": tran_id,
+    }
+    for url in [f"/buy/{assets['user']['id']}/BTC/10.0", f"/sell/{assets['user']['id']}/BTC/0.1"]:
+        ret = mock.post(url, headers=headers)
+        assert ret.status_code == 503
+        assert b"Exchange rates are stale" in ret.data
+    ret = mock.post("/buy/batch", json=[{}], headers=headers)
+    assert ret.status_code == 503
+    assert Transactions.query.get(tran_id).complete is False
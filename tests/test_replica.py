@@ -0,0 +1,108 @@
+import os
+import secrets
+import time
+
+import pytest
+from flask import Flask
+from sqlalchemy.orm import Session
+
+from project.app import create_app, db
+from project.cache import response_cache
+from project.models import Clients, Keys, Users
+from project.replica import replica_fallbacks, replica_reads, replica_router
+
+KEY = secrets.token_urlsafe()
+HEADERS = {"client_id": 1, "authorization": KEY}
+
+
+def seed(engine, btc: float):
+    with Session(engine) as sess:
+        key = Keys(id=1, key=KEY)
+        client = Clients(id=1, name="chase", api_key=key)
+        sess.add_all([key, client, Users(id=1, client=client, BTC=btc, BTC_auth=True)])
+        sess.commit()
+
+
+@pytest.fixture
+def routed(app: Flask, temp_dir):
+    """an app whose replica is a second SQLite file, holding a different (stale) BTC balance"""
+    primary, replica = (os.path.join(temp_dir, f"{name}.db") for name in ("primary", "replica"))
+    for path in (primary, replica):
+        if os.path.exists(path):
+            os.remove(path)
+    routed = create_app(testing=True)
+    routed.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{primary}",
+        REPLICA_DATABASE_URI=f"sqlite:///{replica}",
+        REPLICA_LAG_CHECK_INTERVAL=0,
+        REPLICA_PIN_SECONDS=0.5,
+        RESPONSE_CACHE_ENABLED=False,
+    )
+    replica_router.init_app(routed)
+    response_cache.init_app(routed)
+    db.session.remove()
+    with routed.app_context():
+        for bind, btc in [(None, 1.0), ("replica", 2.0)]:
+            engine = db.get_engine(bind=bind)
+            db.metadata.create_all(engine)
+            seed(engine, btc)
+        yield routed.test_client()
+        db.session.remove()
+    replica_router.init_app(app)
+
+
+def btc(response) -> float:
+    assert response.status_code == 200
+    return response.json["balances"]["BTC"]
+
+
+def test_reads_use_the_replica(routed):
+    reads = replica_reads.value
+    assert btc(routed.get("/balances/1", headers=HEADERS)) == 2.0
+    assert routed.get("/list/1", headers=HEADERS).json["auths"] == ["BTC"]
+    assert routed.get("/balances?ids=1", headers=HEADERS).json["balances"][0]["balances"] == {"BTC": 2.0}
+    assert routed.get("/clients/1/balances", headers=HEADERS).json["balances"][0]["balances"] == {"BTC": 2.0}
+    assert replica_reads.value == reads + 4
+
+
+def test_trading_pins_the_client_to_the_primary(routed):
+    headers = dict(HEADERS, transaction_id=secrets.token_urlsafe())
+    assert routed.post("/sell/1/BTC/100.0", headers=headers).status_code == 401
+    assert btc(routed.get("/balances/1", headers=HEADERS)) == 2.0
+    assert routed.post("/sell/1/BTC/0.25", headers=headers).status_code == 204
+    assert btc(routed.get("/balances/1", headers=HEADERS)) == 0.75
+    time.sleep(0.6)
+    assert btc(routed.get("/balances/1", headers=HEADERS)) == 2.0
+
+
+def test_deposits_pin_the_client_to_the_primary(routed):
+    assert btc(routed.get("/balances/1", headers=HEADERS)) == 2.0
+    deposits = [{"user_id": 1, "usd_amount": 10.0, "client_ref": secrets.token_urlsafe()}]
+    response = routed.post("/deposits/bulk", json=deposits, headers=HEADERS)
+    assert response.json[0]["status"] == 201
+    assert btc(routed.get("/balances/1", headers=HEADERS)) == 1.0
+    time.sleep(0.6)
+    assert btc(routed.get("/balances/1", headers=HEADERS)) == 2.0
+
+
+def test_lagging_replica_falls_back_to_the_primary(routed, monkeypatch):
+    fallbacks = replica_fallbacks.value
+    monkeypatch.setattr(replica_router, "measure_lag", lambda engine: 5.0)
+    assert btc(routed.get("/balances/1", headers=HEADERS)) == 1.0
+
+    def unreachable(engine):
+        raise ConnectionError
+
+    monkeypatch.setattr(replica_router, "measure_lag", unreachable)
+    assert btc(routed.get("/balances/1", headers=HEADERS)) == 1.0
+    assert replica_fallbacks.value == fallbacks + 2
+    monkeypatch.setattr(replica_router, "measure_lag", lambda engine: 0.5)
+    assert btc(routed.get("/balances/1", headers=HEADERS)) == 2.0
+
+
+def test_replica_reads_are_not_cached(routed, monkeypatch):
+    monkeypatch.setattr(response_cache, "enabled", True)
+    assert btc(routed.get("/balances/1", headers=HEADERS)) == 2.0
+    # the primary's user has the same version, so a cached replica body would be served
+    monkeypatch.setattr(replica_router, "enabled", False)
+    assert btc(routed.get("/balances/1", headers=HEADERS)) == 1.0
@@ -179,3 +179,35 @@ def test_user_is_not_authorized_for_currency(mock: FlaskClient):
     not_auth = mock.post(url, headers=headers)
     assert not_auth.status_code == 401
     assert b"not authorized to purchase" in not_auth.data
+
+def test_duplicate_transaction_keeps_holding(mock: FlaskClient):
+    print('test_duplicate_transaction_keeps_holding')
+    assets = fill_mock()
+    user = Users.query.get(assets["user"]["id"])
+    user.BTC = 1.0
+    db.session.commit()
+    headers = {
+        "client_id": assets["client"]["id"],
+        "authorization": assets["client"]["key"],
+        "transaction_id": secrets.token_urlsafe()
+    }
+    url = f"/sell/{assets['user']['id']}/BTC/{.25}"
+    assert mock.post(url, headers=headers).status_code == 204
+    assert mock.post(url, headers=headers).status_code == 401
+    assert Users.query.get(assets["user"]["id"]).BTC == 0.75
+
+def test_same_transaction_id_for_other_client(mock: FlaskClient):
+    print('test_same_transaction_id_for_other_client')
+    transaction_id = secrets.token_urlsafe()
+    for _ in range(2):
+        assets = fill_mock()
+        user = Users.query.get(assets["user"]["id"])
+        user.BTC = 1.0
+        db.session.commit()
+        headers = {
+            "client_id": assets["client"]["id"],
+            "authorization": assets["client"]["key"],
+            "transaction_id": transaction_id
+        }
+        url = f"/sell/{assets['user']['id']}/BTC/{.25}"
+        assert mock.post(url, headers=headers).status_code == 204
@@ -0,0 +1,113 @@
+import secrets
+
+from flask.testing import FlaskClient
+
+from project.app import db
+from project.helpers import convert_to_crypto, convert_to_usd
+from project.models import Holdings, Transactions, Users
+from tests.helpers import client_headers, fill_mock, send_transaction, send_user
+
+URL = "/sell/batch"
+
+
+def fund(user_id: int, symbol: str, usd: float) -> float:
+    user = Users.query.with_for_update().get(user_id)
+    setattr(user, symbol, convert_to_crypto(usd, symbol))
+    db.session.commit()
+    return getattr(user, symbol)
+
+
+# happy path
+def test_client_can_sell_in_batch(mock: FlaskClient):
+    assets = fill_mock()
+    second = send_user(assets["client"]["id"])
+    start = {uid: fund(uid, "BTC", 1_000_000.0) for uid in [assets["user"]["id"], second["id"]]}
+    items = [
+        {"user_id": uid, "symbol": "BTC", "currency_amount": amount, "transaction_id": secrets.token_urlsafe()}
+        for uid in start
+        for amount in [0.01, 0.5, 1]
+    ]
+    ret = mock.post(URL, json=items, headers=client_headers(assets))
+    assert ret.status_code == 200
+    results = ret.get_json()
+    assert [r["transaction_id"] for r in results] == [i["transaction_id"] for i in items]
+    assert all(r["status"] == 204 for r in results)
+    for uid, amount in start.items():
+        assert Users.query.get(uid).BTC == amount - 0.01 - 0.5 - 1
+    orders = Transactions.query.order_by(Transactions.id).all()
+    assert [o.inc_key for o in orders] == [i["transaction_id"] for i in items]
+    assert orders[0].usd_amount == -convert_to_usd(0.01, "BTC")
+    assert all(o.client_id == assets["client"]["id"] for o in orders)
+
+
+def test_failed_orders_do_not_abort_batch(mock: FlaskClient):
+    assets = fill_mock()
+    other = fill_mock()
+    start = fund(assets["user"]["id"], "BTC", 10.0)
+    unauthorized = send_user(assets["client"]["id"], ETH=1.0, ETH_auth=False)
+    used = secrets.token_urlsafe()
+    send_transaction(-1.0, assets["user"]["id"], assets["client"]["id"], inc_key=used)
+    repeated = secrets.token_urlsafe()
+    uid = assets["user"]["id"]
+    items = [
+        {"user_id": uid, "symbol": "BTC", "currency_amount": start / 2, "transaction_id": repeated},
+        {"user_id": uid, "symbol": "BTC", "currency_amount": start / 2, "transaction_id": repeated},
+        {"user_id": uid, "symbol": "BTC", "currency_amount": start / 2, "transaction_id": used},
+        {"user_id": uid, "symbol": "BTC", "currency_amount": start, "transaction_id": secrets.token_urlsafe()},
+        {"user_id": uid, "symbol": "WRONG", "currency_amount": 1.0, "transaction_id": secrets.token_urlsafe()},
+        {"user_id": unauthorized["id"], "symbol": "ETH", "currency_amount": 1.0, "transaction_id": secrets.token_urlsafe()},
+        {"user_id": other["user"]["id"], "symbol": "BTC", "currency_amount": 1.0, "transaction_id": secrets.token_urlsafe()},
+        {"user_id": 10_000, "symbol": "BTC", "currency_amount": 1.0, "transaction_id": secrets.token_urlsafe()},
+        {"user_id": uid, "symbol": "BTC", "currency_amount": 1.0, "transaction_id": 5},
+    ]
+    ret = mock.post(URL, json=items, headers=client_headers(assets))
+    assert ret.status_code == 200
+    results = ret.get_json()
+    assert [r["status"] for r in results] == [204, 401, 401, 401, 404, 401, 401, 404, 400]
+    assert results[1]["message"] == "Sell order already submitted"
+    assert results[2]["message"] == "Sell order already submitted"
+    assert "Insufficient BTC" in results[3]["message"]
+    assert "not authorized to purchase" in results[5]["message"]
+    assert results[6]["message"] == "unauthorized client"
+    assert Users.query.get(uid).BTC == start - start / 2
+    assert Transactions.query.filter_by(inc_key=repeated).count() == 1
+
+
+# negative tests
+def test_invalid_body(mock: FlaskClient):
+    assets = fill_mock()
+    for body in [None, {}, [], {"user_id": 1}]:
+        ret = mock.post(URL, json=body, headers=client_headers(assets))
+        assert ret.status_code == 400
+
+
+def test_concurrent_duplicate_is_rejected(mock: FlaskClient, monkeypatch):
+    assets = fill_mock()
+    uid, client_id = assets["user"]["id"], assets["client"]["id"]
+    start = fund(uid, "BTC", 10.0)
+    lock_many = Holdings.lock_many.__func__
+
+    def lock_then_race(cls, keys):
+        # another batch with the same transaction_id inserts it once this one has started
+        Transactions.create(-1.0, uid, client_id, "raced")
+        db.session.flush()
+        return lock_many(cls, keys)
+
+    monkeypatch.setattr(Holdings, "lock_many", classmethod(lock_then_race))
+    # the other batch's INSERT isn't this one's to count
+    monkeypatch.setitem(mock.application.config, "QUERY_BUDGET", "off")
+    items = [
+        {"user_id": uid, "symbol": "BTC", "currency_amount": start / 4, "transaction_id": "first"},
+        {"user_id": uid, "symbol": "BTC", "currency_amount": start / 2, "transaction_id": "raced"},
+        {"user_id": uid, "symbol": "BTC", "currency_amount": start / 8, "transaction_id": "last"},
+    ]
+    ret = mock.post(URL, json=items, headers=client_headers(assets))
+    assert ret.status_code == 200
+    assert ret.get_json() == [
+        {"transaction_id": "first", "status": 204},
+        {"transaction_id": "raced", "status": 401, "message": "Sell order already submitted"},
+        {"transaction_id": "last", "status": 204},
+    ]
+    # only the inserted orders were debited
+    assert Users.query.get(uid).BTC == start - start / 4 - start / 8
+    assert Transactions.query.filter_by(inc_key="raced").one().usd_amount == -1.0
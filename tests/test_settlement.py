@@ -0,0 +1,173 @@
+import threading
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from project.app import db
+from project.helpers import convert_to_crypto, db_session, user_change_listeners
+from project.metrics import settlement_orders
+from project.models import Orders, Transactions, Users
+from project.rates import rate_store
+from project.settlement import settle_batch, work
+from tests.helpers import bound_parameters, send_client, send_key, send_transaction, send_user
+
+
+@pytest.fixture
+def assets(assets: dict, app: Flask, monkeypatch):
+    monkeypatch.setitem(app.config, "TRADE_SETTLEMENT", "queued")
+    user = Users.query.get(assets["user"]["id"])
+    user.BTC = convert_to_crypto(1_000.00, "BTC")
+    db.session.commit()
+    return assets
+
+
+class StopWhenIdle(threading.Event):
+    """stops `work` the first time it waits for orders"""
+
+    def wait(self, timeout=None):
+        self.set()
+        return True
+
+
+def settle(batch_size: int = 100) -> int:
+    with db_session() as sess:
+        return settle_batch(sess, batch_size)
+
+
+def test_orders_are_queued(mock: FlaskClient, assets: dict):
+    user_id = assets["user"]["id"]
+    deposit = send_transaction(10.0, user_id, assets["client"]["id"]).id
+    headers = dict(assets["headers"], transaction_id=str(deposit))
+    response = mock.post(f"/buy/{user_id}/ETH/10.0", headers=headers)
+    assert response.status_code == 202
+    order_id = response.get_json()["order_id"]
+    assert response.get_json() == {"order_id": order_id, "status": "queued"}
+    assert response.headers["Location"] == f"/orders/{order_id}"
+    # nothing is traded until a worker settles the order
+    assert Users.query.get(user_id).ETH == 0.0
+    status = mock.get(f"/orders/{order_id}", headers=assets["headers"]).get_json()
+    assert status["status"] == "queued"
+    assert status["settled_at"] is None
+
+    # resending the order finds the queued one
+    assert mock.post(f"/buy/{user_id}/ETH/10.0", headers=headers).get_json()["order_id"] == order_id
+
+    with bound_parameters("FROM transactions") as parameters:
+        assert settle() == 1
+    assert [type(value) for value in parameters[0]] == [int]
+    assert Users.query.get(user_id).ETH == convert_to_crypto(10.0, "ETH")
+    assert db.session.get(Transactions, deposit).complete
+    status = mock.get(f"/orders/{order_id}", headers=assets["headers"]).get_json()
+    assert status == dict(
+        status,
+        order_id=order_id,
+        side="buy",
+        user_id=user_id,
+        symbol="ETH",
+        usd_amount=10.0,
+        transaction_id=str(deposit),
+        status="settled",
+        settled_transaction_id=deposit,
+        error=None,
+    )
+    assert status["settled_at"] is not None
+    # and once settled, resending it doesn't queue it again
+    response = mock.post(f"/buy/{user_id}/ETH/10.0", headers=headers)
+    assert response.get_json() == {"order_id": order_id, "status": "settled"}
+    assert settle() == 0
+
+
+def test_failed_orders_dont_undo_the_batch(mock: FlaskClient, assets: dict, monkeypatch):
+    user_id, client_id = assets["user"]["id"], assets["client"]["id"]
+    changed = []
+    monkeypatch.setattr(
+        "project.helpers.user_change_listeners",
+        user_change_listeners + [lambda client_id, user_ids: changed.append(user_ids)],
+    )
+    other = send_user(client_id=client_id, BTC=convert_to_crypto(1.0, "BTC"))
+    orders = []
+    for url, user, transaction_id in [
+        (f"/sell/{user_id}/BTC/0.01", user_id, "s-1"),
+        (f"/sell/{other['id']}/BTC/1.0", other["id"], "s-2"),  # more than they own
+        (f"/sell/{user_id}/BTC/0.005", user_id, "s-3"),
+        (f"/buy/{user_id}/ETH/5.0", user_id, "0"),  # no such deposit
+    ]:
+        headers = dict(assets["headers"], transaction_id=transaction_id)
+        orders.append(mock.post(url, headers=headers).get_json()["order_id"])
+    assert settle() == 4
+
+    statuses = [mock.get(f"/orders/{i}", headers=assets["headers"]).get_json() for i in orders]
+    assert [status["status"] for status in statuses] == ["settled", "failed", "settled", "failed"]
+    assert statuses[1]["error"]["status"] == 401
+    assert statuses[1]["error"]["message"].startswith("Insufficient BTC")
+    assert statuses[3]["error"] == {"status": 401, "message": "Transaction not found"}
+    assert statuses[0]["currency_amount"] == 0.01
+    user = Users.query.get(user_id)
+    assert user.BTC == pytest.approx(convert_to_crypto(1_000.00, "BTC") - 0.015)
+    assert Users.query.get(other["id"]).BTC == convert_to_crypto(1.0, "BTC")
+    sells = Transactions.query.filter(Transactions.inc_key.in_(["s-1", "s-2", "s-3"])).all()
+    assert sorted(sell.inc_key for sell in sells) == ["s-1", "s-3"]
+    # only the settled orders' users changed, once the batch committed
+    assert changed == [[user_id], [user_id]]
+
+
+def test_enqueue_checks(mock: FlaskClient, assets: dict):
+    user_id = assets["user"]["id"]
+    headers = dict(assets["headers"], transaction_id="x")
+    assert mock.post(f"/sell/{user_id}/XYZ/1.0", headers=headers).status_code == 404
+    assert mock.post(f"/sell/{user_id + 1000}/BTC/1.0", headers=headers).status_code == 404
+    other = send_user(client_id=send_client("other", send_key()["id"])["id"])
+    response = mock.post(f"/sell/{other['id']}/BTC/1.0", headers=headers)
+    assert response.status_code == 401
+    assert mock.post(f"/sell/{user_id}/BTC/1.0", headers=assets["headers"]).status_code == 400
+    # a buy's transaction_id must be a deposit id
+    response = mock.post(f"/buy/{user_id}/ETH/1.0", headers=headers)
+    assert (response.status_code, response.get_json()["message"]) == (401, "Transaction not found")
+    assert Orders.query.count() == 0
+
+    order_id = mock.post(f"/sell/{user_id}/BTC/1.0", headers=headers).get_json()["order_id"]
+    assert mock.get(f"/orders/{order_id + 1}", headers=assets["headers"]).status_code == 404
+    theirs = Orders(
+        side="sell",
+        user_id=other["id"],
+        client_id=other["client_id"],
+        symbol="BTC",
+        amount=1.0,
+        transaction_id="x",
+    )
+    db.session.add(theirs)
+    db.session.commit()
+    assert mock.get(f"/orders/{theirs.id}", headers=assets["headers"]).status_code == 401
+
+
+def test_stale_rates_leave_orders_queued(mock: FlaskClient, assets: dict):
+    user_id = assets["user"]["id"]
+    headers = dict(assets["headers"], transaction_id="s-1")
+    order_id = mock.post(f"/sell/{user_id}/BTC/0.01", headers=headers).get_json()["order_id"]
+    max_age = rate_store.max_age
+    rate_store.max_age = 0
+    try:
+        assert settle() == 0
+    finally:
+        rate_store.max_age = max_age
+    assert db.session.get(Orders, order_id).status == "queued"
+    assert settle() == 1
+
+
+def test_worker_and_metrics(mock: FlaskClient, assets: dict, app: Flask):
+    user_id = assets["user"]["id"]
+    for n in range(3):
+        headers = dict(assets["headers"], transaction_id=f"s-{n}")
+        assert mock.post(f"/sell/{user_id}/BTC/0.005", headers=headers).status_code == 202
+    metrics = mock.get("/metrics").get_data(as_text=True)
+    assert "settlement_queue_depth 3" in metrics
+    assert "settlement_queue_lag_seconds " in metrics
+
+    settled = settlement_orders.labels("sell", "settled").value
+    # batches of two, until the worker finds the queue empty
+    work(app, StopWhenIdle(), batch_size=2, poll_interval=0.01)
+    assert settlement_orders.labels("sell", "settled").value == settled + 3
+    metrics = mock.get("/metrics").get_data(as_text=True)
+    assert "settlement_queue_depth 0" in metrics
+    assert "settlement_queue_lag_seconds 0.0" in metrics
@@ -0,0 +1,143 @@
+import time
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from project.app import db
+from project.helpers import convert_to_crypto
+from project.models import Transactions, Users
+from project.sockets import NAMESPACE, socketio
+from tests.helpers import bound_parameters, send_client, send_key, send_transaction, send_user
+
+
+@pytest.fixture
+def assets(assets: dict):
+    user = Users.query.get(assets["user"]["id"])
+    user.BTC = convert_to_crypto(1_000.00, "BTC")
+    db.session.commit()
+    return assets
+
+
+@pytest.fixture
+def orders(app: Flask, assets: dict):
+    client = socketio.test_client(app, namespace=NAMESPACE, auth=assets["headers"])
+    yield client
+    if client.is_connected(NAMESPACE):
+        client.disconnect(NAMESPACE)
+
+
+def received(client, name: str, timeout: float = 2.0) -> list:
+    """the `name` events sent to `client`, waiting for the background tasks that send them"""
+    deadline = time.monotonic() + timeout
+    events = []
+    while not events and time.monotonic() < deadline:
+        events = [e for e in client.get_received(NAMESPACE) if e["name"] == name]
+        time.sleep(0.01)
+    return [e["args"][0] for e in events]
+
+
+def test_connect_authenticates_once(app: Flask, assets: dict):
+    assert socketio.test_client(app, namespace=NAMESPACE, auth=assets["headers"]).is_connected(NAMESPACE)
+    # the same credentials work as headers
+    headers = {"client_id": str(assets["client"]["id"]), "authorization": assets["client"]["key"]}
+    assert socketio.test_client(app, namespace=NAMESPACE, headers=headers).is_connected(NAMESPACE)
+    wrong = dict(assets["headers"], authorization="wrong")
+    assert not socketio.test_client(app, namespace=NAMESPACE, auth=wrong).is_connected(NAMESPACE)
+    missing = {"client_id": assets["client"]["id"]}
+    assert not socketio.test_client(app, namespace=NAMESPACE, auth=missing).is_connected(NAMESPACE)
+
+
+def test_pipelined_orders(orders, assets: dict):
+    user_id, client_id = assets["user"]["id"], assets["client"]["id"]
+    deposits = [send_transaction(1.0, user_id, client_id).id for _ in range(3)]
+    acks = [
+        orders.emit(
+            "buy",
+            {"user_id": user_id, "symbol": "ETH", "usd_amount": 1.0, "transaction_id": deposit},
+            namespace=NAMESPACE,
+            callback=True,
+        )
+        for deposit in deposits
+    ]
+    assert acks == [{"transaction_id": d, "status": 204, "order_id": d} for d in deposits]
+    ack = orders.emit(
+        "sell",
+        {"user_id": user_id, "symbol": "BTC", "currency_amount": 0.01, "transaction_id": "s-1"},
+        namespace=NAMESPACE,
+        callback=True,
+    )
+    assert ack["status"] == 204
+    order = db.session.get(Transactions, ack["order_id"])
+    assert order.inc_key == "s-1" and order.usd_amount < 0
+    user = Users.query.get(user_id)
+    assert user.ETH == convert_to_crypto(3.0, "ETH")
+
+
+def test_orders_have_route_semantics(orders, assets: dict):
+    user_id = assets["user"]["id"]
+    deposit = send_transaction(1.0, user_id, assets["client"]["id"]).id
+    buy = {"user_id": user_id, "symbol": "ETH", "usd_amount": 1.0, "transaction_id": deposit}
+    assert orders.emit("buy", buy, namespace=NAMESPACE, callback=True)["status"] == 204
+    # the deposit is spent
+    assert orders.emit("buy", buy, namespace=NAMESPACE, callback=True)["status"] == 401
+    sell = {"user_id": user_id, "symbol": "BTC", "currency_amount": 0.01, "transaction_id": "dup"}
+    assert orders.emit("sell", sell, namespace=NAMESPACE, callback=True)["status"] == 204
+    assert orders.emit("sell", sell, namespace=NAMESPACE, callback=True) == {
+        "transaction_id": "dup",
+        "status": 401,
+        "message": "Sell order already submitted",
+    }
+    invalid = dict(sell, symbol="XYZ", transaction_id="x")
+    assert orders.emit("sell", invalid, namespace=NAMESPACE, callback=True)["status"] == 404
+    missing = orders.emit("buy", {"user_id": user_id}, namespace=NAMESPACE, callback=True)
+    assert missing["status"] == 400
+    unknown = dict(buy, user_id=user_id + 1000)
+    assert orders.emit("buy", unknown, namespace=NAMESPACE, callback=True)["status"] == 404
+    other = send_user(client_id=send_client("other", send_key()["id"])["id"])
+    theirs = dict(sell, user_id=other["id"], transaction_id="theirs")
+    assert orders.emit("sell", theirs, namespace=NAMESPACE, callback=True) == {
+        "transaction_id": "theirs",
+        "status": 401,
+        "message": "unauthorized client",
+    }
+
+
+def test_deposit_ids_are_bound_as_integers(orders, assets: dict):
+    user_id = assets["user"]["id"]
+    deposit = send_transaction(1.0, user_id, assets["client"]["id"]).id
+    buy = {"user_id": user_id, "symbol": "ETH", "usd_amount": 1.0, "transaction_id": 2**40}
+    with bound_parameters("FROM transactions") as parameters:
+        ack = orders.emit("buy", buy, namespace=NAMESPACE, callback=True)
+        assert (ack["status"], ack["message"]) == (401, "Transaction not found")
+        assert parameters == []
+        buy["transaction_id"] = deposit
+        assert orders.emit("buy", buy, namespace=NAMESPACE, callback=True)["status"] == 204
+    assert [type(value) for value in parameters[0]] == [int]
+
+
+def test_balance_events(orders, mock: FlaskClient, assets: dict):
+    user_id, client_id = assets["user"]["id"], assets["client"]["id"]
+    other = send_user(client_id=send_client("other", send_key()["id"])["id"])
+    ack = orders.emit(
+        "subscribe", {"user_ids": [user_id, other["id"], 0]}, namespace=NAMESPACE, callback=True
+    )
+    assert ack == {"subscribed": [user_id], "not_found": [0], "unauthorized": [other["id"]]}
+
+    # trades from any route are pushed
+    headers = dict(assets["headers"], transaction_id="http-sell")
+    assert mock.post(f"/sell/{user_id}/BTC/0.01", headers=headers).status_code == 204
+    expected = mock.get(f"/balances/{user_id}", headers=assets["headers"]).get_json()
+    assert received(orders, "balance") == [expected]
+
+    deposit = send_transaction(1.0, user_id, client_id).id
+    buy = {"user_id": user_id, "symbol": "ETH", "usd_amount": 1.0, "transaction_id": deposit}
+    assert orders.emit("buy", buy, namespace=NAMESPACE, callback=True)["status"] == 204
+    [event] = received(orders, "balance")
+    assert event["balances"]["ETH"] == convert_to_crypto(1.0, "ETH")
+
+    ack = orders.emit("unsubscribe", {"user_ids": [user_id]}, namespace=NAMESPACE, callback=True)
+    assert ack == {"unsubscribed": [user_id]}
+    headers["transaction_id"] = "after-unsubscribe"
+    assert mock.post(f"/sell/{user_id}/BTC/0.01", headers=headers).status_code == 204
+    assert received(orders, "balance", timeout=0.2) == []
@@ -0,0 +1,126 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from project.app import db
+from project.models import Transactions
+from tests.helpers import send_client, send_key, send_transaction, send_user
+
+START = datetime(2026, 1, 1)
+
+
+def add_history(user_id: int, client_id: int, count: int) -> list:
+    """transactions an hour apart from START, two at a time sharing an inc_time"""
+    rows = [
+        Transactions(
+            usd_amount=float(n + 1),
+            user_id=user_id,
+            client_id=client_id,
+            inc_time=START + timedelta(hours=n // 2),
+            complete=n % 3 == 0,
+        )
+        for n in range(count)
+    ]
+    db.session.add_all(rows)
+    db.session.commit()
+    return [row.id for row in rows]
+
+
+def test_inc_time_is_the_insert_time(assets: dict):
+    first = send_transaction(1.0, assets["user"]["id"], assets["client"]["id"])
+    time.sleep(0.01)
+    second = send_transaction(1.0, assets["user"]["id"], assets["client"]["id"])
+    assert first.inc_time < second.inc_time
+
+
+def test_keyset_pages(mock: FlaskClient, assets: dict):
+    ids = add_history(assets["user"]["id"], assets["client"]["id"], 25)
+    other = send_user(client_id=send_client("other", send_key()["id"])["id"])
+    add_history(other["id"], other["client_id"], 5)
+    seen, after, pages = [], None, 0
+    while True:
+        query = {"limit": 10, **({"after": after} if after else {})}
+        response = mock.get("/transactions", query_string=query, headers=assets["headers"])
+        assert response.status_code == 200
+        body = response.get_json()
+        seen += [row["id"] for row in body["transactions"]]
+        pages += 1
+        after = body["next"]
+        if after is None:
+            break
+    assert seen == ids
+    assert pages == 3
+    assert body["transactions"][-1] == {
+        "id": ids[-1],
+        "user_id": assets["user"]["id"],
+        "usd_amount": 25.0,
+        "inc_key": None,
+        "client_ref": None,
+        "inc_time": "2026-01-01T12:00:00",
+        "complete": True,
+        "complete_time": None,
+        "rate_version": None,
+    }
+
+
+def test_filters(mock: FlaskClient, assets: dict):
+    ids = add_history(assets["user"]["id"], assets["client"]["id"], 10)
+    other = send_user(client_id=assets["client"]["id"])
+    theirs = add_history(other["id"], assets["client"]["id"], 2)
+
+    def listed(**query):
+        response = mock.get("/transactions", query_string=query, headers=assets["headers"])
+        assert response.status_code == 200
+        return [row["id"] for row in response.get_json()["transactions"]]
+
+    # the first hour's transactions of both users, in id order, then the rest
+    assert listed() == ids[:2] + theirs + ids[2:]
+    assert listed(user_id=other["id"]) == theirs
+    assert listed(user_id=assets["user"]["id"], complete="true") == [ids[0], ids[3], ids[6], ids[9]]
+    since, until = "2026-01-01T01:00:00", "2026-01-01T03:00:00"
+    assert listed(user_id=assets["user"]["id"], since=since, until=until) == ids[2:6]
+    # times with an offset are converted to UTC
+    assert listed(user_id=assets["user"]["id"], since="2026-01-01T05:00:00+01:00") == ids[8:]
+
+
+def test_ndjson_stream(mock: FlaskClient, assets: dict, app: Flask, monkeypatch):
+    ids = add_history(assets["user"]["id"], assets["client"]["id"], 25)
+    monkeypatch.setitem(app.config, "STREAM_YIELD_PER", 4)
+    response = mock.get("/transactions?format=ndjson", headers=assets["headers"])
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert response.is_streamed
+    lines = response.get_data().splitlines()
+    assert [json.loads(line)["id"] for line in lines] == ids
+
+    # a stream resumes from its last line
+    headers = dict(assets["headers"], Accept="application/x-ndjson")
+    last = json.loads(lines[19])
+    response = mock.get(
+        "/transactions",
+        query_string={"after": f"{last['inc_time']},{last['id']}", "limit": 3},
+        headers=headers,
+    )
+    assert [json.loads(line)["id"] for line in response.get_data().splitlines()] == ids[20:23]
+
+
+@pytest.mark.parametrize(
+    "query,message",
+    [
+        ({"user_id": "x"}, "'user_id' must be a user id"),
+        ({"since": "yesterday"}, "'since' must be an ISO 8601 time"),
+        ({"complete": "yes"}, "'complete' must be true or false"),
+        ({"after": "2026-01-01T00:00:00"}, "'after' must be a cursor from a previous page"),
+        ({"limit": 0}, "'limit' must be between 1 and 5000"),
+        ({"limit": 5001}, "'limit' must be between 1 and 5000"),
+        ({"format": "csv"}, "'format' must be 'json' or 'ndjson'"),
+    ],
+)
+def test_invalid_parameters(mock: FlaskClient, assets: dict, query: dict, message: str):
+    response = mock.get("/transactions", query_string=query, headers=assets["headers"])
+    assert response.status_code == 400
+    assert response.get_json()["message"] == message